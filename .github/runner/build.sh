@@ -4,12 +4,85 @@ export TOOLS_DIR="/opt/work/tools/"
 export PATH="$TOOLS_DIR:$PATH"
 cd /opt/work/build/
 
+# VC6_GENERATOR selects the CMake generator, "Unix Makefiles" or "Ninja".
+GENERATOR="${VC6_GENERATOR:-Unix Makefiles}"
+
+# Build-wide state written by the proxies
+STATE_DIR=/opt/work/build/.vc6
+mkdir -p "$STATE_DIR"
+export VC6_METRICS="${VC6_METRICS:-$STATE_DIR/metrics.jsonl}"
+rm -f "$VC6_METRICS"
+# Translated CL flag sets, shared as response files by the TUs of a target
+export VC6_FLAGS_CACHE="${VC6_FLAGS_CACHE:-$STATE_DIR/flags}"
+rm -rf "$VC6_FLAGS_CACHE"
+# Temporaries left in the scratch area (vc6prefix.py scratch) by jobs that
+# were killed or crashed in an earlier build
+if [ -n "$VC6_SCRATCH_DIR" ] && [ -d "$VC6_SCRATCH_DIR" ]; then
+    find "$VC6_SCRATCH_DIR" -mindepth 1 -delete
+    mkdir -p "$VC6_SCRATCH_DIR/tmp"
+fi
+# Per-invocation profiles of an earlier build would be merged into this one
+[ -n "$VC6_PROFILE" ] && rm -f "$VC6_PROFILE"/*.prof "$VC6_PROFILE"/*.stacks
+# The history database is kept across builds that reuse the build dir
+export VC6_HISTORY_DB="${VC6_HISTORY_DB:-$STATE_DIR/history.db}"
+export VC6_BUILD_ID="${VC6_BUILD_ID:-$(date +%Y%m%d-%H%M%S)-$(git -C /opt/work/repo rev-parse --short HEAD 2>/dev/null)}"
+
+# VC6_WINE_SLOTS=auto lets the proxies tune how many Wine jobs run at once
+# to the most work completed per second (jobs weighted by their typical
+# duration in the history DB), starting from the limit learned on this
+# hardware by earlier builds; "vc6tune.py report" keeps this build's best.
+# make runs more jobs than the tuner's ceiling so it always has jobs queued
+# to admit.
+JOBS=$(nproc)
+if [ "$VC6_WINE_SLOTS" = "auto" ]; then
+    export VC6_TUNE_FILE="${VC6_TUNE_FILE:-$STATE_DIR/tune.json}"
+    export VC6_WINE_SLOTS_MAX="${VC6_WINE_SLOTS_MAX:-$((2 * $(nproc)))}"
+    JOBS=$((VC6_WINE_SLOTS_MAX + 2))
+    python3 "$TOOLS_DIR/vc6tune.py" start
+fi
+
+# VC6_STATUS_PORT=<port> serves live build status from the proxies' job
+# events, with Prometheus counters at /metrics. It listens on localhost
+# unless VC6_STATUS_BIND says otherwise (0.0.0.0 for the farm monitoring).
+if [ -n "$VC6_STATUS_PORT" ]; then
+    export VC6_STATUS_SOCKET="$STATE_DIR/status.sock"
+    python3 "$TOOLS_DIR/vc6status.py" --socket "$VC6_STATUS_SOCKET" --port "$VC6_STATUS_PORT" --bind "${VC6_STATUS_BIND:-127.0.0.1}" &
+    STATUS_PID=$!
+fi
+
 cmake -DCMAKE_TOOLCHAIN_FILE="/opt/work/vc6-toolchain.cmake" \
       -DCMAKE_BUILD_TYPE=Release \
       -DCMAKE_EXPORT_COMPILE_COMMANDS=ON \
       -DCMAKE_MSVC_RUNTIME_LIBRARY="MultiThreaded$<$<CONFIG:Debug>:Debug>DLL" \
       -DTHYME_FLAGS="/W3" \
-      -G "Unix Makefiles" \
+      -G "$GENERATOR" \
       /opt/work/repo
 
-cmake --build . -j $(nproc)
\ No newline at end of file
+# VC6_BUILD_DRIVER=1 schedules the compile and link jobs with the
+# critical-path driver instead of make. It reads the Makefile link
+# scripts, so it is only available with the Unix Makefiles generator.
+# VC6_AFFECTED_BASE=<git rev> only builds the TUs, libraries and executables
+# affected by the changes since that revision, using the same driver.
+# VC6_BUILD_SEED names a cached previous build dir to take unchanged outputs from.
+# VC6_FIRST_ERROR=<git rev> makes the driver compile the TUs that reach files
+# changed since that revision, or failed in the previous build, first.
+if [ -n "$VC6_AFFECTED_BASE" ] && [ "$GENERATOR" = "Unix Makefiles" ]; then
+    python3 "$TOOLS_DIR/vc6affected.py" --base "$VC6_AFFECTED_BASE" ${VC6_BUILD_SEED:+--seed "$VC6_BUILD_SEED"} --build -j $JOBS ${VC6_FIRST_ERROR:+--first-error --changed-since "$VC6_FIRST_ERROR"} .
+elif [ "${VC6_BUILD_DRIVER:-0}" = "1" ] && [ "$GENERATOR" = "Unix Makefiles" ]; then
+    python3 "$TOOLS_DIR/vc6build.py" -j $JOBS ${VC6_FIRST_ERROR:+--first-error --changed-since "$VC6_FIRST_ERROR"} .
+else
+    cmake --build . -j $JOBS
+fi
+BUILD_RESULT=$?
+[ -n "$STATUS_PID" ] && kill "$STATUS_PID"
+
+python3 "$TOOLS_DIR/vc6metrics.py" "$VC6_METRICS"
+python3 "$TOOLS_DIR/vc6history.py" compare
+[ "$VC6_WINE_SLOTS" = "auto" ] && python3 "$TOOLS_DIR/vc6tune.py" report
+# VC6_PROFILE=<dir> profiles every proxy invocation; merge them into one profile
+# and a collapsed-stack file for flame graphs.
+if [ -n "$VC6_PROFILE" ]; then
+    python3 "$TOOLS_DIR/vc6profile.py" --top 20 --pstats "$VC6_PROFILE/build.pstats" --collapsed "$VC6_PROFILE/build.collapsed" "$VC6_PROFILE"
+fi
+
+exit $BUILD_RESULT
\ No newline at end of file
@@ -4,6 +4,36 @@ Xvfb :0 -screen 0 1x1x8 &
 
 export TEMP="C:\windows\temp"
 
+# Boot the Wine prefix once on tmpfs with a persistent wineserver so the
+# proxy jobs don't each pay Wine's cold start. VC6_WARM_PREFIX=0 disables it;
+# if it can't be set up the build falls back to the image's prefix.
+if [ "${VC6_WARM_PREFIX:-1}" = "1" ]; then
+    VC6_RAMDISK="${VC6_RAMDISK:-/dev/shm/vc6}"
+    if python3 /opt/work/tools/vc6prefix.py --ram-dir "$VC6_RAMDISK" prepare; then
+        . "$VC6_RAMDISK/env.sh"
+    fi
+fi
+
+# Keep proxy and compiler temporaries (batch files, response files, CL.EXE
+# intermediates) on tmpfs, exposed to Wine as T:. VC6_SCRATCH=0 disables it.
+if [ "${VC6_SCRATCH:-1}" = "1" ]; then
+    VC6_RAMDISK="${VC6_RAMDISK:-/dev/shm/vc6}"
+    if python3 /opt/work/tools/vc6prefix.py --ram-dir "$VC6_RAMDISK" scratch; then
+        . "$VC6_RAMDISK/scratch.sh"
+    fi
+fi
+
+# Compile sources from the repo and build dirs through a case-exact view on
+# S: so Wine doesn't list large include directories on every header open.
+# Opt-in with VC6_CASE_VIEW=1: every TU pays a Python include scan to fill
+# the view, and the saving hasn't been measured on this repo yet.
+if [ "${VC6_CASE_VIEW:-0}" = "1" ]; then
+    VC6_RAMDISK="${VC6_RAMDISK:-/dev/shm/vc6}"
+    if python3 /opt/work/tools/vc6prefix.py --ram-dir "$VC6_RAMDISK" view --root /opt/work/repo --root /opt/work/build; then
+        . "$VC6_RAMDISK/view.sh"
+    fi
+fi
+
 ln -s /opt/work/tools/midl.py /opt/work/tools/midl
 ln -s /opt/work/tools/midl.py /opt/work/tools/midl.exe
 ln -s /opt/work/tools/rc.py /opt/work/tools/rc
@@ -7,7 +7,7 @@ import sys
 script_dir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(script_dir)
 
-from vc6proxy import CLCompiler
+from vc6proxy import CLCompiler, run_traced
 
 def main():
     """
@@ -21,7 +21,7 @@ def main():
     compiler = CLCompiler()
     
     # Run the compiler with the arguments
-    return_code = compiler.compile(args)
+    return_code = run_traced('cl', compiler.compile, args)
     
     # Return the compiler's exit code
     sys.exit(return_code)
@@ -7,7 +7,7 @@ import sys
 script_dir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(script_dir)
 
-from vc6proxy import LibExe
+from vc6proxy import LibExe, run_traced
 
 def main():
     """
@@ -21,7 +21,7 @@ def main():
     libexe = LibExe()
     
     # Run the linker with the arguments
-    return_code = libexe.create_lib(args)
+    return_code = run_traced('lib', libexe.create_lib, args)
     
     # Return the linker's exit code
     sys.exit(return_code)
@@ -7,7 +7,7 @@ import sys
 script_dir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(script_dir)
 
-from vc6proxy import LinkExe
+from vc6proxy import LinkExe, run_traced
 
 def main():
     """
@@ -21,7 +21,7 @@ def main():
     linker = LinkExe()
     
     # Run the linker with the arguments
-    return_code = linker.link(args)
+    return_code = run_traced('link', linker.link, args)
     
     # Return the linker's exit code
     sys.exit(return_code)
@@ -7,7 +7,7 @@ import sys
 script_dir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(script_dir)
 
-from vc6proxy import MidlCompiler
+from vc6proxy import MidlCompiler, run_traced
 
 def main():
     """
@@ -21,7 +21,7 @@ def main():
     midl = MidlCompiler()
     
     # Run the MIDL compiler with the arguments
-    return_code = midl.compile(args)
+    return_code = run_traced('midl', midl.compile, args)
     
     # Return the compiler's exit code
     sys.exit(return_code)
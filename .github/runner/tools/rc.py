@@ -7,7 +7,7 @@ import sys
 script_dir = os.path.dirname(os.path.realpath(__file__))
 sys.path.append(script_dir)
 
-from vc6proxy import RcCompiler
+from vc6proxy import RcCompiler, run_traced
 
 def main():
     """
@@ -21,7 +21,7 @@ def main():
     rccomp = RcCompiler()
     
     # Run the MIDL compiler with the arguments
-    return_code = rccomp.compile(args)
+    return_code = run_traced('rc', rccomp.compile, args)
     
     # Return the compiler's exit code
     sys.exit(return_code)
@@ -70,7 +70,12 @@ if not exist "%TEMP%\" (
 echo.
 
 :: Root of Visual Developer Studio Common files.
-set ToolsRoot=Z:\opt\work\tools\VC6SP6
+:: VC6_TOOLS_ROOT points at the RAM-backed copy made by vc6prefix.py.
+if defined VC6_TOOLS_ROOT (
+  set "ToolsRoot=%VC6_TOOLS_ROOT%"
+) else (
+  set ToolsRoot=Z:\opt\work\tools\VC6SP6
+)
 set VSCommonDir=%ToolsRoot%\Common
 ::
 :: Root of Visual Developer Studio installed files.
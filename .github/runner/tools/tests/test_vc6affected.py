@@ -0,0 +1,50 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from vc6build import BuildGraph, BuildJob
+from vc6affected import AffectedTargets
+
+class SelectTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source_root = os.path.join(tmp.name, 'src')
+        build_dir = os.path.join(tmp.name, 'build')
+        os.makedirs(self.source_root)
+        os.makedirs(build_dir)
+        with open(os.path.join(build_dir, 'compile_commands.json'), 'w') as f:
+            json.dump([], f)
+
+        self.graph = BuildGraph(build_dir)
+        self.source = os.path.join(self.source_root, 'a.cpp')
+        job = BuildJob('a.cpp.obj', 'compile', [], build_dir)
+        job.inputs = [self.source]
+        job.outputs = [os.path.join(build_dir, 'a.cpp.obj')]
+        self.job = self.graph.add_job(job)
+        self.targets = AffectedTargets(self.graph, self.source_root)
+
+    def test_doc_change_selects_nothing(self):
+        path = os.path.join(self.source_root, 'README.md')
+        affected, reasons, full = self.targets.select([('M', path)])
+        self.assertEqual(affected, set())
+        self.assertFalse(full)
+        self.assertEqual(reasons[path], "not used by the build")
+
+    def test_unmatched_source_is_full_build(self):
+        path = os.path.join(self.source_root, 'generated.inl')
+        affected, _, full = self.targets.select([('M', path)])
+        self.assertTrue(full)
+        self.assertEqual(affected, {self.job})
+
+    def test_source_selects_its_compile(self):
+        affected, _, full = self.targets.select([('M', self.source)])
+        self.assertFalse(full)
+        self.assertEqual(affected, {self.job})
+
+if __name__ == '__main__':
+    unittest.main()
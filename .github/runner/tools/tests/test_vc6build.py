@@ -0,0 +1,55 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from vc6build import BuildGraph, BuildJob, JobHistory
+
+class OutdatedTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.dir = tmp.name
+        self.source = self.touch('a.cpp', 100)
+        self.header = self.touch('a.h', 100)
+        obj = self.touch('a.obj', 200)
+        with open(obj + '.d', 'w') as f:
+            f.write(f"a.obj: \\\n  {self.source} \\\n  {self.header}\n")
+        lib = self.touch('a.lib', 300)
+
+        self.graph = BuildGraph(self.dir)
+        self.compile = BuildJob('a.obj', 'compile', [], self.dir)
+        self.compile.inputs = [self.source]
+        self.compile.outputs = [obj]
+        self.link = BuildJob('a.lib', 'link', [], self.dir)
+        self.link.outputs = [lib]
+        self.link.deps.add(self.compile)
+        self.compile.successors.add(self.link)
+        for job in (self.compile, self.link):
+            self.graph.add_job(job)
+        self.graph.estimate(JobHistory(os.path.join(self.dir, 'history.json')))
+
+    def touch(self, name, mtime):
+        path = os.path.join(self.dir, name)
+        with open(path, 'w'):
+            pass
+        os.utime(path, (mtime, mtime))
+        return path
+
+    def test_up_to_date_depfile_predicts_nothing(self):
+        self.assertEqual(self.graph.outdated(), set())
+        self.graph.restrict(self.graph.outdated())
+        self.assertEqual(self.graph.simulate(4), 0.0)
+        self.assertEqual(sum(job.estimate for job in self.graph.jobs.values()), 0)
+
+    def test_changed_header_predicts_compile_and_link(self):
+        os.utime(self.header, (250, 250))
+        outdated = self.graph.outdated()
+        self.assertEqual(outdated, {self.compile, self.link})
+        self.graph.restrict(outdated)
+        self.assertEqual(self.graph.simulate(4), self.compile.estimate + self.link.estimate)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,30 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from vc6headers import compile_times
+
+class CompileTimesTest(unittest.TestCase):
+    def write_metrics(self, records):
+        fd, path = tempfile.mkstemp(suffix='.jsonl')
+        with os.fdopen(fd, 'w') as f:
+            for record in records:
+                f.write(json.dumps(record) + "\n")
+        self.addCleanup(os.unlink, path)
+        return path
+
+    def test_skips_preprocess_verify_records(self):
+        path = self.write_metrics([
+            {'tool': 'cl', 'job': 'a.cpp', 'cwd': '/src', 'returncode': 0, 'wall': 2.5},
+            {'tool': 'cl', 'job': 'a.cpp', 'cwd': '/src', 'returncode': 0, 'preprocess_verify': 'same'},
+            {'tool': 'cl', 'job': 'b.cpp', 'cwd': '/src', 'returncode': 0, 'preprocess_verify': 'different',
+             'sections': ['.text']},
+        ])
+        self.assertEqual(compile_times(path), {'/src/a.cpp': 2.5})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,25 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from vc6replay import Invocation
+
+class StandInTest(unittest.TestCase):
+    def test_job_longer_than_stall_limit(self):
+        with tempfile.TemporaryDirectory() as cwd:
+            with open(os.path.join(cwd, 'a.c'), 'w') as f:
+                f.write("int a;\n")
+            # The watchdog polls every 5s, so a stall is only seen after 10s
+            record = {
+                'tool': 'cl', 'argv': ['/c', 'a.c', '/Foa.obj'], 'cwd': cwd,
+                'env': {'VC6_STALL_TIMEOUT': '1'}, 'wine': 12.0, 'duration': 12.0, 'returncode': 0,
+            }
+            invocation = Invocation(record, []).run({}, True, 1.0, True)
+        self.assertEqual(invocation.returncode, 0)
+        self.assertLess(invocation.duration, 20.0)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,46 @@
+import os
+import sys
+import json
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+from vc6build import BuildGraph, BuildJob
+from vc6affected import AffectedTargets
+from vc6watch import Watcher, editor_temporary
+
+class FailingPool:
+    def submit(self, *args):
+        raise AssertionError("nothing should be compiled")
+
+class WatcherTest(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.source_root = os.path.join(tmp.name, 'src')
+        build_dir = os.path.join(tmp.name, 'build')
+        os.makedirs(self.source_root)
+        os.makedirs(build_dir)
+        with open(os.path.join(build_dir, 'compile_commands.json'), 'w') as f:
+            json.dump([], f)
+
+        graph = BuildGraph(build_dir)
+        job = BuildJob('a.cpp.obj', 'compile', ['cl.py a.cpp'], build_dir)
+        job.inputs = [os.path.join(self.source_root, 'a.cpp')]
+        graph.add_job(job)
+        self.watcher = Watcher(graph, AffectedTargets(graph, self.source_root), FailingPool(), False)
+
+    def test_editor_temporaries(self):
+        for name in ('a.cpp~', '.#a.cpp', '#a.cpp#', '.a.cpp.swp', '4913'):
+            self.assertTrue(editor_temporary(os.path.join(self.source_root, name)), name)
+        self.assertFalse(editor_temporary(os.path.join(self.source_root, 'a.cpp')))
+
+    def test_editor_temporaries_compile_nothing(self):
+        self.watcher.compile({os.path.join(self.source_root, name) for name in ('a.cpp~', '.#a.cpp')})
+
+    def test_full_build_compiles_nothing(self):
+        self.watcher.compile({os.path.join(self.source_root, 'unused.h')})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,278 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import shutil
+import fnmatch
+import argparse
+import subprocess
+
+# Add the current directory to the path
+script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(script_dir)
+
+from vc6proxy import IncludeScanner, load_compile_commands
+from vc6build import BuildGraph, BuildDriver, JobHistory, HISTORY_FILE, suspect_jobs
+from vc6headers import read_cache_value
+
+# Changes that can alter how every TU is compiled or linked, relative to the source root
+FULL_BUILD_PATTERNS = [
+    'CMakeLists.txt',
+    '*/CMakeLists.txt',
+    '*.cmake',
+    'CMakePresets.json',
+    '.github/runner/*',
+]
+
+# Files a job may reach in ways the maps miss (a computed #include, a file a
+# tool reads); other files no job uses (docs, images, CI, editor temporaries)
+# don't affect the build
+BUILD_INPUT_EXTENSIONS = (
+    '.c', '.cc', '.cpp', '.cxx', '.h', '.hh', '.hpp', '.hxx', '.inl', '.inc',
+    '.rc', '.rc2', '.def', '.idl', '.odl', '.asm',
+)
+
+def changed_files(source_root, base, head=None):
+    """Return (status, absolute path) for every file git reports changed since base."""
+    # The checkout is mounted into the container under another owner
+    cmd = ['git', '-c', 'safe.directory=*', '-C', source_root, 'diff', '--name-status', '--no-renames', base]
+    if head:
+        cmd.append(head)
+    result = subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, universal_newlines=True)
+    if result.returncode != 0:
+        raise RuntimeError(f"git diff failed: {result.stderr.strip()}")
+    changes = []
+    for line in result.stdout.splitlines():
+        status, _, path = line.partition('\t')
+        if path:
+            changes.append((status[:1], os.path.normpath(os.path.join(source_root, path))))
+    return changes
+
+class AffectedTargets:
+    """Maps changed files to the compile, rule and link jobs of a build graph they affect."""
+    def __init__(self, graph, source_root):
+        self.graph = graph
+        self.source_root = source_root
+        self.includers = None
+        self.commands = {}
+        self.scanners = {}
+
+    def scan(self, job):
+        """Add the headers a compile job's TU reaches to the includers map."""
+        command = self.commands[job]
+        key = tuple(command.include_dirs)
+        if key not in self.scanners:
+            self.scanners[key] = IncludeScanner(command.include_dirs)
+        for _, header in self.scanners[key].scan(command.source):
+            self.includers.setdefault(header, set()).add(job)
+
+    def header_includers(self):
+        """Return header -> compile jobs whose TU reaches it, from the proxy's include resolution."""
+        if self.includers is None:
+            self.includers = {}
+            jobs = {}
+            for job in self.graph.jobs.values():
+                for output in job.outputs:
+                    jobs[output] = job
+            for command in load_compile_commands(self.graph.build_dir):
+                job = jobs.get(command.output)
+                if job is not None:
+                    self.commands[job] = command
+                    self.scan(job)
+        return self.includers
+
+    def forget(self, path):
+        """Drop the cached #include directives of a file that changed on disk."""
+        for scanner in self.scanners.values():
+            scanner.directives.pop(path, None)
+
+    def rule_consumers(self, path):
+        """Return the make rule jobs whose build.make rule lists path as a prerequisite."""
+        jobs = set()
+        for build_make, rules in self.graph.build_makes.values():
+            for target, prereqs in rules.items():
+                # A custom command output belongs to its target's depend job
+                job = self.graph.jobs.get(target) or \
+                    self.graph.producers.get(os.path.normpath(os.path.join(self.graph.build_dir, target)))
+                if job is None:
+                    continue
+                for prereq in prereqs:
+                    if os.path.normpath(os.path.join(self.graph.build_dir, prereq)) == path:
+                        jobs.add(job)
+        return jobs
+
+    def needs_full_build(self, path):
+        if not path.startswith(self.source_root + os.sep):
+            return False
+        rel = os.path.relpath(path, self.source_root)
+        return any(fnmatch.fnmatch(rel, pattern) for pattern in FULL_BUILD_PATTERNS)
+
+    def select(self, changes):
+        """Return (affected jobs, reasons, full build) for a list of (status, path) changes."""
+        reasons = {}
+        direct = {}
+        for status, path in changes:
+            if self.needs_full_build(path):
+                reasons[path] = "build configuration or toolchain changed, full build"
+                return set(self.graph.jobs.values()), reasons, True
+
+            jobs = set()
+            for job in self.graph.jobs.values():
+                if path in job.inputs and job.kind != 'link':
+                    jobs.add(job)
+            if path in self.header_includers():
+                jobs |= self.header_includers()[path]
+            jobs |= self.rule_consumers(path)
+
+            if status == 'D' and not jobs:
+                # The include graph is built from the current tree, so a deleted
+                # file's includers can't be found
+                reasons[path] = "deleted, dependents unknown, full build"
+                return set(self.graph.jobs.values()), reasons, True
+            if (not jobs and path.startswith(self.source_root + os.sep)
+                    and os.path.splitext(path)[1].lower() in BUILD_INPUT_EXTENSIONS):
+                # A source reached some other way than a TU, a literal #include or a
+                # build.make rule; missing a rebuild costs more than a full build
+                reasons[path] = "no job found for it, full build"
+                return set(self.graph.jobs.values()), reasons, True
+            reasons[path] = f"{len(jobs)} job(s)" if jobs else "not used by the build"
+            for job in jobs:
+                direct[job] = path
+
+        affected = set(direct)
+        stack = list(direct)
+        while stack:
+            for successor in stack.pop().successors:
+                if successor not in affected:
+                    affected.add(successor)
+                    stack.append(successor)
+        return affected, reasons, False
+
+def missing_prerequisites(jobs):
+    """Add the jobs the selection depends on whose outputs aren't in the build dir yet."""
+    selected = set(jobs)
+    stack = list(selected)
+    while stack:
+        for dep in stack.pop().deps:
+            if dep not in selected and not all(os.path.exists(output) for output in dep.outputs):
+                selected.add(dep)
+                stack.append(dep)
+    return selected
+
+def seed_build_dir(seed, build_dir):
+    """Copy a cached previous build's outputs into build_dir, keeping what configure just wrote."""
+    copied = 0
+    for root, dirs, files in os.walk(seed):
+        target_root = os.path.join(build_dir, os.path.relpath(root, seed))
+        os.makedirs(target_root, exist_ok=True)
+        for name in files:
+            target = os.path.join(target_root, name)
+            if not os.path.lexists(target):
+                shutil.copy2(os.path.join(root, name), target, follow_symlinks=False)
+                copied += 1
+    return copied
+
+def target_kind(job):
+    if job.kind == 'compile':
+        return 'tus'
+    if job.kind == 'link':
+        return 'libraries' if job.name.lower().endswith('.lib') else 'executables'
+    return 'rules'
+
+def main():
+    """
+    Selects the part of the build a change affects.
+    Changed files are mapped to TUs through the compile commands and the
+    include graph the CL proxy resolves, then to the libraries and
+    executables that link them; --build runs only those jobs.
+    """
+    parser = argparse.ArgumentParser(description="Affected-target selection for the VC6 build")
+    parser.add_argument('build_dir', nargs='?', default='.', help="Configured CMake build directory (Unix Makefiles generator)")
+    parser.add_argument('--base', help="Git revision to diff against (e.g. origin/main or HEAD^)")
+    parser.add_argument('--head', help="Git revision to diff to (default: the working tree)")
+    parser.add_argument('--files', nargs='*', help="Changed files instead of a git diff")
+    parser.add_argument('--seed', help="Cached previous build dir to copy missing outputs from")
+    parser.add_argument('--build', action='store_true', help="Build the affected jobs with the vc6build driver")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help="Number of concurrent jobs with --build")
+    parser.add_argument('-k', '--keep-going', action='store_true', help="Keep starting new jobs after a failure")
+    parser.add_argument('--first-error', action='store_true',
+                        help="With --build, compile the TUs most likely to fail first (see vc6build.py --first-error)")
+    parser.add_argument('--changed-since', metavar='REV',
+                        help="Git revision the --first-error changes are taken from (default: --base)")
+    parser.add_argument('--json', action='store_true', help="Print the selection as JSON")
+    args = parser.parse_args()
+
+    build_dir = os.path.abspath(args.build_dir)
+    source_root = read_cache_value(build_dir, 'CMAKE_HOME_DIRECTORY')
+    if not source_root:
+        print(f"vc6affected: {build_dir} is not a configured CMake build dir", file=sys.stderr)
+        sys.exit(2)
+
+    try:
+        if args.files is not None:
+            changes = [('M', os.path.abspath(path)) for path in args.files]
+        elif args.base:
+            changes = changed_files(source_root, args.base, args.head)
+        else:
+            print("vc6affected: give --base <rev> or --files", file=sys.stderr)
+            sys.exit(2)
+
+        if args.seed:
+            copied = seed_build_dir(os.path.abspath(args.seed), build_dir)
+            print(f"vc6affected: seeded {copied} file(s) from {args.seed}", file=sys.stderr)
+
+        graph = BuildGraph(build_dir)
+        graph.load()
+    except RuntimeError as e:
+        print(f"vc6affected: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    affected, reasons, full = AffectedTargets(graph, source_root).select(changes)
+    selection = {'tus': [], 'libraries': [], 'executables': [], 'rules': []}
+    for job in sorted(affected):
+        selection[target_kind(job)].append(job.name)
+
+    if args.json:
+        json.dump({'full': full, 'changes': reasons, 'affected': selection}, sys.stdout, indent=1)
+        print()
+    else:
+        for path, reason in sorted(reasons.items()):
+            print(f"  {os.path.relpath(path, source_root)}: {reason}")
+        print(f"vc6affected: {len(changes)} changed file(s) affect {len(selection['tus'])} TU(s), "
+              f"{len(selection['libraries'])} library(ies), {len(selection['executables'])} executable(s)"
+              f"{' (full build)' if full else ''}")
+        for kind in ('libraries', 'executables'):
+            for name in selection[kind]:
+                print(f"    {name}")
+
+    if not args.build:
+        sys.exit(0)
+    if not affected:
+        print("vc6affected: nothing to build")
+        sys.exit(0)
+
+    jobs = missing_prerequisites(affected)
+    if len(jobs) > len(affected):
+        print(f"vc6affected: also building {len(jobs) - len(affected)} prerequisite job(s) without outputs in {build_dir}")
+    graph.restrict(jobs)
+
+    history = JobHistory(os.path.join(build_dir, HISTORY_FILE))
+    graph.estimate(history)
+    changed_since = args.changed_since or args.base
+    if args.first_error and changed_since:
+        failed, changed = suspect_jobs(graph, history, changed_since)
+        boosted = graph.prioritize(failed | changed)
+        print(f"vc6affected: starting {len(failed | changed)} suspect TU(s) first ({len(failed)} failed last build, "
+              f"{len(changed)} reach files changed since {changed_since}), {len(boosted)} job(s) boosted")
+    driver = BuildDriver(graph, history, max(1, args.jobs), args.keep_going)
+    elapsed, finished = driver.run()
+    print(f"vc6affected: built {finished} of {len(graph.jobs)} job(s) in {elapsed:.1f}s")
+    if driver.failed:
+        for job in driver.failed:
+            print(f"  FAILED {job.name}", file=sys.stderr)
+        sys.exit(1)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,582 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import time
+import glob
+import heapq
+import shlex
+import argparse
+import subprocess
+import traceback
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+# Add the current directory to the path
+script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(script_dir)
+
+import vc6proxy
+from vc6proxy import CLCompiler, LinkExe, LibExe, MidlCompiler, RcCompiler, load_compile_commands, run_traced
+
+# Proxy scripts that can be run in-process instead of through a new interpreter,
+# traced and profiled like the scripts themselves
+PROXY_TOOLS = {
+    'cl.py': lambda args: run_traced('cl', CLCompiler().compile, args),
+    'link.py': lambda args: run_traced('link', LinkExe().link, args),
+    'lib.py': lambda args: run_traced('lib', LibExe().create_lib, args),
+    'midl.py': lambda args: run_traced('midl', MidlCompiler().compile, args),
+    'rc.py': lambda args: run_traced('rc', RcCompiler().compile, args),
+}
+
+HISTORY_FILE = '.vc6build_history.json'
+
+# Duration estimates for jobs that have never been run on this build dir
+DEFAULT_DURATIONS = {
+    'compile': 2.0,
+    'link': 10.0,
+    'rule': 1.0,
+}
+
+# Weight of the newest sample in the moving average of job durations
+HISTORY_WEIGHT = 0.5
+
+def execute_commands(commands, cwd):
+    """Run a job's command lines in order, stopping at the first failure."""
+    try:
+        os.chdir(cwd)
+        for command in commands:
+            argv = shlex.split(command)
+            if not argv:
+                continue
+            tool = PROXY_TOOLS.get(os.path.basename(argv[0]))
+            if tool:
+                returncode = tool(argv[1:])
+            else:
+                returncode = subprocess.call(command, shell=True)
+            sys.stdout.flush()
+            sys.stderr.flush()
+            if returncode != 0:
+                return returncode
+        return 0
+    except Exception:
+        traceback.print_exc()
+        return 1
+
+def record_depfiles():
+    """Worker initializer: have the CL proxy write <object>.d, which the next build's up-to-date check reads."""
+    vc6proxy.DEPFILE = True
+
+def read_depfile(path):
+    """Return the prerequisites listed in a make-syntax depfile, or None if there is none."""
+    try:
+        with open(path, 'r') as f:
+            text = f.read()
+    except OSError:
+        return None
+    _, _, prereqs = text.replace('\\\n', ' ').partition(': ')
+    deps = []
+    for token in prereqs.replace('\\ ', '\0').split():
+        deps.append(token.replace('\0', ' '))
+    return deps
+
+def target_dir_of(path):
+    """Return the CMakeFiles/<tgt>.dir directory an object file is built in, or None."""
+    directory = os.path.dirname(path)
+    while directory != os.path.dirname(directory):
+        parent = os.path.dirname(directory)
+        if directory.endswith('.dir') and os.path.basename(parent) == 'CMakeFiles':
+            return directory
+        directory = parent
+    return None
+
+def is_path_token(token):
+    """Tell a file argument apart from a /option on a link command line."""
+    if token.startswith('-'):
+        return False
+    if token.startswith('/'):
+        return token.count('/') > 1 and ':' not in token.split('/')[1]
+    return True
+
+class BuildJob:
+    """A single node of the build graph: one compile, link script or make rule."""
+    def __init__(self, name, kind, commands, cwd):
+        self.name = name
+        self.kind = kind
+        self.commands = commands
+        self.cwd = cwd
+        self.inputs = []
+        self.outputs = []
+        self.deps = set()
+        self.successors = set()
+        self.estimate = None
+        self.priority = 0.0
+        self.start = None
+        self.end = None
+        self.returncode = None
+
+    def __lt__(self, other):
+        return self.name < other.name
+
+class JobHistory:
+    """Per-job durations recorded across builds of one build directory."""
+    def __init__(self, path):
+        self.path = path
+        self.entries = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"vc6build: ignoring unreadable history {path}: {e}", file=sys.stderr)
+
+    def duration(self, name):
+        entry = self.entries.get(name)
+        return entry['duration'] if entry else None
+
+    def record(self, name, duration, failed=False):
+        entry = self.entries.setdefault(name, {'duration': duration, 'samples': 0})
+        if not failed:
+            if entry['samples']:
+                entry['duration'] = HISTORY_WEIGHT * duration + (1 - HISTORY_WEIGHT) * entry['duration']
+            else:
+                entry['duration'] = duration
+            entry['samples'] += 1
+        entry['failed'] = failed
+
+    def save(self):
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+class BuildGraph:
+    """Build DAG assembled from compile_commands.json and the Makefile link scripts."""
+    def __init__(self, build_dir):
+        self.build_dir = os.path.abspath(build_dir)
+        self.jobs = {}
+        self.producers = {}
+        self.build_makes = {}
+
+    def relative(self, path):
+        return os.path.relpath(path, self.build_dir)
+
+    def add_job(self, job):
+        self.jobs[job.name] = job
+        for output in job.outputs:
+            self.producers[output] = job
+        return job
+
+    def load(self):
+        """Read every job and dependency the Makefile generator left in the build dir."""
+        compile_commands = os.path.join(self.build_dir, 'compile_commands.json')
+        if not os.path.exists(compile_commands):
+            raise RuntimeError(f"{compile_commands} not found, configure with CMAKE_EXPORT_COMPILE_COMMANDS=ON")
+
+        link_scripts = sorted(glob.glob(os.path.join(self.build_dir, '**', 'CMakeFiles', '*.dir', 'link.txt'), recursive=True))
+        if not link_scripts:
+            raise RuntimeError(f"No link scripts found in {self.build_dir}, configure with -G \"Unix Makefiles\"")
+
+        codegen = self.load_codegen_rules()
+
+        for command in load_compile_commands(self.build_dir):
+            self.load_compile_command(command, codegen)
+
+        for link_script in link_scripts:
+            self.load_link_script(link_script)
+
+        self.resolve_dependencies()
+
+    def build_make_rules(self, target_dir):
+        """Return the build.make path and its rule targets for a target's CMakeFiles/<tgt>.dir."""
+        if target_dir not in self.build_makes:
+            build_make = os.path.join(target_dir, 'build.make')
+            rules = {}
+            if os.path.exists(build_make):
+                with open(build_make, 'r') as f:
+                    for line in f:
+                        if line and not line[0].isspace() and not line.startswith('#') and ': ' in line:
+                            target, prereqs = line.rstrip('\n').split(': ', 1)
+                            # One prerequisite per line, the same target on several lines
+                            rules.setdefault(target, []).extend(prereqs.split())
+            self.build_makes[target_dir] = (build_make, rules)
+        return self.build_makes[target_dir]
+
+    def load_codegen_rules(self):
+        """Create jobs for targets whose depend step waits on custom command outputs (MIDL, shaders)."""
+        codegen = {}
+        for build_make in sorted(glob.glob(os.path.join(self.build_dir, '**', 'CMakeFiles', '*.dir', 'build.make'), recursive=True)):
+            target_dir = os.path.dirname(build_make)
+            _, rules = self.build_make_rules(target_dir)
+            depend = self.relative(os.path.join(target_dir, 'depend'))
+            if rules.get(depend):
+                command = "{0} -f {1} {2}".format(
+                    os.environ.get('MAKE', 'make'),
+                    shlex.quote(self.relative(build_make)),
+                    shlex.quote(depend))
+                job = BuildJob(depend, 'rule', [command], self.build_dir)
+                job.outputs = [os.path.normpath(os.path.join(self.build_dir, out)) for out in rules[depend]]
+                job.inputs = self.rule_inputs(rules, rules[depend])
+                codegen[target_dir] = self.add_job(job)
+        return codegen
+
+    def rule_inputs(self, rules, targets):
+        """Return the absolute prerequisites build.make lists for targets, other than targets themselves."""
+        inputs = []
+        for target in targets:
+            for prereq in rules.get(target, []):
+                path = os.path.normpath(os.path.join(self.build_dir, prereq))
+                if prereq not in targets and path not in inputs:
+                    inputs.append(path)
+        return inputs
+
+    def load_compile_command(self, command, codegen):
+        if not command.output:
+            print(f"vc6build: no output found for {command.source}, skipping", file=sys.stderr)
+            return
+
+        job = BuildJob(self.relative(command.output), 'compile', [command.command], command.directory)
+        job.inputs = [command.source]
+        job.outputs = [command.output]
+        job.target_dir = target_dir_of(command.output)
+        # Only the generated headers of the TU's own target
+        if job.target_dir in codegen:
+            job.deps.add(codegen[job.target_dir])
+        self.add_job(job)
+
+    def read_response_file(self, path):
+        try:
+            with open(path, 'r') as f:
+                return shlex.split(f.read())
+        except OSError:
+            return []
+
+    def load_link_script(self, link_script):
+        target_dir = os.path.dirname(link_script)
+        cwd = os.path.dirname(os.path.dirname(target_dir))
+        with open(link_script, 'r') as f:
+            commands = [line.strip() for line in f if line.strip()]
+
+        job = BuildJob(None, 'link', commands, cwd)
+        job.target_dir = target_dir
+        for command in commands:
+            tokens = shlex.split(command)
+            i = 0
+            while i < len(tokens):
+                token = tokens[i]
+                lower = token.lower()
+                if lower.startswith(('/out:', '-out:')) and len(token) > 5:
+                    job.outputs.append(os.path.normpath(os.path.join(cwd, token[5:])))
+                elif lower.startswith(('/implib:', '-implib:')) and len(token) > 8:
+                    job.outputs.append(os.path.normpath(os.path.join(cwd, token[8:])))
+                elif token.startswith('@'):
+                    tokens[i+1:i+1] = self.read_response_file(os.path.join(cwd, token[1:]))
+                elif is_path_token(token) and lower.endswith(('.obj', '.res', '.lib')):
+                    job.inputs.append(os.path.normpath(os.path.join(cwd, token)))
+                i += 1
+
+        if not job.outputs:
+            print(f"vc6build: no output found in {link_script}, skipping", file=sys.stderr)
+            return
+        job.name = self.relative(job.outputs[0])
+        self.add_job(job)
+
+    def rule_job(self, path, consumer):
+        """Create a make rule job for a link input that no compile command produces (e.g. .rc)."""
+        _, rules = self.build_make_rules(consumer.target_dir)
+        rule = self.relative(path)
+        if rule not in rules:
+            return None
+        build_make = self.relative(os.path.join(consumer.target_dir, 'build.make'))
+        command = "{0} -f {1} {2}".format(os.environ.get('MAKE', 'make'), shlex.quote(build_make), shlex.quote(rule))
+        job = BuildJob(rule, 'rule', [command], self.build_dir)
+        job.outputs = [path]
+        job.inputs = self.rule_inputs(rules, [rule])
+        return self.add_job(job)
+
+    def resolve_dependencies(self):
+        for job in list(self.jobs.values()):
+            for path in job.inputs:
+                producer = self.producers.get(path)
+                if producer is None and job.kind == 'link' and path.startswith(self.build_dir + os.sep):
+                    producer = self.rule_job(path, job)
+                if producer is not None and producer is not job:
+                    job.deps.add(producer)
+        for job in self.jobs.values():
+            for dep in job.deps:
+                dep.successors.add(job)
+
+    def up_to_date(self, job):
+        """Tell whether a job's outputs are all newer than what it reads, as make would.
+
+        Compiles read the headers from the depfile the proxy wrote last time and
+        are stale without one; rules with no known prerequisites always run.
+        """
+        inputs = list(job.inputs)
+        for dep in job.deps:
+            inputs.extend(dep.outputs)
+        target_dir = getattr(job, 'target_dir', None)
+        if target_dir:
+            # flags.make, link.txt and the like, so a changed command line rebuilds
+            _, rules = self.build_make_rules(target_dir)
+            inputs.extend(self.rule_inputs(rules, [self.relative(output) for output in job.outputs]))
+        if job.kind == 'compile':
+            deps = read_depfile(job.outputs[0] + '.d')
+            if deps is None:
+                return False
+            inputs.extend(deps)
+        elif job.kind == 'rule' and not job.inputs:
+            return False
+
+        try:
+            oldest = min(os.stat(output).st_mtime for output in job.outputs)
+            newest = max((os.stat(path).st_mtime for path in inputs), default=0.0)
+        except (OSError, ValueError):
+            return False
+        return newest <= oldest
+
+    def outdated(self):
+        """Return the jobs a build runs: those not up to date and every job after them."""
+        stale = set()
+        for job in self.topological_order():
+            if job.deps & stale or not self.up_to_date(job):
+                stale.add(job)
+        return stale
+
+    def restrict(self, keep):
+        """Drop every job not in keep, along with the dependency edges to it."""
+        keep = set(keep)
+        self.jobs = {name: job for name, job in self.jobs.items() if job in keep}
+        for job in keep:
+            job.deps &= keep
+            job.successors &= keep
+
+    def estimate(self, history):
+        """Assign estimated durations and critical-path priorities to every job."""
+        known = {}
+        for job in self.jobs.values():
+            job.estimate = history.duration(job.name)
+            if job.estimate is not None:
+                known.setdefault(job.kind, []).append(job.estimate)
+
+        for job in self.jobs.values():
+            if job.estimate is None:
+                samples = sorted(known.get(job.kind, []))
+                job.estimate = samples[len(samples) // 2] if samples else DEFAULT_DURATIONS[job.kind]
+
+        # Priority is the longest path from the job to the end of the build
+        for job in self.topological_order(reverse=True):
+            job.priority = job.estimate + max((s.priority for s in job.successors), default=0.0)
+
+        return sum(len(samples) for samples in known.values())
+
+    def prioritize(self, jobs):
+        """Schedule jobs, and the jobs they wait for, ahead of every other job."""
+        # More than any critical path, so boosted jobs keep their relative order
+        boost = sum(job.estimate for job in self.jobs.values())
+        boosted = set(job for job in jobs if job.name in self.jobs)
+        stack = list(boosted)
+        while stack:
+            for dep in stack.pop().deps:
+                if dep not in boosted:
+                    boosted.add(dep)
+                    stack.append(dep)
+        for job in boosted:
+            job.priority += boost
+        return boosted
+
+    def topological_order(self, reverse=False):
+        order = []
+        pending = {job: len(job.deps) for job in self.jobs.values()}
+        ready = [job for job, count in pending.items() if count == 0]
+        while ready:
+            job = ready.pop()
+            order.append(job)
+            for successor in job.successors:
+                pending[successor] -= 1
+                if pending[successor] == 0:
+                    ready.append(successor)
+        if len(order) != len(self.jobs):
+            raise RuntimeError("Dependency cycle in build graph")
+        return order[::-1] if reverse else order
+
+    def simulate(self, workers):
+        """Predict the wall time of a critical-path-first schedule on the given workers."""
+        pending = {job: len(job.deps) for job in self.jobs.values()}
+        ready = [(-job.priority, job) for job, count in pending.items() if count == 0]
+        heapq.heapify(ready)
+        running = []
+        now = 0.0
+        while ready or running:
+            while ready and len(running) < workers:
+                _, job = heapq.heappop(ready)
+                heapq.heappush(running, (now + job.estimate, job))
+            now, job = heapq.heappop(running)
+            for successor in job.successors:
+                pending[successor] -= 1
+                if pending[successor] == 0:
+                    heapq.heappush(ready, (-successor.priority, successor))
+        return now
+
+class BuildDriver:
+    """Runs a BuildGraph longest-path-first on a pool of proxy worker processes."""
+    def __init__(self, graph, history, workers, keep_going=False, always_make=False):
+        self.graph = graph
+        self.history = history
+        self.workers = workers
+        self.keep_going = keep_going
+        self.always_make = always_make
+        self.failed = []
+        self.first_failure = None
+        self.skipped = 0
+
+    def release(self, job, pending, ready):
+        for successor in job.successors:
+            pending[successor] -= 1
+            if pending[successor] == 0:
+                heapq.heappush(ready, (-successor.priority, successor))
+
+    def run(self):
+        jobs = self.graph.jobs
+        pending = {job: len(job.deps) for job in jobs.values()}
+        ready = [(-job.priority, job) for job, count in pending.items() if count == 0]
+        heapq.heapify(ready)
+        in_flight = {}
+        finished = 0
+        build_start = time.monotonic()
+
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=record_depfiles) as pool:
+            while ready or in_flight:
+                while ready and len(in_flight) < self.workers and (self.keep_going or not self.failed):
+                    _, job = heapq.heappop(ready)
+                    if not self.always_make and self.graph.up_to_date(job):
+                        finished += 1
+                        self.skipped += 1
+                        self.release(job, pending, ready)
+                        continue
+                    job.start = time.monotonic()
+                    in_flight[pool.submit(execute_commands, job.commands, job.cwd)] = job
+
+                if not in_flight:
+                    break
+
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    job = in_flight.pop(future)
+                    job.end = time.monotonic()
+                    job.returncode = future.result()
+                    finished += 1
+                    duration = job.end - job.start
+                    self.history.record(job.name, duration, failed=job.returncode != 0)
+
+                    if job.returncode != 0:
+                        print(f"[{finished}/{len(jobs)}] FAILED {job.name} ({duration:.1f}s)")
+                        if not self.failed:
+                            self.first_failure = job.end - build_start
+                        self.failed.append(job)
+                        continue
+
+                    print(f"[{finished}/{len(jobs)}] {job.name} ({duration:.1f}s)")
+                    self.release(job, pending, ready)
+
+        self.history.save()
+        return time.monotonic() - build_start, finished
+
+def suspect_jobs(graph, history, base):
+    """Return (TUs that failed in the previous build, TUs that reach files changed since base)."""
+    failed = set(job for job in graph.jobs.values()
+                 if job.kind == 'compile' and history.entries.get(job.name, {}).get('failed'))
+
+    changed = set()
+    from vc6affected import AffectedTargets, changed_files
+    from vc6headers import read_cache_value
+    source_root = read_cache_value(graph.build_dir, 'CMAKE_HOME_DIRECTORY')
+    if not source_root:
+        return failed, changed
+    try:
+        changes = changed_files(source_root, base)
+    except RuntimeError as e:
+        print(f"vc6build: not ordering by changed files: {str(e).splitlines()[0]}", file=sys.stderr)
+        return failed, changed
+    affected, _, full = AffectedTargets(graph, source_root).select(changes)
+    # A configuration change affects every TU, which says nothing about which will fail
+    if not full:
+        changed = set(job for job in affected if job.kind == 'compile')
+    return failed, changed
+
+def main():
+    """
+    Build driver for the VC6 proxy toolchain.
+    Runs the compile and link jobs of a Makefile-generated build dir directly,
+    starting the longest remaining dependency chain first.
+    """
+    parser = argparse.ArgumentParser(description="Critical-path scheduled build driver for the VC6 Wine proxies")
+    parser.add_argument('build_dir', nargs='?', default='.', help="CMake build directory (Unix Makefiles generator)")
+    parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count(), help="Number of concurrent jobs")
+    parser.add_argument('-k', '--keep-going', action='store_true', help="Keep starting new jobs after a failure")
+    parser.add_argument('-B', '--always-make', action='store_true', help="Run every job, even those whose outputs are up to date")
+    parser.add_argument('-n', '--dry-run', action='store_true', help="Only print the predicted schedule")
+    parser.add_argument('--history', help=f"Job duration history file (default: <build_dir>/{HISTORY_FILE})")
+    parser.add_argument('--first-error', action='store_true',
+                        help="Compile the TUs most likely to fail first: those that failed in the previous build "
+                             "or reach files changed since --changed-since")
+    parser.add_argument('--changed-since', metavar='REV', default='HEAD^',
+                        help="Git revision the --first-error changes are taken from (default: %(default)s)")
+    args = parser.parse_args()
+
+    graph = BuildGraph(args.build_dir)
+    try:
+        graph.load()
+    except RuntimeError as e:
+        print(f"vc6build: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    history = JobHistory(args.history or os.path.join(graph.build_dir, HISTORY_FILE))
+    with_history = graph.estimate(history)
+    workers = max(1, args.jobs)
+    current = 0
+    if not args.always_make:
+        # Predict only what runs; the jobs after a stale one are stale too, so priorities stay as estimated
+        outdated = graph.outdated()
+        current = len(graph.jobs) - len(outdated)
+        graph.restrict(outdated)
+    critical_path = max((job.priority for job in graph.jobs.values()), default=0.0)
+    if args.first_error:
+        failed, changed = suspect_jobs(graph, history, args.changed_since)
+        boosted = graph.prioritize(failed | changed)
+        print(f"vc6build: starting {len(failed | changed)} suspect TU(s) first ({len(failed)} failed last build, "
+              f"{len(changed)} reach files changed since {args.changed_since}), {len(boosted)} job(s) boosted")
+    predicted = graph.simulate(workers)
+    total_work = sum(job.estimate for job in graph.jobs.values())
+
+    kinds = {}
+    for job in graph.jobs.values():
+        kinds[job.kind] = kinds.get(job.kind, 0) + 1
+    summary = ', '.join(f"{count} {kind}" for kind, count in sorted(kinds.items()))
+    print(f"vc6build: {len(graph.jobs)} jobs ({summary}), {current} up to date, {workers} workers, "
+          f"{with_history} with history")
+    print(f"vc6build: predicted wall time {predicted:.1f}s (critical path {critical_path:.1f}s, {total_work:.1f}s of work)")
+
+    if args.dry_run:
+        sys.exit(0)
+
+    driver = BuildDriver(graph, history, workers, args.keep_going, args.always_make)
+    actual, finished = driver.run()
+    if driver.skipped:
+        print(f"vc6build: {driver.skipped} more job(s) found up to date")
+
+    error = (actual - predicted) / predicted * 100 if predicted > 0 else 0.0
+    print(f"vc6build: actual wall time {actual:.1f}s (predicted {predicted:.1f}s, {error:+.1f}%)")
+
+    if driver.failed:
+        skipped = len(graph.jobs) - finished
+        print(f"vc6build: first failure after {driver.first_failure:.1f}s, "
+              f"{len(driver.failed)} job(s) failed, {skipped} not run:", file=sys.stderr)
+        for job in driver.failed:
+            print(f"  {job.name}", file=sys.stderr)
+        sys.exit(1)
+
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,304 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import struct
+import argparse
+
+# Add the current directory to the path
+script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(script_dir)
+
+from vc6proxy import ARCHIVE_MAGIC, ARCHIVE_MEMBER_HEADER_SIZE, IMAGE_FILE_MACHINE_I386
+
+IMAGE_SCN_CNT_CODE = 0x20
+IMAGE_SCN_CNT_INITIALIZED_DATA = 0x40
+IMAGE_SCN_CNT_UNINITIALIZED_DATA = 0x80
+IMAGE_SCN_LNK_COMDAT = 0x1000
+IMAGE_SYM_CLASS_EXTERNAL = 2
+IMAGE_SYM_CLASS_STATIC = 3
+SYMBOL_SIZE = 18
+SECTION_HEADER_SIZE = 40
+
+# COMDATs kept in a JSON report, the rest only count towards the totals
+JSON_COMDAT_LIMIT = 2000
+
+class ObjectStats:
+    """Size breakdown of one object file, or the sum over a library's members."""
+    FIELDS = ('size', 'sections', 'comdats', 'symbols', 'externals', 'relocations',
+              'code', 'data', 'bss', 'debug_s', 'debug_t', 'other', 'imports', 'members')
+
+    def __init__(self, name):
+        self.name = name
+        for field in self.FIELDS:
+            setattr(self, field, 0)
+
+    @property
+    def debug(self):
+        return self.debug_s + self.debug_t
+
+    def add(self, other):
+        for field in self.FIELDS:
+            if field != 'size':
+                setattr(self, field, getattr(self, field) + getattr(other, field))
+
+    def to_json(self):
+        return {field: getattr(self, field) for field in self.FIELDS}
+
+    @classmethod
+    def from_json(cls, name, record):
+        stats = cls(name)
+        for field in cls.FIELDS:
+            setattr(stats, field, record.get(field, 0))
+        return stats
+
+def _symbol_name(data, entry, strtab):
+    if data[entry:entry + 4] == b'\0\0\0\0':
+        start = strtab + struct.unpack_from('<I', data, entry + 4)[0]
+        return data[start:data.find(b'\0', start)].decode('latin-1')
+    return data[entry:entry + 8].rstrip(b'\0').decode('latin-1')
+
+def parse_object(data, offset, size, name, comdats):
+    """Return ObjectStats for the COFF object at data[offset:offset + size], or None if it isn't one.
+
+    COMDAT symbols are counted into comdats, name -> [TUs defining it, total bytes].
+    """
+    if size < 20:
+        return None
+    machine, nsections, _, symtab, nsymbols, optional_size, _ = struct.unpack_from('<HHIIIHH', data, offset)
+    if machine != IMAGE_FILE_MACHINE_I386:
+        return None
+
+    stats = ObjectStats(name)
+    stats.size = size
+    stats.members = 1
+    strtab = offset + symtab + nsymbols * SYMBOL_SIZE
+    sections = []
+    try:
+        header = offset + 20 + optional_size
+        for i in range(nsections):
+            (raw_name, virtual_size, _, raw_size, _, _, _,
+             relocations, _, flags) = struct.unpack_from('<8sIIIIIIHHI', data, header + i * SECTION_HEADER_SIZE)
+            section = raw_name.rstrip(b'\0').decode('latin-1')
+            if section.startswith('/') and section[1:].isdigit():
+                start = strtab + int(section[1:])
+                section = data[start:data.find(b'\0', start)].decode('latin-1')
+            sections.append((raw_size, flags))
+
+            stats.sections += 1
+            stats.relocations += relocations
+            if flags & IMAGE_SCN_LNK_COMDAT:
+                stats.comdats += 1
+            if section.startswith('.debug$S'):
+                stats.debug_s += raw_size
+            elif section.startswith('.debug$T'):
+                stats.debug_t += raw_size
+            elif flags & IMAGE_SCN_CNT_CODE:
+                stats.code += raw_size
+            elif flags & IMAGE_SCN_CNT_UNINITIALIZED_DATA:
+                stats.bss += raw_size or virtual_size
+            elif flags & IMAGE_SCN_CNT_INITIALIZED_DATA:
+                stats.data += raw_size
+            else:
+                stats.other += raw_size
+
+        seen = set()
+        i = 0
+        while i < nsymbols:
+            entry = offset + symtab + i * SYMBOL_SIZE
+            _, section_number, _, storage_class, aux_count = struct.unpack_from('<IhHBB', data, entry + 8)
+            stats.symbols += 1
+            if storage_class == IMAGE_SYM_CLASS_EXTERNAL:
+                stats.externals += 1
+            # A COMDAT section's own symbol is the first one after the section
+            # symbol (which carries the aux record) that lives in it
+            if (0 < section_number <= len(sections) and section_number not in seen and aux_count == 0
+                    and sections[section_number - 1][1] & IMAGE_SCN_LNK_COMDAT
+                    and storage_class in (IMAGE_SYM_CLASS_EXTERNAL, IMAGE_SYM_CLASS_STATIC)):
+                seen.add(section_number)
+                comdat = comdats.setdefault(_symbol_name(data, entry, strtab), [0, 0])
+                comdat[0] += 1
+                comdat[1] += sections[section_number - 1][0]
+            i += 1 + aux_count
+    except (struct.error, ValueError):
+        print(f"vc6coff: {name}: truncated COFF object", file=sys.stderr)
+    return stats
+
+def parse_archive(data, name, comdats):
+    """Return the summed ObjectStats of a .lib archive's object members."""
+    stats = ObjectStats(name)
+    stats.size = len(data)
+    offset = len(ARCHIVE_MAGIC)
+    while offset + ARCHIVE_MEMBER_HEADER_SIZE <= len(data):
+        member = data[offset:offset + 16].decode('latin-1').rstrip()
+        try:
+            size = int(data[offset + 48:offset + 58].decode('ascii').strip())
+        except ValueError:
+            print(f"vc6coff: {name}: unexpected archive member header", file=sys.stderr)
+            break
+        body = offset + ARCHIVE_MEMBER_HEADER_SIZE
+        # Skip the linker members and the long names table
+        if member not in ('/', '//'):
+            if data[body:body + 4] == b'\x00\x00\xff\xff':
+                stats.imports += 1
+            else:
+                obj = parse_object(data, body, size, member, comdats)
+                if obj:
+                    stats.add(obj)
+        offset = body + size + (size & 1)
+    return stats
+
+class CoffReport:
+    """Sizes of every object and library in a build, keyed by path relative to it."""
+    def __init__(self):
+        self.objects = {}
+        self.libraries = {}
+        self.comdats = {}
+        # Kept apart because the libraries repeat the objects built next to them
+        self.library_comdats = {}
+
+    def add_file(self, path, key):
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError as e:
+            print(f"vc6coff: {path}: {str(e)}", file=sys.stderr)
+            return
+        if data.startswith(ARCHIVE_MAGIC):
+            self.libraries[key] = parse_archive(data, key, self.library_comdats)
+        else:
+            stats = parse_object(data, 0, len(data), key, self.comdats)
+            if stats:
+                self.objects[key] = stats
+
+    def add_path(self, path):
+        if os.path.isfile(path):
+            self.add_file(path, os.path.basename(path))
+            return
+        for root, dirs, files in os.walk(path):
+            for name in files:
+                if name.lower().endswith(('.obj', '.lib')):
+                    full = os.path.join(root, name)
+                    self.add_file(full, os.path.relpath(full, path))
+
+    def to_json(self):
+        ranked = sorted((self.comdats or self.library_comdats).items(), key=lambda item: item[1][1], reverse=True)
+        return {
+            'objects': {key: stats.to_json() for key, stats in self.objects.items()},
+            'libraries': {key: stats.to_json() for key, stats in self.libraries.items()},
+            'comdats': dict(ranked[:JSON_COMDAT_LIMIT]),
+        }
+
+    @classmethod
+    def load(cls, path):
+        """Scan a build dir or file, or read a report saved with --json."""
+        report = cls()
+        if path.endswith('.json') and os.path.isfile(path):
+            with open(path, 'r') as f:
+                saved = json.load(f)
+            report.objects = {key: ObjectStats.from_json(key, r) for key, r in saved['objects'].items()}
+            report.libraries = {key: ObjectStats.from_json(key, r) for key, r in saved['libraries'].items()}
+            report.comdats = saved.get('comdats', {})
+        else:
+            report.add_path(path)
+        return report
+
+SORT_KEYS = {
+    'size': lambda s: s.size,
+    'code': lambda s: s.code,
+    'debug': lambda s: s.debug,
+    'comdats': lambda s: s.comdats,
+    'symbols': lambda s: s.symbols,
+    'relocations': lambda s: s.relocations,
+}
+
+def kib(value):
+    return f"{value / 1024:>9.1f}"
+
+def print_table(title, entries, sort, top):
+    total = ObjectStats('total')
+    for stats in entries:
+        total.add(stats)
+        total.size += stats.size
+    print(f"{title}: {len(entries)} files, {total.size / 2**20:.1f} MiB, {total.comdats} COMDATs, "
+          f"{total.symbols} symbols, {total.debug / 2**20:.1f} MiB of debug info")
+    print(f"{'size KiB':>9} {'code KiB':>9} {'data KiB':>9} {'dbg$S KiB':>9} {'dbg$T KiB':>9} "
+          f"{'sections':>8} {'COMDATs':>8} {'symbols':>8} {'relocs':>8}  file")
+    for stats in sorted(entries, key=SORT_KEYS[sort], reverse=True)[:top]:
+        print(f"{kib(stats.size)} {kib(stats.code)} {kib(stats.data)} {kib(stats.debug_s)} {kib(stats.debug_t)} "
+              f"{stats.sections:>8} {stats.comdats:>8} {stats.symbols:>8} {stats.relocations:>8}  {stats.name}")
+
+def print_comdats(comdats, top):
+    """List the COMDATs duplicated across the most TUs, by bytes the linker discards."""
+    duplicated = [(name, count, total) for name, (count, total) in comdats.items() if count > 1]
+    duplicated.sort(key=lambda item: item[2] - item[2] / item[1], reverse=True)
+    wasted = sum(total - total / count for _, count, total in duplicated)
+    print(f"COMDATs defined in more than one TU: {len(duplicated)}, {wasted / 2**20:.1f} MiB discarded by the linker")
+    print(f"{'TUs':>6} {'total KiB':>9} {'dup KiB':>9}  symbol")
+    for name, count, total in duplicated[:top]:
+        print(f"{count:>6} {kib(total)} {kib(total - total / count)}  {name}")
+
+def print_diff(title, baseline, current, sort, top):
+    key = SORT_KEYS[sort]
+    rows = []
+    for name in set(baseline) | set(current):
+        old = baseline.get(name) or ObjectStats(name)
+        new = current.get(name) or ObjectStats(name)
+        delta = key(new) - key(old)
+        if delta:
+            rows.append((delta, name, old, new))
+    rows.sort(key=lambda row: abs(row[0]), reverse=True)
+
+    old_total = sum(key(stats) for stats in baseline.values())
+    new_total = sum(key(stats) for stats in current.values())
+    unit = 1024 if sort in ('size', 'code', 'debug') else 1
+    print(f"{title}: {sort} {old_total / unit:.1f} -> {new_total / unit:.1f}{' KiB' if unit > 1 else ''} "
+          f"({len(rows)} files changed)")
+    for delta, name, old, new in rows[:top]:
+        status = ' (new)' if name not in baseline else ' (removed)' if name not in current else ''
+        print(f"  {delta / unit:>+10.1f} {key(old) / unit:>10.1f} -> {key(new) / unit:<10.1f} {name}{status}")
+
+def main():
+    """
+    Size analyzer for the .obj and .lib files the proxies produce.
+    Ranks TUs and libraries by section size, COMDATs, symbols and debug
+    info, lists COMDATs duplicated across TUs, and diffs two builds.
+    """
+    parser = argparse.ArgumentParser(description="COFF object and archive size analyzer for the VC6 build")
+    parser.add_argument('path', help="Build dir, .obj/.lib file, or a report saved with --json")
+    parser.add_argument('--baseline', help="Build dir or saved report to diff against")
+    parser.add_argument('--sort', choices=sorted(SORT_KEYS), default='size', help="Ranking key (default: %(default)s)")
+    parser.add_argument('--top', type=int, default=25, help="Number of entries to list")
+    parser.add_argument('--json', metavar='FILE', help="Also write the full report as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.path):
+        print(f"vc6coff: {args.path} does not exist", file=sys.stderr)
+        sys.exit(1)
+    report = CoffReport.load(args.path)
+
+    if args.json == '-':
+        json.dump(report.to_json(), sys.stdout, indent=1)
+        print()
+        sys.exit(0)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump(report.to_json(), f, indent=1)
+
+    if args.baseline:
+        baseline = CoffReport.load(args.baseline)
+        print_diff("Objects", baseline.objects, report.objects, args.sort, args.top)
+        print()
+        print_diff("Libraries", baseline.libraries, report.libraries, args.sort, args.top)
+        sys.exit(0)
+
+    print_table("Objects", list(report.objects.values()), args.sort, args.top)
+    print()
+    print_table("Libraries", list(report.libraries.values()), args.sort, args.top)
+    print()
+    print_comdats(report.comdats or report.library_comdats, args.top)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,802 @@
+#!/usr/bin/python3
+
+import os
+import re
+import sys
+import time
+import argparse
+
+# Add the current directory to the path
+script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(script_dir)
+
+from vc6proxy import SYSTEM_INCLUDE_DIRS, find_file_nocase, wine_to_unix
+
+# How CL.EXE spells the INCLUDE directories setup.bat sets, for #line and __FILE__
+TOOLS_ROOT = os.environ.get('VC6_TOOLS_ROOT') or 'Z:\\opt\\work\\tools\\VC6SP6'
+SYSTEM_INCLUDE_SPELLINGS = [
+    TOOLS_ROOT + '\\VC98\\ATL\\INCLUDE',
+    TOOLS_ROOT + '\\VC98\\INCLUDE',
+    TOOLS_ROOT + '\\VC98\\MFC\\INCLUDE',
+]
+
+C_EXTENSIONS = ('.c',)
+MAX_INCLUDE_DEPTH = 200
+
+# Splices, line ends, literals and comments; everything else in as large chunks as possible
+SCAN_RE = re.compile(r'''[^\\\n/"']+|\\\n|\n|"(?:[^"\\\n]|\\.)*"?|'(?:[^'\\\n]|\\.)*'?|//(?:\\\n|[^\n])*|/\*|.''',
+                     re.DOTALL)
+TOKEN_RE = re.compile(r'''
+    (?P<ws>[ \t\f\v\r\n]+)
+  | (?P<str>L?"(?:[^"\\\n]|\\.)*"?)
+  | (?P<chr>L?'(?:[^'\\\n]|\\.)*'?)
+  | (?P<num>\.?[0-9](?:[eEpP][+-]|[0-9A-Za-z_.])*)
+  | (?P<id>[A-Za-z_$][A-Za-z0-9_$]*)
+  | (?P<punct>\#@|\#\#|\.\.\.|<<=|>>=|->\*|->|\+\+|--|<<|>>|<=|>=|==|!=|&&|\|\||[-+*/%&|^]=|::|\.\*|[][(){}.,;:?~!+\-*/%&|^=<>\#])
+  | (?P<other>.)
+''', re.VERBOSE | re.DOTALL)
+INCLUDE_RE = re.compile(r'\s*(?:"([^"]*)"|<([^>]*)>)\s*$')
+NUMBER_RE = re.compile(r'(0[xX][0-9a-fA-F]+|[0-9]+)(?:[uUlL]*|[uU]?[iI]64)$')
+CHAR_ESCAPES = {'n': 10, 't': 9, 'v': 11, 'b': 8, 'r': 13, 'f': 12, 'a': 7, '\\': 92, "'": 39, '"': 34, '?': 63}
+
+BINARY_PRECEDENCE = {
+    '||': 1, '&&': 2, '|': 3, '^': 4, '&': 5, '==': 6, '!=': 6,
+    '<': 7, '>': 7, '<=': 7, '>=': 7, '<<': 8, '>>': 8, '+': 9, '-': 9, '*': 10, '/': 10, '%': 10,
+}
+BUILTINS = ('__FILE__', '__LINE__', '__DATE__', '__TIME__', '__TIMESTAMP__')
+
+class PreprocessError(Exception):
+    pass
+
+class NeedMore(Exception):
+    """A macro invocation continues on the next source line."""
+
+class Token:
+    __slots__ = ('kind', 'text', 'hide')
+
+    def __init__(self, kind, text, hide=frozenset()):
+        self.kind = kind
+        self.text = text
+        self.hide = hide
+
+    def __repr__(self):
+        return f"Token({self.kind!r}, {self.text!r})"
+
+SPACE = Token('ws', ' ')
+
+def tokenize(text):
+    return [Token(m.lastgroup, m.group()) for m in TOKEN_RE.finditer(text)]
+
+def strip_ws(tokens):
+    start, end = 0, len(tokens)
+    while start < end and tokens[start].kind == 'ws':
+        start += 1
+    while end > start and tokens[end - 1].kind == 'ws':
+        end -= 1
+    return tokens[start:end]
+
+def next_significant(tokens, i):
+    while i < len(tokens) and tokens[i].kind == 'ws':
+        i += 1
+    return i if i < len(tokens) else None
+
+def string_literal(text):
+    return '"' + text.replace('\\', '\\\\').replace('"', '\\"') + '"'
+
+def logical_lines(text):
+    """Split source text into (first physical line, text) lines with splices joined and comments removed."""
+    lines = []
+    buf = []
+    line = start = 1
+    pos = 0
+    end = len(text)
+    while pos < end:
+        match = SCAN_RE.match(text, pos)
+        chunk = match.group()
+        pos = match.end()
+        if chunk == '\n':
+            lines.append((start, ''.join(buf)))
+            buf = []
+            line += 1
+            start = line
+        elif chunk == '\\\n':
+            line += 1
+        elif chunk == '/*':
+            close = text.find('*/', pos)
+            close = end if close < 0 else close
+            line += text.count('\n', pos, close)
+            pos = close + 2
+            # A comment is one space, even when it spans lines
+            buf.append(' ')
+        elif chunk.startswith('//'):
+            line += chunk.count('\n')
+        else:
+            if '\\\n' in chunk:
+                line += chunk.count('\\\n')
+                chunk = chunk.replace('\\\n', '')
+            buf.append(chunk)
+    if buf:
+        lines.append((start, ''.join(buf)))
+    return lines
+
+def predefined_macros(compiler_flags, cplusplus):
+    """The macros CL.EXE 6.0 defines itself for a set of command line flags."""
+    flags = ['/' + flag[1:] if flag.startswith('-') else flag for flag in compiler_flags]
+    if '/u' in flags:
+        return {}
+    macros = {'_MSC_VER': '1200', '_WIN32': '1', '_M_IX86': '500', '_INTEGRAL_MAX_BITS': '64'}
+    if '/Za' in flags:
+        macros['__STDC__'] = '1'
+    else:
+        macros['_MSC_EXTENSIONS'] = '1'
+    if cplusplus:
+        macros['__cplusplus'] = '199711L'
+    for flag in flags:
+        if flag in ('/G3', '/G4', '/G5', '/G6'):
+            macros['_M_IX86'] = flag[2] + '00'
+        elif flag == '/GB':
+            macros['_M_IX86'] = '500'
+        elif flag == '/GR' and cplusplus:
+            macros['_CPPRTTI'] = '1'
+        elif flag in ('/GX', '/EHsc', '/EHs', '/EHa') and cplusplus:
+            macros['_CPPUNWIND'] = '1'
+        elif flag == '/J':
+            macros['_CHAR_UNSIGNED'] = '1'
+        elif flag in ('/MT', '/MTd', '/MD', '/MDd', '/MLd'):
+            if flag.startswith(('/MT', '/MD')):
+                macros['_MT'] = '1'
+            if flag.startswith('/MD'):
+                macros['_DLL'] = '1'
+            if flag.endswith('d'):
+                macros['_DEBUG'] = '1'
+    return macros
+
+def is_cplusplus(source, compiler_flags):
+    if '/TP' in compiler_flags or '-TP' in compiler_flags:
+        return True
+    if '/TC' in compiler_flags or '-TC' in compiler_flags:
+        return False
+    return not source.lower().endswith(C_EXTENSIONS)
+
+class Macro:
+    __slots__ = ('name', 'params', 'body')
+
+    def __init__(self, name, params, body):
+        self.name = name
+        self.params = params
+        self.body = body
+
+class SourceFile:
+    """A header or source read once per process, with its include guard if it has one."""
+    def __init__(self, path):
+        with open(path, 'r', encoding='latin-1') as f:
+            text = f.read()
+        self.path = path
+        self.lines = logical_lines(text.replace('\r\n', '\n'))
+        self.guard = self.find_guard()
+
+    def find_guard(self):
+        """Return X if the whole file is wrapped in #ifndef X / #if !defined(X) ... #endif."""
+        significant = [text.strip() for _, text in self.lines if text.strip()]
+        if len(significant) < 2 or not significant[-1].startswith('#') \
+                or significant[-1][1:].strip().split()[:1] != ['endif']:
+            return None
+        match = re.match(r'#\s*(?:ifndef\s+(\w+)|if\s+!\s*defined\s*(?:\(\s*(\w+)\s*\)|(\w+)))\s*$', significant[0])
+        if not match:
+            return None
+        depth = 0
+        for index, text in enumerate(significant):
+            if not text.startswith('#'):
+                continue
+            word = text[1:].strip().split()[:1]
+            if word and word[0] in ('if', 'ifdef', 'ifndef'):
+                depth += 1
+            elif word == ['endif']:
+                depth -= 1
+                if depth == 0 and index != len(significant) - 1:
+                    return None
+        return next(group for group in match.groups() if group)
+
+class Preprocessor:
+    """A C/C++ preprocessor that behaves like the one in CL.EXE 6.0.
+
+    Include lookup follows CL.EXE: quoted includes search the directories of
+    every open includer, then the /I directories, then INCLUDE; names are
+    matched ignoring case. #line markers spell paths the way CL.EXE would, so
+    diagnostics and debug info of the preprocessed compile name the real files.
+    """
+    def __init__(self, include_dirs, defines=(), undefines=(), compiler_flags=(), cplusplus=False):
+        # (Unix directory, spelling) pairs searched for includes
+        self.include_dirs = list(include_dirs)
+        if not {'/X', '-X'} & set(compiler_flags):
+            self.include_dirs += list(zip(SYSTEM_INCLUDE_DIRS, SYSTEM_INCLUDE_SPELLINGS))
+        self.macros = {}
+        for name, value in predefined_macros(compiler_flags, cplusplus).items():
+            self.define(name, value)
+        for define in defines:
+            name, sep, value = define.replace('#', '=', 1).partition('=')
+            self.define(name, value if sep else '1')
+        for name in undefines:
+            self.macros.pop(name, None)
+        self.files = {}
+        self.once = set()
+        self.included = []
+        self.stack = []
+        self.out = []
+        self.out_spelling = None
+        self.out_line = 0
+        self.position = (None, 0)
+        now = time.localtime()
+        self.date = string_literal(f"{time.strftime('%b', now)} {now.tm_mday:2d} {now.tm_year}")
+        self.time = string_literal(time.strftime('%H:%M:%S', now))
+
+    def define(self, name, value):
+        self.macros[name] = Macro(name, None, self.macro_body(tokenize(value)))
+
+    def macro_body(self, tokens):
+        body = []
+        for token in strip_ws(tokens):
+            if token.kind == 'ws':
+                if body and body[-1].kind != 'ws':
+                    body.append(SPACE)
+            else:
+                body.append(token)
+        return body
+
+    def source(self, path):
+        if path not in self.files:
+            try:
+                self.files[path] = SourceFile(path)
+            except OSError as e:
+                raise PreprocessError(f"Cannot open source file: '{path}': {e.strerror}")
+        return self.files[path]
+
+    # Output
+
+    def emit(self, spelling, line, text):
+        """Add a line of output, with a #line marker when CL.EXE would misplace it otherwise."""
+        if spelling != self.out_spelling or line < self.out_line or line > self.out_line + 8:
+            self.out.append(f'#line {line} {string_literal(spelling)}\n')
+        else:
+            self.out.append('\n' * (line - self.out_line))
+        self.out.append(text + '\n')
+        self.out_spelling = spelling
+        self.out_line = line + 1
+
+    def join(self, tokens):
+        parts = []
+        previous = None
+        for token in tokens:
+            if token.kind == 'ws':
+                if previous is not None:
+                    parts.append(' ')
+                    previous = None
+                continue
+            if previous is not None and (token.hide or previous.hide):
+                # Tokens that only became neighbours through expansion must not lex as one
+                merged = TOKEN_RE.match(previous.text + token.text)
+                if merged and len(merged.group()) > len(previous.text):
+                    parts.append(' ')
+            parts.append(token.text)
+            previous = token
+        return ''.join(parts).rstrip()
+
+    # Macro expansion
+
+    def expand(self, tokens, final=True):
+        """Macro-expand a token list, raising NeedMore if an invocation runs past its end."""
+        out = []
+        stack = tokens[::-1]
+        while stack:
+            token = stack.pop()
+            if token.kind != 'id' or token.text in token.hide:
+                out.append(token)
+                continue
+            name = token.text
+            macro = self.macros.get(name)
+            if macro is None:
+                out.append(self.builtin(token) if name in BUILTINS else token)
+                continue
+            if macro.params is None:
+                stack.extend(reversed(self.substitute(macro, None, token.hide | {name})))
+                continue
+
+            index = len(stack) - 1
+            while index >= 0 and stack[index].kind == 'ws':
+                index -= 1
+            if index < 0:
+                if not final:
+                    raise NeedMore('name')
+                out.append(token)
+                continue
+            if stack[index].text != '(' or stack[index].kind != 'punct':
+                out.append(token)
+                continue
+            del stack[index:]
+
+            args = [[]]
+            depth = 0
+            while True:
+                if not stack:
+                    if not final:
+                        raise NeedMore()
+                    raise PreprocessError(f"unexpected end of line in the arguments of macro '{name}'")
+                arg_token = stack.pop()
+                if arg_token.kind == 'punct':
+                    if arg_token.text == '(':
+                        depth += 1
+                    elif arg_token.text == ')':
+                        if depth == 0:
+                            rparen = arg_token
+                            break
+                        depth -= 1
+                    elif arg_token.text == ',' and depth == 0:
+                        args.append([])
+                        continue
+                args[-1].append(arg_token)
+            if not macro.params and len(args) == 1 and not strip_ws(args[0]):
+                args = []
+            if macro.params and macro.params[-1] == '__VA_ARGS__' and len(args) > len(macro.params):
+                variadic = args[len(macro.params) - 1]
+                for arg in args[len(macro.params):]:
+                    variadic = variadic + [Token('punct', ',')] + arg
+                args = args[:len(macro.params) - 1] + [variadic]
+            # CL.EXE warns (C4002, C4003) and carries on with missing arguments empty
+            args = (args + [[] for _ in macro.params])[:len(macro.params)]
+            hide = (token.hide & rparen.hide) | {name}
+            stack.extend(reversed(self.substitute(macro, args, hide)))
+        return out
+
+    def substitute(self, macro, args, hide):
+        body = macro.body
+        params = macro.params
+        result = []
+        expanded = {}
+        i = 0
+        while i < len(body):
+            token = body[i]
+            if params is not None and token.kind == 'punct' and token.text in ('#', '#@'):
+                k = next_significant(body, i + 1)
+                if k is not None and body[k].kind == 'id' and body[k].text in params:
+                    result.append(self.stringify(args[params.index(body[k].text)], token.text == '#@'))
+                    i = k + 1
+                    continue
+            if token.kind == 'punct' and token.text == '##':
+                while result and result[-1].kind == 'ws':
+                    result.pop()
+                k = next_significant(body, i + 1)
+                if k is None:
+                    i += 1
+                    continue
+                right = body[k]
+                if params is not None and right.kind == 'id' and right.text in params:
+                    right_tokens = strip_ws(args[params.index(right.text)])
+                else:
+                    right_tokens = [right]
+                left = result.pop() if result else None
+                if left is not None and left.kind != 'placemarker' and right_tokens:
+                    result.extend(tokenize(left.text + right_tokens[0].text))
+                    result.extend(right_tokens[1:])
+                elif right_tokens:
+                    result.extend(right_tokens)
+                elif left is not None:
+                    result.append(left)
+                i = k + 1
+                continue
+            if params is not None and token.kind == 'id' and token.text in params:
+                index = params.index(token.text)
+                k = next_significant(body, i + 1)
+                if k is not None and body[k].kind == 'punct' and body[k].text == '##':
+                    # The left operand of ## is the argument as written
+                    result.extend(strip_ws(args[index]) or [Token('placemarker', '')])
+                else:
+                    if index not in expanded:
+                        expanded[index] = self.expand(args[index])
+                    result.extend(expanded[index])
+                i += 1
+                continue
+            result.append(token)
+            i += 1
+        return [Token(t.kind, t.text, t.hide | hide) for t in result if t.kind != 'placemarker']
+
+    def stringify(self, arg, charize=False):
+        parts = []
+        for token in strip_ws(arg):
+            if token.kind == 'ws':
+                if parts and parts[-1] != ' ':
+                    parts.append(' ')
+            elif token.kind in ('str', 'chr'):
+                parts.append(token.text.replace('\\', '\\\\').replace('"', '\\"'))
+            else:
+                parts.append(token.text)
+        text = ''.join(parts)
+        return Token('chr', f"'{text}'") if charize else Token('str', f'"{text}"')
+
+    def builtin(self, token):
+        spelling, line = self.position
+        if token.text == '__FILE__':
+            return Token('str', string_literal(spelling), token.hide)
+        if token.text == '__LINE__':
+            return Token('num', str(line), token.hide)
+        if token.text == '__DATE__':
+            return Token('str', self.date, token.hide)
+        if token.text == '__TIME__':
+            return Token('str', self.time, token.hide)
+        return Token('str', string_literal(time.strftime('%a %b %d %H:%M:%S %Y', time.localtime(
+            os.path.getmtime(self.stack[-1][0])))), token.hide)
+
+    # Conditional expressions
+
+    def evaluate(self, tokens):
+        tokens = self.replace_defined(tokens)
+        tokens = [token for token in self.expand(tokens) if token.kind != 'ws']
+        parser = ExpressionParser(self.replace_defined(tokens))
+        value = parser.parse()
+        if parser.pos != len(parser.tokens):
+            raise PreprocessError(f"unexpected '{parser.tokens[parser.pos].text}' in #if expression")
+        return value != 0
+
+    def replace_defined(self, tokens):
+        result = []
+        i = 0
+        while i < len(tokens):
+            token = tokens[i]
+            if token.kind == 'id' and token.text == 'defined':
+                k = next_significant(tokens, i + 1)
+                parens = k is not None and tokens[k].text == '('
+                if parens:
+                    k = next_significant(tokens, k + 1)
+                if k is None or tokens[k].kind != 'id':
+                    raise PreprocessError("'defined' without an identifier")
+                name = tokens[k].text
+                if parens:
+                    k = next_significant(tokens, k + 1)
+                    if k is None or tokens[k].text != ')':
+                        raise PreprocessError("missing ')' after 'defined'")
+                result.append(Token('num', '1' if name in self.macros or name in BUILTINS else '0'))
+                i = k + 1
+                continue
+            result.append(token)
+            i += 1
+        return result
+
+    # Directives
+
+    def resolve_include(self, name, quoted):
+        """Return (path, spelling) of an included file, searched the way CL.EXE searches."""
+        if re.match(r'^[A-Za-z]:|^[\\/]', name):
+            path = wine_to_unix(name) if re.match(r'^[A-Za-z]:', name) else name.replace('\\', '/')
+            return (os.path.normpath(path), name) if os.path.isfile(path) else (None, None)
+        search = []
+        if quoted:
+            for path, spelling in reversed(self.stack):
+                cut = max(spelling.rfind('\\'), spelling.rfind('/'))
+                search.append((os.path.dirname(path), spelling[:cut] if cut >= 0 else ''))
+        search.extend(self.include_dirs)
+        for directory, spelling in search:
+            path = find_file_nocase(directory, name)
+            if path:
+                return path, (spelling.rstrip('\\/') + '\\' + name) if spelling else name
+        return None, None
+
+    def include(self, rest):
+        match = INCLUDE_RE.match(rest)
+        if not match:
+            # #include MACRO
+            match = INCLUDE_RE.match(self.join(self.expand(tokenize(rest))))
+            if not match:
+                raise PreprocessError(f"#include expected a file name, found '{rest.strip()}'")
+        name = match.group(1) if match.group(1) is not None else match.group(2)
+        path, spelling = self.resolve_include(name, match.group(1) is not None)
+        if path is None:
+            raise PreprocessError(f"Cannot open include file: '{name}': No such file or directory")
+        self.process(path, spelling)
+
+    def define_directive(self, rest):
+        match = re.match(r'\s*([A-Za-z_$][A-Za-z0-9_$]*)(\()?', rest)
+        if not match:
+            raise PreprocessError("#define expected an identifier")
+        name = match.group(1)
+        rest = rest[match.end():]
+        params = None
+        if match.group(2):
+            close = rest.find(')')
+            if close < 0:
+                raise PreprocessError(f"missing ')' in the parameter list of macro '{name}'")
+            params = [param.strip() for param in rest[:close].split(',')]
+            if params == ['']:
+                params = []
+            if params and params[-1] == '...':
+                # Not in CL.EXE 6.0, but cheap to accept in headers shared with newer compilers
+                params[-1] = '__VA_ARGS__'
+            rest = rest[close + 1:]
+        self.macros[name] = Macro(name, params, self.macro_body(tokenize(rest)))
+
+    def process(self, path, spelling):
+        """Preprocess one file into the output, including what it includes."""
+        real = os.path.realpath(path)
+        if real in self.once:
+            return
+        source = self.source(path)
+        if source.guard and source.guard in self.macros:
+            return
+        if len(self.stack) >= MAX_INCLUDE_DEPTH:
+            raise PreprocessError(f"#include nested too deeply in {spelling}")
+        self.included.append(path)
+        self.stack.append((path, spelling))
+        delta = 0
+        conditions = []
+        active = True
+        lines = source.lines
+        i = 0
+        try:
+            while i < len(lines):
+                line, text = lines[i]
+                i += 1
+                self.position = (spelling, line + delta)
+                stripped = text.lstrip()
+                if stripped.startswith('#'):
+                    match = re.match(r'#\s*(\w*)(.*)$', stripped, re.DOTALL)
+                    directive, rest = match.group(1), match.group(2)
+                    if directive in ('if', 'ifdef', 'ifndef'):
+                        if not active:
+                            conditions.append([False, True, active])
+                            continue
+                        if directive == 'if':
+                            value = self.evaluate(tokenize(rest))
+                        else:
+                            words = rest.split()
+                            if not words:
+                                raise PreprocessError(f"#{directive} expected an identifier")
+                            value = (words[0] in self.macros or words[0] in BUILTINS) == (directive == 'ifdef')
+                        conditions.append([value, value, active])
+                        active = value
+                    elif directive == 'elif':
+                        if not conditions:
+                            raise PreprocessError("#elif without #if")
+                        condition = conditions[-1]
+                        if condition[1] or not condition[2]:
+                            active = False
+                        else:
+                            active = self.evaluate(tokenize(rest))
+                            condition[1] = active
+                        condition[0] = active
+                    elif directive == 'else':
+                        if not conditions:
+                            raise PreprocessError("#else without #if")
+                        condition = conditions[-1]
+                        active = condition[2] and not condition[1]
+                        condition[1] = True
+                        condition[0] = active
+                    elif directive == 'endif':
+                        if not conditions:
+                            raise PreprocessError("#endif without #if")
+                        active = conditions.pop()[2]
+                    elif not active:
+                        continue
+                    elif directive == 'include':
+                        self.include(rest)
+                    elif directive == 'define':
+                        self.define_directive(rest)
+                    elif directive == 'undef':
+                        words = rest.split()
+                        if words:
+                            self.macros.pop(words[0], None)
+                    elif directive == 'pragma':
+                        if rest.split() == ['once']:
+                            self.once.add(real)
+                        else:
+                            self.emit(spelling, line + delta, '#pragma' + rest.rstrip())
+                    elif directive == 'line':
+                        parts = self.join(self.expand(tokenize(rest))).split(None, 1)
+                        if not parts or not parts[0].isdigit():
+                            raise PreprocessError("#line expected a line number")
+                        delta = int(parts[0]) - (lines[i][0] if i < len(lines) else line + 1)
+                        if len(parts) > 1:
+                            spelling = parts[1].strip()[1:-1].replace('\\\\', '\\')
+                            self.stack[-1] = (path, spelling)
+                    elif directive == 'error':
+                        raise PreprocessError(f"#error {rest.strip()}")
+                    elif directive:
+                        # Includes #import, which needs the type library compiler
+                        raise PreprocessError(f"#{directive} is not supported on the host")
+                    continue
+
+                if not active:
+                    continue
+                tokens = tokenize(text)
+                while True:
+                    final = i >= len(lines) or lines[i][1].lstrip().startswith('#')
+                    try:
+                        expanded = self.expand(tokens, final)
+                        break
+                    except NeedMore as e:
+                        if e.args == ('name',) and not lines[i][1].lstrip().startswith('('):
+                            # A function-like macro's name used on its own, not an invocation
+                            expanded = self.expand(tokens)
+                            break
+                        tokens = tokens + [SPACE] + tokenize(lines[i][1])
+                        i += 1
+                output = self.join(expanded)
+                if output:
+                    self.emit(spelling, line + delta, output)
+            if conditions:
+                raise PreprocessError("#if without #endif")
+        except PreprocessError as e:
+            if not getattr(e, 'located', False):
+                e.args = (f"{self.position[0]}({self.position[1]}) : {e.args[0]}",)
+                e.located = True
+            raise
+        finally:
+            self.stack.pop()
+
+    def preprocess(self, path, spelling, forced_includes=()):
+        """Return the preprocessed text of a source file."""
+        for name in forced_includes:
+            include_path, include_spelling = self.resolve_include(name, True)
+            if include_path is None:
+                raise PreprocessError(f"Cannot open include file: '{name}': No such file or directory")
+            self.process(include_path, include_spelling)
+        self.process(path, spelling)
+        return ''.join(self.out)
+
+class ExpressionParser:
+    """Evaluates a macro-expanded #if expression."""
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.pos = 0
+
+    def peek(self):
+        return self.tokens[self.pos].text if self.pos < len(self.tokens) else None
+
+    def take(self):
+        if self.pos >= len(self.tokens):
+            raise PreprocessError("unexpected end of #if expression")
+        token = self.tokens[self.pos]
+        self.pos += 1
+        return token
+
+    def parse(self):
+        condition = self.binary(1)
+        if self.peek() == '?':
+            self.pos += 1
+            if_true = self.parse()
+            if self.take().text != ':':
+                raise PreprocessError("missing ':' in #if expression")
+            if_false = self.parse()
+            return if_true if condition else if_false
+        return condition
+
+    def binary(self, min_precedence):
+        left = self.unary()
+        while True:
+            op = self.peek()
+            precedence = BINARY_PRECEDENCE.get(op)
+            if precedence is None or precedence < min_precedence or self.tokens[self.pos].kind != 'punct':
+                return left
+            self.pos += 1
+            right = self.binary(precedence + 1)
+            left = self.apply(op, left, right)
+
+    def apply(self, op, left, right):
+        if op in ('/', '%'):
+            if right == 0:
+                # Only an error where CL.EXE evaluates it, which short-circuiting may avoid
+                return 0
+            quotient = abs(left) // abs(right) * (1 if (left >= 0) == (right >= 0) else -1)
+            return quotient if op == '/' else left - quotient * right
+        return {
+            '||': lambda: int(bool(left) or bool(right)), '&&': lambda: int(bool(left) and bool(right)),
+            '|': lambda: left | right, '^': lambda: left ^ right, '&': lambda: left & right,
+            '==': lambda: int(left == right), '!=': lambda: int(left != right),
+            '<': lambda: int(left < right), '>': lambda: int(left > right),
+            '<=': lambda: int(left <= right), '>=': lambda: int(left >= right),
+            '<<': lambda: left << right if right >= 0 else left >> -right,
+            '>>': lambda: left >> right if right >= 0 else left << -right,
+            '+': lambda: left + right, '-': lambda: left - right, '*': lambda: left * right,
+        }[op]()
+
+    def unary(self):
+        token = self.take()
+        if token.kind == 'punct':
+            if token.text == '(':
+                value = self.parse()
+                if self.take().text != ')':
+                    raise PreprocessError("missing ')' in #if expression")
+                return value
+            if token.text == '-':
+                return -self.unary()
+            if token.text == '+':
+                return self.unary()
+            if token.text == '~':
+                return ~self.unary()
+            if token.text == '!':
+                return int(not self.unary())
+        if token.kind == 'num':
+            match = NUMBER_RE.match(token.text)
+            if not match:
+                raise PreprocessError(f"invalid integer constant '{token.text}' in #if expression")
+            digits = match.group(1)
+            if digits.lower().startswith('0x'):
+                return int(digits, 16)
+            return int(digits, 8) if digits.startswith('0') and len(digits) > 1 else int(digits)
+        if token.kind == 'chr':
+            return char_value(token.text)
+        if token.kind == 'id':
+            # Identifiers left after expansion, true and false included, are 0
+            return 0
+        raise PreprocessError(f"unexpected '{token.text}' in #if expression")
+
+def char_value(text):
+    body = text[text.index("'") + 1:-1]
+    values = []
+    i = 0
+    while i < len(body):
+        if body[i] == '\\' and i + 1 < len(body):
+            c = body[i + 1]
+            if c in CHAR_ESCAPES:
+                values.append(CHAR_ESCAPES[c])
+                i += 2
+            elif c == 'x':
+                digits = re.match(r'[0-9a-fA-F]*', body[i + 2:]).group()
+                values.append(int(digits or '0', 16) & 0xff)
+                i += 2 + len(digits)
+            else:
+                digits = re.match(r'[0-7]{1,3}', body[i + 1:])
+                values.append(int(digits.group(), 8) if digits else ord(c))
+                i += 1 + (len(digits.group()) if digits else 1)
+        else:
+            values.append(ord(body[i]))
+            i += 1
+    value = 0
+    for byte in values:
+        value = (value << 8) | byte
+    # A single plain char is signed unless /J
+    if len(values) == 1 and value > 127 and not text.startswith('L'):
+        value -= 256
+    return value
+
+def preprocess_file(source, spelling, include_dirs, defines, undefines, compiler_flags, forced_includes=()):
+    """Preprocess one TU; returns (text, included files). Module level so a process pool can run it."""
+    preprocessor = Preprocessor(include_dirs, defines, undefines, compiler_flags,
+                                is_cplusplus(source, compiler_flags))
+    text = preprocessor.preprocess(source, spelling, forced_includes)
+    return text, preprocessor.included
+
+def main():
+    """
+    VC6-compatible C/C++ preprocessor.
+    Used by the CL proxy to preprocess on the host with VC6_PREPROCESS;
+    run directly, it prints what CL.EXE would compile for a source file.
+    """
+    parser = argparse.ArgumentParser(description="Host-side VC6 preprocessor")
+    parser.add_argument('source', help="Source file")
+    parser.add_argument('-I', dest='include_dirs', action='append', default=[], help="Include directory")
+    parser.add_argument('-D', dest='defines', action='append', default=[], help="Macro definition")
+    parser.add_argument('-U', dest='undefines', action='append', default=[], help="Macro to undefine")
+    parser.add_argument('--flag', action='append', default=[], help="CL.EXE flag that affects the predefined macros (e.g. /GX, /MD)")
+    parser.add_argument('-o', '--output', help="Write to a file instead of stdout")
+    parser.add_argument('--deps', action='store_true', help="List the files read instead of the output")
+    args = parser.parse_args()
+
+    from vc6proxy import unix_to_wine
+    include_dirs = [(os.path.abspath(d), unix_to_wine(os.path.abspath(d))) for d in args.include_dirs]
+    start = time.monotonic()
+    try:
+        text, included = preprocess_file(os.path.abspath(args.source), unix_to_wine(os.path.abspath(args.source)),
+                                         include_dirs, args.defines, args.undefines, args.flag)
+    except PreprocessError as e:
+        print(f"vc6cpp: {e}", file=sys.stderr)
+        sys.exit(1)
+    if args.deps:
+        text = ''.join(path + '\n' for path in included)
+    if args.output:
+        with open(args.output, 'w', encoding='latin-1') as f:
+            f.write(text)
+    else:
+        sys.stdout.write(text)
+    print(f"vc6cpp: {len(included)} file(s) in {time.monotonic() - start:.2f}s", file=sys.stderr)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import argparse
+
+# Add the current directory to the path
+script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(script_dir)
+
+from vc6proxy import IncludeScanner, load_compile_commands
+from vc6metrics import load_records
+
+def read_cache_value(build_dir, name):
+    """Return a variable from a build dir's CMakeCache.txt."""
+    try:
+        with open(os.path.join(build_dir, 'CMakeCache.txt'), 'r') as f:
+            for line in f:
+                if line.startswith(name + ':'):
+                    return line.split('=', 1)[1].strip()
+    except OSError:
+        pass
+    return None
+
+def compile_times(metrics_path):
+    """Return source path -> seconds of its most recent successful CL.EXE run."""
+    times = {}
+    if not metrics_path or not os.path.exists(metrics_path):
+        return times
+    for record in load_records(metrics_path):
+        job = record.get('job')
+        if record.get('tool') != 'cl' or record.get('returncode') or not job or ' ' in job:
+            continue
+        # VC6_PREPROCESS=verify outcomes aren't compiles and have no time
+        if 'preprocess_verify' in record or 'wall' not in record:
+            continue
+        times[os.path.normpath(os.path.join(record.get('cwd', ''), job))] = record['wall']
+    return times
+
+class HeaderStats:
+    def __init__(self, path, size):
+        self.path = path
+        self.size = size
+        self.transitive_size = size
+        self.tus = 0
+        self.self_cost = 0.0
+        self.transitive_cost = 0.0
+
+class HeaderCostReport:
+    """Attributes per-TU compile time to the headers each TU includes."""
+    def __init__(self):
+        self.headers = {}
+        self.edges = {}
+        self.sizes = {}
+        self.tus = 0
+        self.timed_tus = 0
+        self.total_time = 0.0
+        self.tu_records = []
+        self.source_roots = []
+
+    def size(self, path):
+        if path not in self.sizes:
+            try:
+                self.sizes[path] = os.path.getsize(path)
+            except OSError:
+                self.sizes[path] = 0
+        return self.sizes[path]
+
+    def add_build(self, build_dir, metrics_path):
+        source_root = read_cache_value(build_dir, 'CMAKE_HOME_DIRECTORY')
+        if source_root and source_root not in self.source_roots:
+            self.source_roots.append(source_root)
+
+        commands = load_compile_commands(build_dir)
+        times = compile_times(metrics_path)
+        known = sorted(times[c.source] for c in commands if c.source in times)
+        # TUs without a recorded run are charged the median compile time
+        fallback = known[len(known) // 2] if known else 1.0
+
+        scanners = {}
+        for command in commands:
+            key = tuple(command.include_dirs)
+            if key not in scanners:
+                scanners[key] = IncludeScanner(command.include_dirs)
+            scanner = scanners[key]
+            headers = [path for _, path in scanner.scan(command.source)]
+            for parent, children in scanner.edges.items():
+                self.edges.setdefault(parent, set()).update(children)
+
+            seconds = times.get(command.source)
+            if seconds is not None:
+                self.timed_tus += 1
+            else:
+                seconds = fallback
+            self.tus += 1
+            self.total_time += seconds
+
+            total_bytes = self.size(command.source) + sum(self.size(h) for h in headers)
+            for header in headers:
+                stats = self.headers.get(header)
+                if stats is None:
+                    stats = self.headers[header] = HeaderStats(header, self.size(header))
+                stats.tus += 1
+            if total_bytes:
+                self.tu_records.append((headers, seconds, total_bytes))
+
+    def reachable(self, header, cache):
+        """Return the set of headers reachable from header through the include graph."""
+        if header in cache:
+            return cache[header]
+        seen = {header}
+        stack = [header]
+        while stack:
+            for child in self.edges.get(stack.pop(), ()):
+                if child not in seen:
+                    seen.add(child)
+                    stack.append(child)
+        cache[header] = seen
+        return seen
+
+    def finish(self):
+        """Compute transitive sizes and spread each TU's time over the bytes it parses."""
+        cache = {}
+        for stats in self.headers.values():
+            stats.transitive_size = sum(self.size(h) for h in self.reachable(stats.path, cache))
+
+        for headers, seconds, total_bytes in self.tu_records:
+            for header in headers:
+                stats = self.headers[header]
+                stats.self_cost += seconds * stats.size / total_bytes
+                stats.transitive_cost += seconds * min(stats.transitive_size, total_bytes) / total_bytes
+
+    def tree(self, path):
+        for root in self.source_roots:
+            if path.startswith(root.rstrip('/') + '/'):
+                return os.path.relpath(path, root).split(os.sep)[0]
+        return 'system'
+
+    def display_path(self, path):
+        for root in self.source_roots:
+            if path.startswith(root.rstrip('/') + '/'):
+                return os.path.relpath(path, root)
+        return path
+
+    def to_json(self, ranked):
+        return {
+            'tus': self.tus,
+            'timed_tus': self.timed_tus,
+            'total_compile_time': self.total_time,
+            'headers': [{
+                'path': stats.path,
+                'tree': self.tree(stats.path),
+                'tus': stats.tus,
+                'size': stats.size,
+                'transitive_size': stats.transitive_size,
+                'self_cost': stats.self_cost,
+                'transitive_cost': stats.transitive_cost,
+            } for stats in ranked],
+        }
+
+    def print_text(self, ranked):
+        print(f"{self.tus} TUs ({self.timed_tus} with recorded compile times), {self.total_time:.1f}s of compile time, "
+              f"{len(self.headers)} headers")
+        trees = {}
+        for stats in self.headers.values():
+            tree = trees.setdefault(self.tree(stats.path), [0, 0.0])
+            tree[0] += 1
+            tree[1] += stats.self_cost
+        for tree, (count, cost) in sorted(trees.items(), key=lambda item: -item[1][1]):
+            print(f"  {tree:<14} {count:>5} headers, {cost:>9.1f}s parsing their own text")
+        print()
+        print(f"{'transitive s':>12} {'own s':>8} {'TUs':>5} {'own KiB':>8} {'trans KiB':>9}  header")
+        for stats in ranked:
+            print(f"{stats.transitive_cost:>12.1f} {stats.self_cost:>8.1f} {stats.tus:>5} "
+                  f"{stats.size / 1024:>8.1f} {stats.transitive_size / 1024:>9.1f}  {self.display_path(stats.path)}")
+
+def main():
+    """
+    Reports which headers dominate total compile time.
+    Each TU's CL.EXE time (from VC6_METRICS) is split over the bytes it
+    parses, using the include graph the CL proxy resolves for it.
+    """
+    parser = argparse.ArgumentParser(description="Header compile-time cost report for the VC6 build")
+    parser.add_argument('build_dirs', nargs='*', default=['.'], help="CMake build directories (e.g. Generals and GeneralsMD builds)")
+    parser.add_argument('--metrics', action='append', help="Metrics file per build dir (default: <build_dir>/.vc6/metrics.jsonl)")
+    parser.add_argument('--top', type=int, default=40, help="Number of headers to list")
+    parser.add_argument('--sort', choices=['transitive', 'self', 'tus', 'size'], default='transitive', help="Ranking key")
+    parser.add_argument('--tree', help="Only list headers from this top-level tree (e.g. GeneralsMD)")
+    parser.add_argument('--json', metavar='FILE', help="Also write the full report as JSON ('-' for stdout)")
+    args = parser.parse_args()
+
+    report = HeaderCostReport()
+    for i, build_dir in enumerate(args.build_dirs):
+        metrics = args.metrics[i] if args.metrics and i < len(args.metrics) else os.path.join(build_dir, '.vc6', 'metrics.jsonl')
+        try:
+            report.add_build(os.path.abspath(build_dir), metrics)
+        except OSError as e:
+            print(f"vc6headers: {build_dir}: {e}", file=sys.stderr)
+            sys.exit(1)
+    report.finish()
+
+    sort_keys = {
+        'transitive': lambda s: s.transitive_cost,
+        'self': lambda s: s.self_cost,
+        'tus': lambda s: s.tus,
+        'size': lambda s: s.transitive_size,
+    }
+    ranked = sorted(report.headers.values(), key=sort_keys[args.sort], reverse=True)
+    if args.tree:
+        ranked = [stats for stats in ranked if report.tree(stats.path) == args.tree]
+
+    if args.json == '-':
+        json.dump(report.to_json(ranked), sys.stdout, indent=1)
+        print()
+    else:
+        report.print_text(ranked[:args.top])
+        if args.json:
+            with open(args.json, 'w') as f:
+                json.dump(report.to_json(ranked), f, indent=1)
+
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
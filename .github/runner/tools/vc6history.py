@@ -0,0 +1,197 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+import sqlite3
+import hashlib
+import argparse
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS samples (
+    id INTEGER PRIMARY KEY,
+    build TEXT NOT NULL,
+    time REAL NOT NULL,
+    tool TEXT NOT NULL,
+    job TEXT NOT NULL,
+    flags TEXT NOT NULL,
+    duration REAL NOT NULL,
+    returncode INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS samples_key ON samples (tool, job, flags);
+CREATE INDEX IF NOT EXISTS samples_build ON samples (build);
+"""
+
+# Jobs needed before whole-build drift is factored out of the comparison
+MIN_DRIFT_JOBS = 20
+
+def flags_key(flags):
+    """Short stable key for a job's flag set."""
+    return hashlib.sha1((flags or '').encode('utf-8')).hexdigest()[:16]
+
+def median(values):
+    values = sorted(values)
+    n = len(values)
+    if not n:
+        return None
+    return values[n // 2] if n % 2 else (values[n // 2 - 1] + values[n // 2]) / 2
+
+class HistoryDB:
+    """SQLite history of proxy job durations, keyed by tool, job and flag set."""
+    def __init__(self, path):
+        self.path = path
+        # Every parallel proxy job writes here, so wait for the lock instead of failing
+        self.conn = sqlite3.connect(path, timeout=60)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def record(self, build, tool, job, flags, duration, returncode):
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO samples (build, time, tool, job, flags, duration, returncode) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (build, time.time(), tool, job, flags_key(flags), duration, returncode))
+
+    def builds(self):
+        """Return (build, first sample time, job count, total seconds) oldest first."""
+        return self.conn.execute(
+            "SELECT build, MIN(time), COUNT(*), SUM(duration) FROM samples WHERE returncode = 0 "
+            "GROUP BY build ORDER BY MIN(time)").fetchall()
+
+    def durations(self, builds):
+        """Return (tool, job, flags) -> successful durations recorded in the given builds."""
+        result = {}
+        if not builds:
+            return result
+        placeholders = ','.join('?' * len(builds))
+        rows = self.conn.execute(
+            f"SELECT tool, job, flags, duration FROM samples WHERE returncode = 0 AND build IN ({placeholders})",
+            list(builds))
+        for tool, job, flags, duration in rows:
+            result.setdefault((tool, job, flags), []).append(duration)
+        return result
+
+    def typical_duration(self, tool, job, flags, limit=10):
+        """Median of the most recent successful durations of a job, or None."""
+        rows = self.conn.execute(
+            "SELECT duration FROM samples WHERE tool = ? AND job = ? AND flags = ? AND returncode = 0 "
+            "ORDER BY time DESC LIMIT ?", (tool, job, flags_key(flags), limit)).fetchall()
+        return median([row[0] for row in rows])
+
+class Regression:
+    def __init__(self, key, baseline, current, ratio, normalized):
+        self.tool, self.job, self.flags = key
+        self.baseline = baseline
+        self.current = current
+        self.ratio = ratio
+        self.normalized = normalized
+
+def compare(db, baseline_builds, current_builds, threshold, min_delta, noise_factor):
+    """Return (regressions, build drift, compared keys, keys without a baseline)."""
+    baseline = db.durations(baseline_builds)
+    current = db.durations(current_builds)
+
+    pairs = []
+    unmatched = 0
+    for key, samples in current.items():
+        if key not in baseline:
+            unmatched += 1
+            continue
+        pairs.append((key, baseline[key], samples))
+
+    # Whole-build drift (a slower runner, a busy machine) shouldn't flag every
+    # job, but it only means something over a reasonable number of jobs
+    ratios = [median(cur) / median(base) for _, base, cur in pairs if median(base) > 0]
+    drift = median(ratios) if len(ratios) >= MIN_DRIFT_JOBS else 1.0
+
+    regressions = []
+    for key, base, cur in pairs:
+        base_median = median(base)
+        cur_median = median(cur)
+        if base_median <= 0:
+            continue
+        delta = cur_median - base_median * drift
+        if delta < min_delta:
+            continue
+        normalized = cur_median / (base_median * drift)
+        if normalized < 1 + threshold:
+            continue
+        # With repeated baseline samples, ignore jobs that were this noisy before
+        if len(base) >= 3:
+            spread = median([abs(d - base_median) for d in base])
+            if delta < noise_factor * spread:
+                continue
+        # With repeated current samples, require the fastest one to be slow too
+        if len(cur) >= 2 and min(cur) < base_median * drift * (1 + threshold):
+            continue
+        regressions.append(Regression(key, base_median, cur_median, cur_median / base_median, normalized))
+
+    regressions.sort(key=lambda r: r.current - r.baseline, reverse=True)
+    return regressions, drift, len(pairs), unmatched
+
+def main():
+    """
+    Compile-time history kept by the proxies in VC6_HISTORY_DB.
+    Lists recorded builds and compares a build to a baseline, flagging
+    jobs whose duration grew past a threshold.
+    """
+    parser = argparse.ArgumentParser(description="VC6 proxy compile-time history and regression alerts")
+    parser.add_argument('--db', default=os.environ.get('VC6_HISTORY_DB'), help="History database (default: $VC6_HISTORY_DB)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    subparsers.add_parser('builds', help="List recorded builds")
+
+    compare_parser = subparsers.add_parser('compare', help="Flag jobs that got slower than the baseline")
+    compare_parser.add_argument('--current', action='append', help="Current build id(s) (default: the latest build)")
+    compare_parser.add_argument('--baseline', action='append', help="Baseline build id(s) (default: the builds before current)")
+    compare_parser.add_argument('--baseline-count', type=int, default=5, help="Number of previous builds in the default baseline")
+    compare_parser.add_argument('--threshold', type=float, default=0.25, help="Relative growth to flag (default: %(default)s)")
+    compare_parser.add_argument('--min-delta', type=float, default=1.0, help="Ignore growth below this many seconds")
+    compare_parser.add_argument('--noise', type=float, default=3.0, help="Growth must exceed this many baseline deviations")
+    compare_parser.add_argument('--top', type=int, default=30, help="Number of regressions to list")
+    compare_parser.add_argument('--fail', action='store_true', help="Exit with status 1 when regressions are found")
+
+    args = parser.parse_args()
+    if not args.db or not os.path.exists(args.db):
+        print("vc6history: no history database, build with VC6_HISTORY_DB=<file>", file=sys.stderr)
+        sys.exit(2)
+
+    db = HistoryDB(args.db)
+    builds = db.builds()
+
+    if args.command == 'builds':
+        for build, started, jobs, total in builds:
+            print(f"{build:<40} {time.strftime('%Y-%m-%d %H:%M', time.localtime(started))} {jobs:>6} jobs {total:>9.1f}s")
+        sys.exit(0)
+
+    order = [b[0] for b in builds]
+    current = args.current or order[-1:]
+    if args.baseline:
+        baseline = args.baseline
+    else:
+        first = min((order.index(b) for b in current if b in order), default=len(order))
+        baseline = order[max(0, first - args.baseline_count):first]
+    if not current or not baseline:
+        if args.current or args.baseline:
+            print("vc6history: need at least a baseline and a current build to compare", file=sys.stderr)
+            sys.exit(2)
+        # The first build on a fresh history database has nothing to compare with
+        print("vc6history: no earlier build recorded yet, nothing to compare")
+        sys.exit(0)
+
+    regressions, drift, compared, unmatched = compare(db, baseline, current, args.threshold, args.min_delta, args.noise)
+    print(f"vc6history: {', '.join(current)} vs {len(baseline)} baseline build(s): {compared} jobs compared, "
+          f"{unmatched} new or with changed flags, whole-build drift x{drift:.2f}")
+    if not regressions:
+        print("vc6history: no regressions")
+        sys.exit(0)
+
+    print(f"vc6history: {len(regressions)} job(s) regressed by more than {args.threshold:.0%}:")
+    for r in regressions[:args.top]:
+        print(f"  {r.tool:<5} {r.baseline:>7.1f}s -> {r.current:>7.1f}s (x{r.ratio:.2f}, x{r.normalized:.2f} after drift)  {r.job}")
+    sys.exit(1 if args.fail else 0)
+
+if __name__ == "__main__":
+    main()
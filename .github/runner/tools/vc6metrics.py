@@ -0,0 +1,135 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import argparse
+
+def load_records(path):
+    """Read the JSON-lines metrics file written by the proxies (VC6_METRICS)."""
+    records = []
+    with open(path, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                records.append(json.loads(line))
+            except ValueError:
+                # A job killed mid-write can leave a truncated last line
+                continue
+    return records
+
+def tool_totals(records):
+    totals = {}
+    for record in records:
+        total = totals.setdefault(record.get('tool') or '?', {
+            'jobs': 0, 'failed': 0, 'killed': 0, 'wall': 0.0, 'user': 0.0, 'sys': 0.0,
+            'wineserver_cpu': 0.0, 'max_rss_kb': 0, 'read_blocks': 0, 'write_blocks': 0, 'slot_wait': 0.0,
+        })
+        total['jobs'] += 1
+        total['failed'] += 1 if record.get('returncode') else 0
+        total['killed'] += len(record.get('watchdog', []))
+        for key in ('wall', 'user', 'sys', 'wineserver_cpu', 'read_blocks', 'write_blocks', 'slot_wait'):
+            total[key] += record.get(key, 0)
+        total['max_rss_kb'] = max(total['max_rss_kb'], record.get('max_rss_kb', 0))
+    return totals
+
+def worst(records, key, count):
+    ranked = [r for r in records if r.get(key) is not None]
+    ranked.sort(key=lambda r: r[key], reverse=True)
+    return ranked[:count]
+
+def verify_results(records):
+    """Group the VC6_PREPROCESS=verify outcomes by result (same, different, failed, unsupported)."""
+    results = {}
+    for record in records:
+        results.setdefault(record['preprocess_verify'], []).append(record)
+    return results
+
+def summarize(records, count):
+    verified = [r for r in records if 'preprocess_verify' in r]
+    records = [r for r in records if 'preprocess_verify' not in r]
+    return {
+        'jobs': len(records),
+        'tools': tool_totals(records),
+        'max_rss_kb': worst(records, 'max_rss_kb', count),
+        'cpu': worst([dict(r, cpu=r.get('user', 0) + r.get('sys', 0)) for r in records], 'cpu', count),
+        'wall': worst(records, 'wall', count),
+        'killed': [r for r in records if r.get('watchdog')],
+        'io': worst([dict(r, io_blocks=r.get('read_blocks', 0) + r.get('write_blocks', 0)) for r in records], 'io_blocks', count),
+        'preprocess_verify': verify_results(verified),
+    }
+
+def job_name(record):
+    job = record.get('job') or '?'
+    return os.path.relpath(job, record['cwd']) if os.path.isabs(job) and record.get('cwd') else job
+
+def print_summary(summary, rss_limit_mb):
+    print(f"{summary['jobs']} Wine jobs")
+    print(f"{'tool':<6} {'jobs':>6} {'failed':>6} {'wall s':>10} {'user s':>10} {'sys s':>9} {'wineserver s':>13} {'peak RSS MiB':>13}")
+    for tool, total in sorted(summary['tools'].items()):
+        print(f"{tool:<6} {total['jobs']:>6} {total['failed']:>6} {total['wall']:>10.1f} {total['user']:>10.1f} "
+              f"{total['sys']:>9.1f} {total['wineserver_cpu']:>13.1f} {total['max_rss_kb'] / 1024:>13.0f}")
+    print("(wineserver time is measured per job while other jobs run, so it over-counts shared time)")
+    slot_wait = sum(total['slot_wait'] for total in summary['tools'].values())
+    if slot_wait:
+        print(f"Jobs waited {slot_wait:.1f}s in total for a Wine slot (VC6_WINE_SLOTS)")
+
+    if summary['killed']:
+        print(f"\nKilled by the watchdog: {len(summary['killed'])} job(s)")
+        for record in summary['killed']:
+            outcome = 'failed' if record.get('returncode') else 'recovered on retry'
+            print(f"  {', '.join(record['watchdog']):<16} {outcome:<18} {record.get('tool', '?'):<5} {job_name(record)}")
+
+    sections = [
+        ('max_rss_kb', "Peak memory", lambda r: f"{r['max_rss_kb'] / 1024:8.0f} MiB"),
+        ('cpu', "CPU time (user+sys)", lambda r: f"{r['cpu']:8.1f} s"),
+        ('wall', "Wall time", lambda r: f"{r['wall']:8.1f} s"),
+        ('io', "Block I/O", lambda r: f"{r['io_blocks'] * 512 / 2**20:8.1f} MiB"),
+    ]
+    for key, title, fmt in sections:
+        print(f"\nWorst offenders: {title}")
+        for record in summary[key]:
+            flag = ''
+            if key == 'max_rss_kb' and record['max_rss_kb'] / 1024 > rss_limit_mb:
+                flag = '  <-- over limit'
+            print(f"  {fmt(record)}  {record.get('tool', '?'):<5} {job_name(record)}{flag}")
+
+    results = summary['preprocess_verify']
+    if results:
+        print(f"\nHost preprocessing (VC6_PREPROCESS=verify): {sum(len(r) for r in results.values())} source(s), "
+              + ', '.join(f"{len(results[result])} {result}" for result in ('same', 'different', 'failed', 'unsupported')
+                          if result in results))
+        for result in ('different', 'failed', 'unsupported'):
+            for record in results.get(result, []):
+                sections = f"  ({', '.join(record['sections'])})" if record.get('sections') else ''
+                print(f"  {result:<11}  {job_name(record)}{sections}")
+
+def main():
+    """
+    Summarizes the per-job resource usage the proxies record with VC6_METRICS.
+    Prints per-tool totals and the jobs using the most memory, CPU, time and I/O,
+    and the objects that changed when preprocessed on the host.
+    """
+    parser = argparse.ArgumentParser(description="Summarize VC6 proxy resource metrics")
+    parser.add_argument('metrics', nargs='?', default=os.environ.get('VC6_METRICS'), help="Metrics file (default: $VC6_METRICS)")
+    parser.add_argument('--top', type=int, default=10, help="Number of worst offenders to list")
+    parser.add_argument('--rss-limit', type=int, default=1024, help="Flag jobs whose peak RSS exceeds this many MiB")
+    parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+    args = parser.parse_args()
+
+    if not args.metrics or not os.path.exists(args.metrics):
+        print("vc6metrics: no metrics file, build with VC6_METRICS=<file>", file=sys.stderr)
+        sys.exit(1)
+
+    summary = summarize(load_records(args.metrics), args.top)
+    if args.json:
+        json.dump(summary, sys.stdout, indent=1)
+        print()
+    else:
+        print_summary(summary, args.rss_limit)
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
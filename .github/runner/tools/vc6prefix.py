@@ -0,0 +1,242 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+import shutil
+import argparse
+import subprocess
+
+# Add the current directory to the path
+script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(script_dir)
+
+from vc6proxy import SCRIPT_DIR, unix_to_wine
+
+DEFAULT_RAM_DIR = os.environ.get('VC6_RAMDISK', '/dev/shm/vc6')
+
+# Headroom left on the RAM-backed filesystem for the build's own temporaries
+RESERVE_BYTES = 256 * 1024 * 1024
+
+def tree_size(path):
+    """Return the apparent size in bytes of a directory tree, without following links."""
+    total = 0
+    for root, dirs, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+def wine_env(prefix, tools_root=None):
+    env = os.environ.copy()
+    env['WINEPREFIX'] = prefix
+    if tools_root:
+        env['VC6_TOOLS_ROOT'] = unix_to_wine(tools_root)
+    return env
+
+def probe(env):
+    """Time one cmd.exe + setup.bat round trip, the fixed cost of every proxy job."""
+    setup = unix_to_wine(os.path.join(SCRIPT_DIR, 'setup.bat'))
+    start = time.monotonic()
+    result = subprocess.run(['wine', 'cmd', '/c', setup], env=env,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode, time.monotonic() - start
+
+def measure(env, label):
+    """Return (first, later) probe times for a prefix, or None if Wine isn't usable."""
+    returncode, first = probe(env)
+    if returncode != 0:
+        print(f"vc6prefix: {label} prefix is not ready (cmd.exe returned {returncode})", file=sys.stderr)
+        return None
+    _, later = probe(env)
+    print(f"vc6prefix: {label}: first job {first:.2f}s, later jobs {later:.2f}s")
+    return first, later
+
+def wineserver_running():
+    result = subprocess.run(['pgrep', '-x', 'wineserver'], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    return result.returncode == 0
+
+def prepare(args):
+    source_prefix = os.environ.get('WINEPREFIX', os.path.expanduser('~/.wine'))
+    ram_dir = os.path.abspath(args.ram_dir)
+    prefix = os.path.join(ram_dir, 'prefix')
+    tools_root = os.path.join(ram_dir, 'VC6SP6')
+    source_tools = os.path.join(SCRIPT_DIR, 'VC6SP6')
+
+    if not os.path.isdir(source_prefix):
+        print(f"vc6prefix: {source_prefix} is not a Wine prefix, run init.bat first", file=sys.stderr)
+        return 1
+
+    # Baseline: a cold wineserver on the image's (overlay filesystem) prefix
+    subprocess.run(['wineserver', '-k'], env=wine_env(source_prefix), stderr=subprocess.DEVNULL)
+    subprocess.run(['wineserver', '-w'], env=wine_env(source_prefix), stderr=subprocess.DEVNULL)
+    baseline = measure(wine_env(source_prefix), "overlay prefix")
+
+    os.makedirs(ram_dir, exist_ok=True)
+    needed = tree_size(source_prefix) + RESERVE_BYTES
+    copy_tools = os.path.isdir(source_tools) and not args.no_tools
+    if copy_tools:
+        needed += tree_size(source_tools)
+    free = shutil.disk_usage(ram_dir).free
+    if free < needed:
+        print(f"vc6prefix: {ram_dir} has {free // 2**20} MiB free, {needed // 2**20} MiB needed "
+              "(run the container with a larger --shm-size)", file=sys.stderr)
+        return 1
+
+    start = time.monotonic()
+    if os.path.exists(prefix):
+        shutil.rmtree(prefix)
+    shutil.copytree(source_prefix, prefix, symlinks=True)
+    if copy_tools and not os.path.isdir(tools_root):
+        shutil.copytree(source_tools, tools_root, symlinks=True)
+    print(f"vc6prefix: copied prefix{' and VC6 toolchain' if copy_tools else ''} to {ram_dir} "
+          f"in {time.monotonic() - start:.1f}s")
+
+    env = wine_env(prefix, tools_root if copy_tools else None)
+    subprocess.Popen(['wineserver', '-p'], env=env)
+
+    # Wait for the persistent wineserver to finish booting the prefix
+    deadline = time.monotonic() + args.timeout
+    while True:
+        returncode, _ = probe(env)
+        if returncode == 0:
+            break
+        if time.monotonic() > deadline:
+            print(f"vc6prefix: prefix {prefix} did not become ready within {args.timeout}s", file=sys.stderr)
+            return 1
+        time.sleep(0.5)
+
+    warm = measure(env, "tmpfs prefix, persistent wineserver")
+
+    env_file = os.path.join(ram_dir, 'env.sh')
+    with open(env_file, 'w') as f:
+        f.write(f"export WINEPREFIX='{prefix}'\n")
+        if copy_tools:
+            f.write(f"export VC6_TOOLS_ROOT='{unix_to_wine(tools_root)}'\n")
+    print(f"vc6prefix: ready, source {env_file} to use it")
+
+    if baseline and warm:
+        print(f"vc6prefix: saved {baseline[0] - warm[0]:.2f}s on the first compile, "
+              f"{baseline[1] - warm[1]:.2f}s on each later compile")
+    return 0
+
+def scratch(args):
+    """Create an empty scratch area on tmpfs and map it to a Wine drive letter."""
+    prefix = os.environ.get('WINEPREFIX', os.path.expanduser('~/.wine'))
+    scratch_dir = os.path.join(os.path.abspath(args.ram_dir), 'scratch')
+    drive = args.drive.rstrip(':').lower()
+
+    # build.sh empties it again before every build
+    if os.path.exists(scratch_dir):
+        shutil.rmtree(scratch_dir)
+    os.makedirs(os.path.join(scratch_dir, 'tmp'))
+
+    free = shutil.disk_usage(scratch_dir).free
+    if free < args.size * 2**20:
+        print(f"vc6prefix: {scratch_dir} has {free // 2**20} MiB free, {args.size} MiB requested "
+              "(run the container with a larger --shm-size)", file=sys.stderr)
+        return 1
+
+    dosdevice = os.path.join(prefix, 'dosdevices', f"{drive}:")
+    if os.path.lexists(dosdevice):
+        os.unlink(dosdevice)
+    os.symlink(scratch_dir, dosdevice)
+
+    env_file = os.path.join(os.path.abspath(args.ram_dir), 'scratch.sh')
+    with open(env_file, 'w') as f:
+        f.write(f"export VC6_SCRATCH_DIR='{scratch_dir}'\n")
+        f.write(f"export VC6_SCRATCH_DRIVE='{drive.upper()}'\n")
+        # CL.EXE and LINK.EXE put their own temporaries in %TEMP%
+        f.write(f"export TEMP='{drive.upper()}:\\tmp'\n")
+        f.write(f"export TMP='{drive.upper()}:\\tmp'\n")
+    print(f"vc6prefix: scratch area {scratch_dir} mapped to {drive.upper()}:, source {env_file} to use it")
+    return 0
+
+def view(args):
+    """Create the case-exact include view and map it to a Wine drive letter."""
+    prefix = os.environ.get('WINEPREFIX', os.path.expanduser('~/.wine'))
+    view_dir = os.path.join(os.path.abspath(args.ram_dir), 'view')
+    drive = args.drive.rstrip(':').lower()
+    roots = [os.path.abspath(root) for root in args.root]
+    if not roots:
+        print("vc6prefix: view needs at least one --root", file=sys.stderr)
+        return 2
+
+    # The proxies add entries as they compile, so the view is kept unless asked
+    if args.reset and os.path.exists(view_dir):
+        shutil.rmtree(view_dir)
+    os.makedirs(view_dir, exist_ok=True)
+
+    dosdevice = os.path.join(prefix, 'dosdevices', f"{drive}:")
+    if os.path.lexists(dosdevice):
+        os.unlink(dosdevice)
+    os.symlink(view_dir, dosdevice)
+
+    env_file = os.path.join(os.path.abspath(args.ram_dir), 'view.sh')
+    with open(env_file, 'w') as f:
+        f.write(f"export VC6_INCLUDE_VIEW='{view_dir}'\n")
+        f.write(f"export VC6_INCLUDE_VIEW_DRIVE='{drive.upper()}'\n")
+        f.write(f"export VC6_INCLUDE_VIEW_ROOTS='{os.pathsep.join(roots)}'\n")
+    print(f"vc6prefix: include view {view_dir} mapped to {drive.upper()}: for {', '.join(roots)}, "
+          f"source {env_file} to use it")
+    return 0
+
+def check(args):
+    prefix = os.path.join(os.path.abspath(args.ram_dir), 'prefix')
+    if not os.path.isdir(prefix):
+        print(f"vc6prefix: {prefix} has not been prepared", file=sys.stderr)
+        return 1
+    if not wineserver_running():
+        print("vc6prefix: no wineserver is running", file=sys.stderr)
+        return 1
+    returncode, elapsed = probe(wine_env(prefix))
+    if returncode != 0:
+        print(f"vc6prefix: prefix {prefix} is not ready", file=sys.stderr)
+        return 1
+    print(f"vc6prefix: prefix {prefix} ready, job startup {elapsed:.2f}s")
+    return 0
+
+def stop(args):
+    prefix = os.path.join(os.path.abspath(args.ram_dir), 'prefix')
+    return subprocess.run(['wineserver', '-k'], env=wine_env(prefix)).returncode
+
+def main():
+    """
+    Manages a pre-booted Wine prefix on a RAM-backed filesystem.
+    The prefix and VC98 toolchain are copied to tmpfs and kept warm by a
+    persistent wineserver so proxy jobs don't pay Wine's cold start.
+    """
+    parser = argparse.ArgumentParser(description="Pre-booted tmpfs Wine prefix for the VC6 proxies")
+    parser.add_argument('--ram-dir', default=DEFAULT_RAM_DIR, help="RAM-backed directory (default: %(default)s)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    prepare_parser = subparsers.add_parser('prepare', help="Copy the prefix to tmpfs and start a persistent wineserver")
+    prepare_parser.add_argument('--no-tools', action='store_true', help="Leave the VC6 toolchain on disk")
+    prepare_parser.add_argument('--timeout', type=float, default=60.0, help="Seconds to wait for the prefix to boot")
+    prepare_parser.set_defaults(func=prepare)
+
+    scratch_parser = subparsers.add_parser('scratch', help="Create the proxy scratch area and map it into Wine")
+    scratch_parser.add_argument('--size', type=int, default=512, help="Minimum free MiB to require on the scratch filesystem; "
+                                "checked once, usage is not capped (default: %(default)s)")
+    scratch_parser.add_argument('--drive', default='T', help="Wine drive letter for the scratch area (default: %(default)s)")
+    scratch_parser.set_defaults(func=scratch)
+
+    view_parser = subparsers.add_parser('view', help="Create the case-exact include view and map it into Wine")
+    view_parser.add_argument('--drive', default='S', help="Wine drive letter for the view (default: %(default)s)")
+    view_parser.add_argument('--root', action='append', default=[], help="Source or build root compiled through the view (repeatable)")
+    view_parser.add_argument('--reset', action='store_true', help="Drop the entries added by earlier builds")
+    view_parser.set_defaults(func=view)
+
+    check_parser = subparsers.add_parser('check', help="Check that the prepared prefix is ready")
+    check_parser.set_defaults(func=check)
+
+    stop_parser = subparsers.add_parser('stop', help="Stop the persistent wineserver")
+    stop_parser.set_defaults(func=stop)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import pstats
+import argparse
+
+def profile_files(directory, suffix, tool=None):
+    """Return the per-invocation profile files the proxies wrote to VC6_PROFILE."""
+    paths = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(suffix) and (tool is None or name.split('.', 1)[0] == tool):
+            paths.append(os.path.join(directory, name))
+    return paths
+
+def merge_stats(paths):
+    """Merge cProfile dumps into one pstats.Stats, skipping unreadable ones."""
+    stats = None
+    skipped = 0
+    for path in paths:
+        try:
+            if stats is None:
+                stats = pstats.Stats(path, stream=sys.stdout)
+            else:
+                stats.add(path)
+        except (OSError, EOFError, TypeError, ValueError):
+            # A job killed mid-dump leaves a truncated file
+            skipped += 1
+    return stats, skipped
+
+def merge_stacks(paths):
+    """Sum the collapsed stack samples of every invocation."""
+    stacks = {}
+    for path in paths:
+        with open(path, 'r') as f:
+            for line in f:
+                stack, _, count = line.rstrip('\n').rpartition(' ')
+                if stack and count.isdigit():
+                    stacks[stack] = stacks.get(stack, 0) + int(count)
+    return stacks
+
+def main():
+    """
+    Merges the per-invocation profiles the proxies write with VC6_PROFILE.
+    Prints the functions the proxies spend the most time in across the whole
+    build, and writes the combined pstats file and collapsed stacks for
+    flamegraph.pl or speedscope.
+    """
+    parser = argparse.ArgumentParser(description="Merge VC6 proxy profiles into a build-wide profile")
+    parser.add_argument('profile_dir', nargs='?', default=os.environ.get('VC6_PROFILE'), help="Profile directory (default: $VC6_PROFILE)")
+    parser.add_argument('--tool', help="Only merge the invocations of one proxy (cl, link, lib, midl, rc)")
+    parser.add_argument('--sort', default='cumulative', help="pstats sort key (default: %(default)s)")
+    parser.add_argument('--top', type=int, default=30, help="Number of functions to print")
+    parser.add_argument('--pstats', help="Write the merged profile to this file (for snakeviz, gprof2dot)")
+    parser.add_argument('--collapsed', help="Write the merged collapsed stacks to this file")
+    args = parser.parse_args()
+
+    if not args.profile_dir or not os.path.isdir(args.profile_dir):
+        print("vc6profile: no profile directory, build with VC6_PROFILE=<dir>", file=sys.stderr)
+        sys.exit(1)
+
+    paths = profile_files(args.profile_dir, '.prof', args.tool)
+    stats, skipped = merge_stats(paths)
+    if stats is None:
+        print(f"vc6profile: no profiles in {args.profile_dir}", file=sys.stderr)
+        sys.exit(1)
+
+    invocations = {}
+    for path in paths:
+        tool = os.path.basename(path).split('.', 1)[0]
+        invocations[tool] = invocations.get(tool, 0) + 1
+    print(f"{len(paths) - skipped} proxy invocations: "
+          + ', '.join(f"{count} {tool}" for tool, count in sorted(invocations.items()))
+          + (f" ({skipped} unreadable)" if skipped else ''))
+    if args.pstats:
+        stats.dump_stats(args.pstats)
+        print(f"vc6profile: merged profile written to {args.pstats}")
+    print(f"{stats.total_tt:.2f}s spent in the proxies, waits for Wine included\n")
+    stats.strip_dirs().sort_stats(args.sort).print_stats(args.top)
+
+    stacks = merge_stacks(profile_files(args.profile_dir, '.stacks', args.tool))
+    if args.collapsed:
+        with open(args.collapsed, 'w') as f:
+            for stack, count in sorted(stacks.items()):
+                f.write(f"{stack} {count}\n")
+        print(f"vc6profile: {sum(stacks.values())} stack samples written to {args.collapsed}")
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
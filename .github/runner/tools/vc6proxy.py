@@ -5,22 +5,96 @@ import sys
 import subprocess
 import tempfile
 import re
+import shlex
 import shutil
 import platform
 import io
+import filecmp
+import hashlib
+import json
+import time
+import signal
+import socket
 import traceback
 from pathlib import Path
 from contextlib import contextmanager
 
 # Global variables
 VERBOSE = os.environ.get('VC6_VERBOSE', '0').lower() in ('1', 'true', 'yes')
+DEPFILE = os.environ.get('VC6_DEPFILE', '0').lower() in ('1', 'true', 'yes')
+DEBUG_INFO = os.environ.get('VC6_DEBUG_INFO', '').lower()
+DETERMINISTIC = os.environ.get('VC6_DETERMINISTIC', '0').lower() in ('1', 'true', 'yes')
+METRICS_FILE = os.environ.get('VC6_METRICS') or None
+HISTORY_DB = os.environ.get('VC6_HISTORY_DB') or None
+TRACE_FILE = os.environ.get('VC6_TRACE') or None
+PROFILE_DIR = os.environ.get('VC6_PROFILE') or None
+PROFILE_INTERVAL = float(os.environ.get('VC6_PROFILE_INTERVAL', '0.001'))
+STATUS_SOCKET = os.environ.get('VC6_STATUS_SOCKET') or None
+FLAGS_CACHE_DIR = os.environ.get('VC6_FLAGS_CACHE') or None
+PREPROCESS = os.environ.get('VC6_PREPROCESS', '').lower()
+BUILD_ID = os.environ.get('VC6_BUILD_ID') or 'unnamed'
 log_buffer = io.StringIO()
 last_command_successful = True
+last_command_usage = {}
 
 # Constants
 SCRIPT_DIR = os.path.dirname(os.path.realpath(__file__))
 ROOT_DIR = os.path.abspath(os.path.join(SCRIPT_DIR, ".."))
 IS_WINDOWS = platform.system() == "Windows"
+SHOW_INCLUDES_PREFIX = "Note: including file: "
+IMAGE_FILE_MACHINE_I386 = 0x14c
+ARCHIVE_MAGIC = b'!<arch>\n'
+ARCHIVE_MEMBER_HEADER_SIZE = 60
+
+# Mirrors the INCLUDE variable set by setup.bat
+VC98_DIR = os.path.join(SCRIPT_DIR, 'VC6SP6', 'VC98')
+SYSTEM_INCLUDE_DIRS = [
+    os.path.join(VC98_DIR, 'ATL', 'INCLUDE'),
+    os.path.join(VC98_DIR, 'INCLUDE'),
+    os.path.join(VC98_DIR, 'MFC', 'INCLUDE'),
+]
+
+# RAM-backed scratch area for proxy temporaries and the drive letter Wine
+# sees it as, both set up by vc6prefix.py scratch
+SCRATCH_DIR = os.path.abspath(os.environ['VC6_SCRATCH_DIR']) if os.environ.get('VC6_SCRATCH_DIR') else None
+SCRATCH_DRIVE = os.environ.get('VC6_SCRATCH_DRIVE', '').rstrip(':').upper() or None
+
+# Case-exact include view and its drive letter, set up by vc6prefix.py view
+INCLUDE_VIEW_DIR = os.path.abspath(os.environ['VC6_INCLUDE_VIEW']) if os.environ.get('VC6_INCLUDE_VIEW') else None
+INCLUDE_VIEW_DRIVE = os.environ.get('VC6_INCLUDE_VIEW_DRIVE', '').rstrip(':').upper() or None
+INCLUDE_VIEW_ROOTS = [os.path.abspath(root) for root in os.environ.get('VC6_INCLUDE_VIEW_ROOTS', '').split(os.pathsep) if root]
+
+# Watchdog for hung Wine jobs: a job may run TIMEOUT_FACTOR times its typical
+# recorded duration (at least TIMEOUT_MIN), or its tool's default without a
+# history, and is killed earlier if it does no CPU work or I/O for STALL_TIMEOUT
+TIMEOUT_OVERRIDE = os.environ.get('VC6_TIMEOUT')
+TIMEOUT_FACTOR = float(os.environ.get('VC6_TIMEOUT_FACTOR', '4'))
+TIMEOUT_MIN = float(os.environ.get('VC6_TIMEOUT_MIN', '120'))
+STALL_TIMEOUT = float(os.environ.get('VC6_STALL_TIMEOUT', '300'))
+DEFAULT_TIMEOUTS = {'cl': 900, 'lib': 600, 'link': 1800, 'midl': 300, 'rc': 300}
+WATCHDOG_POLL = 5
+KILL_GRACE = 5
+
+# Host-wide limit on concurrent Wine jobs, one locked file per slot, so make
+# can run more proxies than Wine slots while the extra ones preprocess on the host.
+# "auto" lets vc6tune.py move the limit to where the most work completes per second.
+WINE_SLOTS_AUTO = os.environ.get('VC6_WINE_SLOTS') == 'auto'
+WINE_SLOTS = 0 if WINE_SLOTS_AUTO else int(os.environ.get('VC6_WINE_SLOTS', '0') or 0)
+WINE_SLOTS_DIR = os.environ.get('VC6_WINE_SLOTS_DIR') or os.path.join(tempfile.gettempdir(), 'vc6-wine-slots')
+WINE_SLOT_POLL = 0.05
+
+# CL.EXE flags the host preprocessor can't stand in for: preprocess-only
+# output, precompiled headers, which need CL.EXE to see the real headers, and
+# /u and /X, which drop the predefined macros and the INCLUDE directories
+PREPROCESS_UNSUPPORTED = ('/E', '/EP', '/P', '/Zs', '/u', '/X')
+PREPROCESS_UNSUPPORTED_PREFIXES = ('/Yc', '/Yu', '/YX', '/Fp')
+
+# Command used to run Windows programs, replaced by a stand-in when replaying traces
+WINE_COMMAND = shlex.split(os.environ.get('VC6_WINE', 'wine'))
+
+# Environment that influences a proxy invocation, captured in VC6_TRACE records
+TRACED_ENV_PREFIXES = ('VC6_', 'WINE')
+TRACED_ENV_NAMES = ('PATH', 'TEMP', 'TMP', 'DISPLAY')
 
 def log(message, error=False):
     """Log a message to the buffer, immediately print if error or verbose mode."""
@@ -64,6 +138,8 @@ def unix_to_wine(path):
         return path
 
     if os.path.isabs(path): 
+        if SCRATCH_DRIVE and path.startswith(SCRATCH_DIR + os.sep):
+            return SCRATCH_DRIVE + ":" + path[len(SCRATCH_DIR):].replace("/", "\\")
         return "Z:" + path.replace("/", "\\")
     return path
 
@@ -76,68 +152,441 @@ def wine_to_unix(path):
         drive_letter = path[0]
         if drive_letter.lower() == 'z':
             return path[2:].replace("\\", "/")
+        elif SCRATCH_DRIVE and drive_letter.lower() == SCRATCH_DRIVE.lower():
+            return SCRATCH_DIR + path[2:].replace("\\", "/")
         else:
             drive_path = path[2:].replace('\\', '/')
             return "/mnt/{0}{1}".format(drive_letter.lower(), drive_path)
     
     return path.replace("\\", "/")
 
-def run_command_with_wine(cmd, env=None, cwd=None):
-    """Run a command with Wine, handling the environment and working directory."""
+class UsagePopen(subprocess.Popen):
+    """Popen that keeps the resource usage of the child (and its reaped children) when it exits."""
+    rusage = None
+
+    def _try_wait(self, wait_flags):
+        if not hasattr(os, 'wait4'):
+            return super()._try_wait(wait_flags)
+        try:
+            pid, sts, rusage = os.wait4(self.pid, wait_flags)
+            if pid:
+                self.rusage = rusage
+        except ChildProcessError:
+            pid, sts = self.pid, 0
+        return (pid, sts)
+
+def wineserver_cpu_time():
+    """Return the CPU seconds used so far by the wineserver, or None if there is none."""
     if IS_WINDOWS:
-        process = subprocess.Popen(
-            cmd, 
-            env=env, 
-            cwd=cwd, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE,
-            universal_newlines=True,
-            shell=True
-        )
-    else:
-        wine_cmd = ['wine'] + cmd
-        process = subprocess.Popen(
-            wine_cmd, 
-            env=env, 
-            cwd=cwd, 
-            stdout=subprocess.PIPE, 
-            stderr=subprocess.PIPE,
-            universal_newlines=True
-        )
-    
-    stdout, stderr = process.communicate()
-    
-    if process.returncode != 0:
-        log(f"Command failed with return code {process.returncode}", error=True)
-        if stdout:
-            log("STDOUT:", error=True)
-            log(stdout, error=True)
-        if stderr:
-            log("STDERR:", error=True)
-            log(stderr, error=True)
+        return None
+    try:
+        for pid in os.listdir('/proc'):
+            if not pid.isdigit():
+                continue
+            try:
+                with open(f'/proc/{pid}/stat', 'r') as f:
+                    stat = f.read()
+            except OSError:
+                continue
+            if stat[stat.index('(') + 1:stat.rindex(')')] == 'wineserver':
+                fields = stat[stat.rindex(')') + 2:].split()
+                return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+    except (OSError, ValueError):
+        pass
+    return None
+
+def _proc_stat(pid):
+    """Return (command name, fields after it) from /proc/<pid>/stat."""
+    with open(f'/proc/{pid}/stat', 'r') as f:
+        stat = f.read()
+    return stat[stat.index('(') + 1:stat.rindex(')')], stat[stat.rindex(')') + 2:].split()
+
+def session_processes(sid):
+    """Return the live pids of a session, leaving out the wineserver other jobs share."""
+    pids = []
+    for entry in os.listdir('/proc'):
+        if not entry.isdigit():
+            continue
+        try:
+            name, fields = _proc_stat(entry)
+        except (OSError, ValueError):
+            continue
+        if int(fields[3]) == sid and fields[0] != 'Z' and name != 'wineserver':
+            pids.append(int(entry))
+    return pids
+
+def session_activity(sid):
+    """Return a snapshot of a session's processes, CPU ticks and bytes of I/O, to compare for progress."""
+    pids = session_processes(sid)
+    total = 0
+    for pid in pids:
+        try:
+            _, fields = _proc_stat(pid)
+            total += int(fields[11]) + int(fields[12])
+            with open(f'/proc/{pid}/io', 'r') as f:
+                for line in f:
+                    if line.startswith(('rchar:', 'wchar:')):
+                        total += int(line.split()[1])
+        except (OSError, ValueError):
+            continue
+    return frozenset(pids), total
+
+def kill_session(sid):
+    """Terminate every process of a Wine job's session, then kill whatever is left."""
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        for pid in session_processes(sid):
+            try:
+                os.kill(pid, sig)
+            except ProcessLookupError:
+                pass
+        deadline = time.monotonic() + KILL_GRACE
+        while session_processes(sid) and time.monotonic() < deadline:
+            time.sleep(0.2)
+        if not session_processes(sid):
+            return
+
+def expected_duration(tool, job, flags):
+    """Median duration of a job in the recent builds of VC6_HISTORY_DB, or None."""
+    if not (HISTORY_DB and job and os.path.exists(HISTORY_DB)):
+        return None
+    try:
+        from vc6history import HistoryDB
+        db = HistoryDB(HISTORY_DB)
+        try:
+            return db.typical_duration(tool, job, flags)
+        finally:
+            db.close()
+    except Exception as e:
+        log(f"Warning: Failed to read history from {HISTORY_DB}: {str(e)}")
+        return None
+
+def job_timeout(tool, job, flags):
+    """Seconds a job may run before the watchdog kills it, or None for no limit."""
+    if TIMEOUT_OVERRIDE is not None:
+        return float(TIMEOUT_OVERRIDE) or None
+    
+    typical = expected_duration(tool, job, flags)
+    if typical:
+        return max(TIMEOUT_MIN, typical * TIMEOUT_FACTOR)
+    return DEFAULT_TIMEOUTS.get(tool, max(DEFAULT_TIMEOUTS.values()))
+
+def wait_with_watchdog(process, timeout):
+    """Wait for a Wine job like communicate(), killing it if it runs too long or stops making progress.
+    
+    Returns (stdout, stderr, reason), reason being None, 'timeout' or 'stall'.
+    """
+    if IS_WINDOWS or not (timeout or STALL_TIMEOUT):
+        return process.communicate() + (None,)
+    
+    start = time.monotonic()
+    last_progress = start
+    activity = None
+    while True:
+        try:
+            stdout, stderr = process.communicate(timeout=WATCHDOG_POLL)
+            return stdout, stderr, None
+        except subprocess.TimeoutExpired:
+            pass
+        
+        now = time.monotonic()
+        if timeout and now - start > timeout:
+            reason = 'timeout'
+        else:
+            current = session_activity(process.pid)
+            if current != activity:
+                activity = current
+                last_progress = now
+                continue
+            if not STALL_TIMEOUT or now - last_progress < STALL_TIMEOUT:
+                continue
+            reason = 'stall'
+        
+        kill_session(process.pid)
+        stdout, stderr = process.communicate()
+        return stdout, stderr, reason
+
+def wine_slot_limit():
+    if WINE_SLOTS_AUTO:
+        from vc6tune import current_limit
+        return current_limit(WINE_SLOTS_DIR)
+    return WINE_SLOTS
+
+def acquire_wine_slot():
+    """Take one of the VC6_WINE_SLOTS slots shared by every proxy on the host; returns (fd, seconds waited) or None."""
+    if not (WINE_SLOTS or WINE_SLOTS_AUTO) or IS_WINDOWS:
+        return None
+    import fcntl
+    os.makedirs(WINE_SLOTS_DIR, exist_ok=True)
+    start = None
+    while True:
+        # Re-read every round, the tuner may have raised or lowered the limit
+        limit = wine_slot_limit()
+        # Spread the first attempts so concurrent proxies don't all queue on slot 0
+        first = os.getpid() % limit
+        for n in range(limit):
+            fd = os.open(os.path.join(WINE_SLOTS_DIR, f"slot{(first + n) % limit}"), os.O_RDWR | os.O_CREAT, 0o666)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                continue
+            return fd, time.monotonic() - start if start is not None else 0.0
+        if start is None:
+            start = time.monotonic()
+        time.sleep(WINE_SLOT_POLL)
+
+def release_wine_slot(slot, cost=None, counted=True):
+    if slot:
+        # Closing the descriptor drops the lock
+        os.close(slot[0])
+        if WINE_SLOTS_AUTO and counted:
+            from vc6tune import record_completion
+            record_completion(WINE_SLOTS_DIR, waited=slot[1] > 0, cost=cost)
+
+def run_command_with_wine(cmd, env=None, cwd=None, timeout=None, label=None, on_start=None, cost=None, counted=True):
+    """Run a command with Wine, handling the environment and working directory.
+    
+    on_start is called once a Wine slot is held, right before Wine starts.
+    cost is the job's typical duration, which VC6_WINE_SLOTS=auto weighs it by;
+    with counted=False the run doesn't count as a completed job there.
+    """
+    global last_command_usage
+    
+    slot = acquire_wine_slot()
+    try:
+        if on_start:
+            on_start()
+        wineserver_before = wineserver_cpu_time() if METRICS_FILE else None
+        start = time.monotonic()
+    
+        watchdog = []
+        while True:
+            attempt_start = time.monotonic()
+            if IS_WINDOWS:
+                process = UsagePopen(
+                    cmd, 
+                    env=env, 
+                    cwd=cwd, 
+                    stdout=subprocess.PIPE, 
+                    stderr=subprocess.PIPE,
+                    universal_newlines=True,
+                    shell=True
+                )
+            else:
+                wine_cmd = WINE_COMMAND + cmd
+                # Its own session, so the watchdog can find and kill the whole Wine process tree
+                process = UsagePopen(
+                    wine_cmd, 
+                    env=env, 
+                    cwd=cwd, 
+                    stdout=subprocess.PIPE, 
+                    stderr=subprocess.PIPE,
+                    universal_newlines=True,
+                    start_new_session=True
+                )
+        
+            stdout, stderr, reason = wait_with_watchdog(process, timeout)
+            if reason is None:
+                break
+        
+            watchdog.append(reason)
+            what = f"ran past its {timeout:.0f}s timeout" if reason == 'timeout' else \
+                f"did no CPU work or I/O for {STALL_TIMEOUT:.0f}s"
+            elapsed = time.monotonic() - attempt_start
+            if len(watchdog) > 1:
+                print(f"vc6proxy: {label or ' '.join(cmd)} {what} again, killed after {elapsed:.0f}s", file=sys.stderr)
+                break
+            print(f"vc6proxy: {label or ' '.join(cmd)} {what}, killed after {elapsed:.0f}s; retrying in a fresh session",
+                  file=sys.stderr)
+    
+        last_command_usage = {'wall': time.monotonic() - start}
+        if watchdog:
+            last_command_usage['watchdog'] = watchdog
+            last_command_usage['retries'] = 1
+        if process.rusage:
+            last_command_usage.update({
+                'user': process.rusage.ru_utime,
+                'sys': process.rusage.ru_stime,
+                'max_rss_kb': process.rusage.ru_maxrss,
+                'read_blocks': process.rusage.ru_inblock,
+                'write_blocks': process.rusage.ru_oublock,
+            })
+        if wineserver_before is not None:
+            wineserver_after = wineserver_cpu_time()
+            if wineserver_after is not None and wineserver_after >= wineserver_before:
+                # Shared by every job running at the same time, so an upper bound
+                last_command_usage['wineserver_cpu'] = wineserver_after - wineserver_before
+    
+        if process.returncode != 0:
+            log(f"Command failed with return code {process.returncode}", error=True)
+            if stdout:
+                log("STDOUT:", error=True)
+                log(stdout, error=True)
+            if stderr:
+                log("STDERR:", error=True)
+                log(stderr, error=True)
+    
+    finally:
+        release_wine_slot(slot, cost, counted)
+    if slot and slot[1] > 0:
+        last_command_usage['slot_wait'] = slot[1]
     
     return process.returncode, stdout, stderr
 
+def append_json_line(path, record):
+    """Append a record to a JSON-lines file shared by all concurrent proxy jobs."""
+    try:
+        with open(path, 'a') as f:
+            # A single O_APPEND write keeps lines from concurrent jobs intact
+            f.write(json.dumps(record) + "\n")
+    except OSError as e:
+        log(f"Warning: Failed to write to {path}: {str(e)}")
+
+def record_metrics(tool, job, returncode, usage):
+    """Append one job's resource usage to the build-wide VC6_METRICS file."""
+    if not METRICS_FILE:
+        return
+    record = {
+        'time': time.time(),
+        'tool': tool,
+        'job': job,
+        'cwd': os.getcwd(),
+        'returncode': returncode,
+    }
+    record.update(usage)
+    append_json_line(METRICS_FILE, record)
+
+status_socket = None
+
+def send_status(event, **fields):
+    """Send a job lifecycle event to the vc6status.py service listening on VC6_STATUS_SOCKET."""
+    global status_socket
+    if not STATUS_SOCKET or IS_WINDOWS:
+        return
+    record = {'event': event, 'pid': os.getpid(), 'time': time.time(), 'build': BUILD_ID}
+    record.update(fields)
+    try:
+        if status_socket is None:
+            status_socket = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+            status_socket.setblocking(False)
+        status_socket.sendto(json.dumps(record).encode('utf-8'), STATUS_SOCKET)
+    except OSError:
+        # Nothing listening or its queue is full, the build never waits for the status service
+        pass
+
+class StackSampler:
+    """Counts the Python stacks seen every PROFILE_INTERVAL of CPU time, in collapsed (flame graph) form."""
+    def __init__(self, root):
+        self.root = root
+        self.stacks = {}
+
+    def sample(self, signum, frame):
+        names = []
+        while frame is not None:
+            names.append(f"{os.path.basename(frame.f_code.co_filename)}:{frame.f_code.co_name}")
+            frame = frame.f_back
+        names.append(self.root)
+        stack = ';'.join(reversed(names))
+        self.stacks[stack] = self.stacks.get(stack, 0) + 1
+
+    def start(self):
+        signal.signal(signal.SIGPROF, self.sample)
+        signal.setitimer(signal.ITIMER_PROF, PROFILE_INTERVAL, PROFILE_INTERVAL)
+
+    def stop(self):
+        signal.setitimer(signal.ITIMER_PROF, 0, 0)
+        signal.signal(signal.SIGPROF, signal.SIG_DFL)
+
+def profiled(tool, func):
+    """Wrap a proxy entry point to write a cProfile and sampled stacks of each call to VC6_PROFILE."""
+    def run(args):
+        import cProfile
+        profile = cProfile.Profile()
+        sampler = None
+        if not IS_WINDOWS:
+            try:
+                sampler = StackSampler(tool)
+                sampler.start()
+            except ValueError:
+                # Signals can only be handled on the main thread
+                sampler = None
+        profile.enable()
+        try:
+            return func(args)
+        finally:
+            profile.disable()
+            if sampler:
+                sampler.stop()
+            try:
+                os.makedirs(PROFILE_DIR, exist_ok=True)
+                base = os.path.join(PROFILE_DIR, f"{tool}.{os.getpid()}.{time.time_ns()}")
+                profile.dump_stats(base + '.prof')
+                if sampler:
+                    with open(base + '.stacks', 'w') as f:
+                        f.writelines(f"{stack} {count}\n" for stack, count in sampler.stacks.items())
+            except OSError as e:
+                log(f"Warning: Failed to write the profile to {PROFILE_DIR}: {str(e)}")
+    return run
+
+def run_traced(tool, func, args):
+    """Run a proxy entry point, logging the invocation to VC6_TRACE for vc6replay.py and profiling it with VC6_PROFILE."""
+    global last_command_usage
+    # In-process workers run many jobs, don't report the previous one's Wine time
+    last_command_usage = {}
+    if PROFILE_DIR:
+        func = profiled(tool, func)
+    if not TRACE_FILE:
+        return func(args)
+    
+    started = time.time()
+    start = time.monotonic()
+    returncode = func(args)
+    append_json_line(TRACE_FILE, {
+        'tool': tool,
+        'argv': args,
+        'cwd': os.getcwd(),
+        'env': {name: value for name, value in os.environ.items()
+                if name.startswith(TRACED_ENV_PREFIXES) and name != 'VC6_TRACE' or name in TRACED_ENV_NAMES},
+        'start': started,
+        'duration': time.monotonic() - start,
+        'wine': last_command_usage.get('wall'),
+        'returncode': returncode,
+    })
+    return returncode
+
+def record_history(tool, job, flags, returncode, duration):
+    """Add one job's duration to the VC6_HISTORY_DB compile-time history."""
+    if not HISTORY_DB or not job:
+        return
+    try:
+        from vc6history import HistoryDB
+        db = HistoryDB(HISTORY_DB)
+        try:
+            db.record(BUILD_ID, tool, job, flags, duration, returncode)
+        finally:
+            db.close()
+    except Exception as e:
+        log(f"Warning: Failed to record history in {HISTORY_DB}: {str(e)}")
+
 def create_batch_file(commands):
     """Create a temporary batch file with the given commands."""
-    fd, path = tempfile.mkstemp(suffix='.bat')
+    fd, path = tempfile.mkstemp(suffix='.bat', dir=SCRATCH_DIR)
     try:
-        with os.fdopen(fd, 'w') as f:
-            f.write("@echo off\r\n")
+        lines = ["@echo off"]
+        
+        if not IS_WINDOWS:
+            setup_path = unix_to_wine(os.path.join(SCRIPT_DIR, 'setup.bat'))
+            lines.append("call {0}".format(setup_path))
             
-            if not IS_WINDOWS:
-                setup_path = unix_to_wine(os.path.join(SCRIPT_DIR, 'setup.bat'))
-                f.write("call {0}\r\n".format(setup_path))
-                
-            for cmd in commands:
-                f.write("{0}\r\n".format(cmd))
+        lines.extend(commands)
+        
+        with os.fdopen(fd, 'w') as f:
+            f.write("".join("{0}\r\n".format(line) for line in lines))
         
         log(f"Created batch file: {path}")
-        with open(path, 'r') as f:
-            batch_contents = f.read()
-            log("Batch contents:")
-            for line in batch_contents.splitlines():
-                log(f"  {line}")
+        log("Batch contents:")
+        for line in lines:
+            log(f"  {line}")
         
         return path
     except Exception as e:
@@ -147,13 +596,437 @@ def create_batch_file(commands):
             os.unlink(path)
         raise
 
+def find_file_nocase(directory, rel_path):
+    """Find rel_path below directory the way Windows would, ignoring case."""
+    rel_path = rel_path.replace('\\', '/')
+    candidate = os.path.join(directory, rel_path)
+    if os.path.isfile(candidate):
+        return os.path.normpath(candidate)
+
+    current = directory
+    for part in rel_path.split('/'):
+        if part in ('', '.'):
+            continue
+        if part == '..':
+            current = os.path.dirname(current)
+            continue
+        entries = _dir_listing(current)
+        if entries is None:
+            return None
+        name = entries.get(part.lower())
+        if name is None:
+            return None
+        current = os.path.join(current, name)
+
+    return os.path.normpath(current) if os.path.isfile(current) else None
+
+_dir_listings = {}
+
+def _dir_listing(directory):
+    """Return a cached lower-case name -> real name map of a directory."""
+    if directory not in _dir_listings:
+        try:
+            _dir_listings[directory] = {name.lower(): name for name in os.listdir(directory)}
+        except OSError:
+            _dir_listings[directory] = None
+    return _dir_listings[directory]
+
+def invalidate_dir_listing(directory):
+    """Forget the cached listing of a directory whose entries changed."""
+    _dir_listings.pop(directory, None)
+
+class CompileCommand:
+    """One entry of a compile_commands.json, with the paths the proxy cares about made absolute."""
+    def __init__(self, entry):
+        self.directory = entry['directory']
+        if 'arguments' in entry:
+            self.argv = entry['arguments']
+            self.command = ' '.join(shlex.quote(arg) for arg in self.argv)
+        else:
+            self.command = entry['command']
+            self.argv = shlex.split(self.command)
+        self.source = os.path.normpath(os.path.join(self.directory, entry['file']))
+        
+        output = entry.get('output')
+        self.include_dirs = []
+        args = self.argv
+        i = 1
+        while i < len(args):
+            arg = args[i]
+            if arg.startswith(('/Fo', '-Fo')) and len(arg) > 3 and not output:
+                output = arg[3:]
+            elif arg in ('/Fo', '-Fo', '-o') and i + 1 < len(args) and not output:
+                output = args[i+1]
+                i += 1
+            elif arg.startswith(('/I', '-I')) and len(arg) > 2:
+                self.include_dirs.append(os.path.normpath(os.path.join(self.directory, arg[2:])))
+            elif arg in ('/I', '-I') and i + 1 < len(args):
+                self.include_dirs.append(os.path.normpath(os.path.join(self.directory, args[i+1])))
+                i += 1
+            i += 1
+        self.output = os.path.normpath(os.path.join(self.directory, output.replace('\\', '/'))) if output else None
+
+def load_compile_commands(build_dir):
+    """Read a build directory's compile_commands.json."""
+    path = os.path.join(build_dir, 'compile_commands.json')
+    with open(path, 'r') as f:
+        return [CompileCommand(entry) for entry in json.load(f)]
+
+class IncludeScanner:
+    """Resolve the headers a translation unit includes, as CL.EXE would find them."""
+    INCLUDE_RE = re.compile(r'^[ \t]*#[ \t]*(?:include|import)[ \t]*([<"])([^>"\r\n]+)[>"]', re.MULTILINE)
+    ANY_INCLUDE_RE = re.compile(r'^[ \t]*#[ \t]*(?:include|import)\b[ \t]*([^ \t\r\n]?)', re.MULTILINE)
+
+    def __init__(self, include_dirs):
+        self.include_dirs = [os.path.abspath(d) for d in include_dirs] + SYSTEM_INCLUDE_DIRS
+        self.directives = {}
+        # Files with an #include whose name comes from a macro, which can't be followed
+        self.computed = set()
+        # File -> headers it was seen to include directly
+        self.edges = {}
+        # (directory, name as written) pairs that resolved to a header
+        self.lookups = set()
+
+    def _directives(self, path):
+        if path not in self.directives:
+            try:
+                with open(path, 'r', errors='replace') as f:
+                    text = f.read()
+                self.directives[path] = self.INCLUDE_RE.findall(text)
+                if any(first not in ('<', '"') for first in self.ANY_INCLUDE_RE.findall(text)):
+                    self.computed.add(path)
+            except OSError:
+                self.directives[path] = []
+        return self.directives[path]
+
+    def scan(self, source):
+        """Return (depth, path) for every header reachable from source, in include order.
+
+        Conditional compilation is ignored, so the result is a superset of
+        what the compiler actually opens, which is what a dependency list needs.
+        """
+        source = os.path.abspath(source)
+        found = []
+        seen = {source}
+        stack = [(source, iter(self._directives(source)))]
+
+        while stack:
+            current, directives = stack[-1]
+            directive = next(directives, None)
+            if directive is None:
+                stack.pop()
+                continue
+
+            kind, name = directive
+            search = []
+            if kind == '"':
+                # Quoted includes also search the directories of every open includer
+                search.extend(os.path.dirname(path) for path, _ in reversed(stack))
+            search.extend(self.include_dirs)
+
+            for directory in search:
+                header = find_file_nocase(directory, name)
+                if header:
+                    self.lookups.add((directory, name))
+                    self.edges.setdefault(current, set()).add(header)
+                    if header not in seen:
+                        seen.add(header)
+                        found.append((len(stack), header))
+                        stack.append((header, iter(self._directives(header))))
+                    break
+
+        return found
+
+class IncludeView:
+    """Tree holding only the headers compiles have resolved, under their real names and the spellings used.
+
+    Wine opens a DOS path by listing every directory on the way that has no
+    exact-case match, so each header CL.EXE probes in the source tree costs a
+    scan of a large include directory. Through the view, the #include
+    spellings are exact hits and misses only list the few entries compiles
+    have needed. Entries are added as TUs are compiled and kept across builds.
+    """
+    def __init__(self, root, drive, source_roots):
+        self.root = root
+        self.drive = drive
+        self.source_roots = source_roots
+
+    def covers(self, path):
+        return any(path == root or path.startswith(root + os.sep) for root in self.source_roots)
+
+    def view_path(self, path):
+        return self.root + path
+
+    def wine_path(self, path):
+        return f"{self.drive}:" + path.replace("/", "\\")
+
+    def _link(self, link, target):
+        try:
+            os.symlink(target, link)
+        except FileExistsError:
+            pass
+
+    def add_dir(self, path):
+        os.makedirs(self.view_path(path), exist_ok=True)
+
+    def add_file(self, path):
+        self.add_dir(os.path.dirname(path))
+        self._link(self.view_path(path), path)
+
+    def add_lookup(self, directory, name):
+        """Add the entries CL.EXE walks through to open name from directory."""
+        parts = [part for part in name.replace('\\', '/').split('/') if part not in ('', '.')]
+        current = directory
+        view_dir = self.view_path(directory)
+        os.makedirs(view_dir, exist_ok=True)
+        for i, part in enumerate(parts):
+            if part == '..':
+                current = os.path.dirname(current)
+                view_dir = os.path.dirname(view_dir)
+                continue
+            entries = _dir_listing(current)
+            real = entries.get(part.lower()) if entries else None
+            if real is None:
+                return
+            current = os.path.join(current, real)
+            entry = os.path.join(view_dir, real)
+            if i == len(parts) - 1:
+                self._link(entry, current)
+            else:
+                os.makedirs(entry, exist_ok=True)
+            if part != real:
+                # The spelling the source uses, so Wine finds it without listing view_dir
+                self._link(os.path.join(view_dir, part), real)
+            view_dir = entry
+
+def include_view():
+    """Return the IncludeView set up for this build, or None."""
+    if IS_WINDOWS or not (INCLUDE_VIEW_DIR and INCLUDE_VIEW_DRIVE and INCLUDE_VIEW_ROOTS):
+        return None
+    return IncludeView(INCLUDE_VIEW_DIR, INCLUDE_VIEW_DRIVE, INCLUDE_VIEW_ROOTS)
+
+def write_depfile(path, target, deps):
+    """Write a gcc-style (make syntax) depfile."""
+    def escape(p):
+        return p.replace(' ', '\\ ')
+    with open(path, 'w') as f:
+        f.write(f"{escape(target)}:")
+        for dep in deps:
+            f.write(f" \\\n  {escape(dep)}")
+        f.write("\n")
+
+def _clear_coff_timestamp(data, offset, size):
+    if size < 20:
+        return
+    if data[offset:offset + 4] == b'\x00\x00\xff\xff':
+        # Short import object: Sig1, Sig2, Version, Machine, TimeDateStamp
+        data[offset + 8:offset + 12] = bytes(4)
+    elif int.from_bytes(data[offset:offset + 2], 'little') == IMAGE_FILE_MACHINE_I386:
+        # Object file: Machine, NumberOfSections, TimeDateStamp
+        data[offset + 4:offset + 8] = bytes(4)
+
+def normalize_coff_timestamps(path):
+    """Zero the build timestamps VC6 writes into a .obj or .lib, in place."""
+    with open(path, 'rb') as f:
+        data = bytearray(f.read())
+    original = bytes(data)
+    
+    if data.startswith(ARCHIVE_MAGIC):
+        offset = len(ARCHIVE_MAGIC)
+        while offset + ARCHIVE_MEMBER_HEADER_SIZE <= len(data):
+            name = bytes(data[offset:offset + 16])
+            try:
+                size = int(data[offset + 48:offset + 58].decode('ascii').strip())
+            except ValueError:
+                log(f"Warning: Unexpected archive member header in {path}, left as is")
+                return
+            data[offset + 16:offset + 28] = b'0'.ljust(12)
+            body = offset + ARCHIVE_MEMBER_HEADER_SIZE
+            # Linker members and the long names table carry no COFF header
+            if not name.startswith((b'/ ', b'// ')):
+                _clear_coff_timestamp(data, body, size)
+            offset = body + size + (size & 1)
+    else:
+        _clear_coff_timestamp(data, 0, len(data))
+    
+    if data != original:
+        with open(path, 'wb') as f:
+            f.write(data)
+
+def coff_sections(data):
+    """Return {section name: raw data} of a COFF object, plus its 'symbols' table, or None if it isn't one."""
+    if len(data) < 20 or int.from_bytes(data[0:2], 'little') != IMAGE_FILE_MACHINE_I386:
+        return None
+    count = int.from_bytes(data[2:4], 'little')
+    symtab = int.from_bytes(data[8:12], 'little')
+    strtab = symtab + int.from_bytes(data[12:16], 'little') * 18
+    header = 20 + int.from_bytes(data[16:18], 'little')
+    sections = {'symbols': data[symtab:]}
+    for i in range(count):
+        entry = header + i * 40
+        name = data[entry:entry + 8].rstrip(b'\0').decode('latin-1')
+        if name.startswith('/') and name[1:].isdigit():
+            start = strtab + int(name[1:])
+            name = data[start:data.find(b'\0', start)].decode('latin-1')
+        size = int.from_bytes(data[entry + 16:entry + 20], 'little')
+        offset = int.from_bytes(data[entry + 20:entry + 24], 'little')
+        # COMDAT sections repeat a name; number them to compare them in order
+        key = name if name not in sections else f"{name}#{i + 1}"
+        sections[key] = data[offset:offset + size]
+    return sections
+
+def coff_differences(path, other):
+    """Name the sections in which two COFF objects differ."""
+    with open(path, 'rb') as f:
+        sections = coff_sections(f.read())
+    with open(other, 'rb') as f:
+        other_sections = coff_sections(f.read())
+    if sections is None or other_sections is None:
+        return ['not a COFF object']
+    return sorted(name for name in set(sections) | set(other_sections)
+                  if sections.get(name) != other_sections.get(name))
+
+class InputStamp:
+    """Hash of a LIB or LINK step's arguments and input file contents, kept next to its output.
+    
+    In VC6_DETERMINISTIC mode outputs still get a fresh mtime, as make and
+    Ninja expect, so a recompile that produced the same bytes reruns the
+    dependent steps. A matching stamp lets the proxy skip the tool then and
+    only touch the outputs.
+    """
+    # Options whose value is an output of the step, not an input
+    OUTPUT_OPTIONS = ('/out:', '/implib:', '/pdb:', '/map:')
+    
+    def __init__(self, output, args):
+        self.output = output
+        self.path = output + '.vc6stamp'
+        self.digest = self.compute(args)
+    
+    def compute(self, args):
+        digest = hashlib.sha1(json.dumps([os.getcwd(), args]).encode('utf-8'))
+        outputs = {os.path.abspath(self.output)}
+        pending = list(args)
+        skip_next = False
+        while pending:
+            arg = pending.pop(0)
+            if skip_next:
+                outputs.add(os.path.abspath(arg))
+                skip_next = False
+                continue
+            lower = arg.lower()
+            if lower in self.OUTPUT_OPTIONS:
+                skip_next = True
+                continue
+            if arg.startswith('@'):
+                path = arg[1:]
+            elif lower.startswith('/def:'):
+                path = arg[5:]
+            elif arg.startswith(('/', '-')) and not os.path.isfile(arg):
+                continue
+            else:
+                path = arg
+            if os.path.abspath(path) in outputs or not os.path.isfile(path):
+                continue
+            with open(path, 'rb') as f:
+                content = f.read()
+            digest.update(path.encode('utf-8') + b'\0' + hashlib.sha1(content).digest())
+            if arg.startswith('@'):
+                pending.extend(shlex.split(content.decode('utf-8', errors='replace')))
+        return digest.hexdigest()
+    
+    def matches(self):
+        try:
+            with open(self.path, 'r') as f:
+                return f.read().strip() == self.digest and os.path.exists(self.output)
+        except OSError:
+            return False
+    
+    def update(self, returncode):
+        """Record the stamp of a successful run, or drop a stale one."""
+        try:
+            if returncode == 0 and os.path.exists(self.output):
+                with open(self.path, 'w') as f:
+                    f.write(self.digest + "\n")
+            elif os.path.exists(self.path):
+                os.unlink(self.path)
+        except OSError as e:
+            log(f"Warning: Failed to update {self.path}: {str(e)}")
+
+def touch_outputs(paths):
+    """Give unchanged outputs a fresh mtime so make and Ninja see them as up to date."""
+    for path in paths:
+        if path and os.path.exists(path):
+            os.utime(path)
+
+class FlagSetCache:
+    """Translated CL.EXE flag sets shared by every TU of a target, one response file each.
+    
+    Entries are keyed on everything the translation depends on: the parsed
+    non-source arguments, the working directory, the include view and this
+    module's own version.
+    """
+    def __init__(self, directory):
+        self.directory = directory
+        stat = os.stat(__file__)
+        self.stamp = f"{stat.st_mtime_ns}:{stat.st_size}"
+
+    def key(self, *parts):
+        data = json.dumps([self.stamp, os.getcwd()] + list(parts))
+        return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+    def lookup(self, key):
+        """Return (flag set, response file) for a key, or None."""
+        try:
+            with open(os.path.join(self.directory, key + '.json'), 'r') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+        rsp = os.path.join(self.directory, key + '.rsp')
+        return entry['flag_set'], rsp if os.path.exists(rsp) else None
+
+    def store(self, key, flag_set):
+        """Write the flag set and its response file, returning the response file or None."""
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            rsp = os.path.join(self.directory, key + '.rsp')
+            # Written under temporary names and renamed, TUs of the target race here
+            for path, content in ((rsp, flag_set + "\n"), (os.path.join(self.directory, key + '.json'),
+                                                            json.dumps({'flag_set': flag_set}))):
+                fd, tmp_path = tempfile.mkstemp(dir=self.directory)
+                with os.fdopen(fd, 'w') as f:
+                    f.write(content)
+                os.replace(tmp_path, path)
+            return rsp
+        except OSError as e:
+            log(f"Warning: Failed to write to the flag set cache {self.directory}: {str(e)}")
+            return None
+
 class ProxyCompiler:
     """Base class for proxy compilers."""
+    tool = None
+    
     def __init__(self, env=None):
         self.env = env or os.environ.copy()
+        self.last_output = ''
+        # The job reported to VC6_STATUS_SOCKET, kept across the attempts of one job
+        self.status_id = None
+        self.status_end = None
     
-    def _run_batch(self, commands):
-        """Run a batch file with the specified commands."""
+    def end_status(self):
+        """Report the end of the job whose attempts _run_batch ran with final=False."""
+        if self.status_end:
+            send_status('end', id=self.status_id, **self.status_end)
+        self.status_id = None
+        self.status_end = None
+    
+    def _run_batch(self, commands, job=None, flags=None, final=True, counted=True):
+        """Run a batch file with the specified commands.
+        
+        With final=False the job's end isn't reported yet, so a retry through
+        another _run_batch call counts as the same job; end_status() reports it.
+        With counted=False the run is a check of a job already counted, and is
+        kept out of the metrics, history, status events and slot tuning.
+        """
         batch_path = None
         try:
             batch_path = create_batch_file(commands)
@@ -166,7 +1039,31 @@ class ProxyCompiler:
             with log_group("Executing batch command"):
                 log(f"Command: {' '.join(cmd)}")
             
-            returncode, stdout, stderr = run_command_with_wine(cmd, env=self.env)
+            if flags is None:
+                flags = ' '.join(commands)
+            on_start = None
+            if counted:
+                if self.status_id is None:
+                    self.status_id = f"{os.getpid()}.{time.monotonic_ns()}"
+                # Sent once the Wine slot is held, so jobs still queued for one don't show as running
+                on_start = lambda: send_status('start', id=self.status_id, tool=self.tool, job=job)
+            cost = expected_duration(self.tool, job, flags) if WINE_SLOTS_AUTO and counted else None
+            returncode, stdout, stderr = run_command_with_wine(cmd, env=self.env,
+                                                               timeout=job_timeout(self.tool, job, flags),
+                                                               label=f"{self.tool} {job}" if job else None,
+                                                               on_start=on_start, cost=cost, counted=counted)
+            self.last_output = stdout or ''
+            if counted:
+                record_metrics(self.tool, job, returncode, last_command_usage)
+                record_history(self.tool, job, flags, returncode, last_command_usage['wall'])
+                previous = self.status_end or {'wall': 0.0, 'retries': -1}
+                self.status_end = {
+                    'tool': self.tool, 'job': job, 'returncode': returncode,
+                    'wall': previous['wall'] + last_command_usage['wall'],
+                    'retries': previous['retries'] + 1 + last_command_usage.get('retries', 0),
+                }
+                if final:
+                    self.end_status()
             
             with log_group("Command output"):
                 if stdout:
@@ -185,6 +1082,9 @@ class ProxyCompiler:
             return returncode
         except Exception as e:
             log(f"Error executing batch command: {str(e)}", error=True)
+            if counted:
+                self.status_end = dict(self.status_end or {}, tool=self.tool, job=job, returncode=1)
+                self.end_status()
             traceback.print_exc(file=log_buffer)
             flush_logs_if_error()
             return 1
@@ -194,6 +1094,8 @@ class ProxyCompiler:
 
 class CLCompiler(ProxyCompiler):
     """Proxy for Microsoft CL compiler."""
+    tool = 'cl'
+    
     def __init__(self, env=None):
         super().__init__(env)
 
@@ -207,6 +1109,7 @@ class CLCompiler(ProxyCompiler):
         source_files = []
         output_opts = {}
         compile_only = False
+        show_includes = False
         
         i = 0
         while i < len(args):
@@ -244,6 +1147,11 @@ class CLCompiler(ProxyCompiler):
                 compile_only = True
                 i += 1
                 
+            elif arg == '/showIncludes' or arg == '-showIncludes':
+                # VC6 predates /showIncludes, so the proxy emulates it
+                show_includes = True
+                i += 1
+                
             elif arg.endswith(('.c', '.cpp', '.cxx', '.cc', '.C', '.CPP', '.CXX', '.CC')):
                 log(f"Found potential source file: {arg}")
                 if os.path.exists(arg):
@@ -285,6 +1193,76 @@ class CLCompiler(ProxyCompiler):
         log("Found include dirs: " + str(include_dirs))
         log("Found define macros: " + str(define_macros))
         
+        if DEBUG_INFO in ('z7', 'pertu'):
+            self.rewrite_debug_info(compiler_flags, output_opts, source_files)
+        
+        obj_file = output_opts.get('Fo')
+        if not (DETERMINISTIC and obj_file and len(source_files) == 1 and not obj_file.endswith(('/', '\\'))):
+            obj_file = None
+        
+        preprocessed = None
+        if PREPROCESS in ('1', 'host') and compile_only and source_files and self.can_preprocess(compiler_flags):
+            preprocessed = self.preprocess_sources(source_files, include_dirs, define_macros, compiler_flags)
+        
+        view = include_view() if source_files and not preprocessed else None
+        if view:
+            view = self.prepare_include_view(view, source_files, include_dirs)
+        
+        if preprocessed:
+            # CL.EXE only compiles; the #line markers keep diagnostics and debug info on the real files
+            cl_cmd, flag_set = self.build_command(compile_only, [], [], self.preprocessed_flags(compiler_flags),
+                                                  preprocessed[1], output_opts)
+        else:
+            cl_cmd, flag_set = self.build_command(compile_only, include_dirs, define_macros, compiler_flags,
+                                                  source_files, output_opts)
+        if view:
+            plain_cmd = cl_cmd
+            cl_cmd, _ = self.build_command(compile_only, include_dirs, define_macros, compiler_flags,
+                                           source_files, output_opts, view)
+        
+        log("Executing: " + cl_cmd)
+        
+        try:
+            # A view compile may be retried, which is still the same job
+            result = self._run_batch([cl_cmd], job=' '.join(source_files), flags=flag_set, final=not view)
+        finally:
+            if preprocessed:
+                shutil.rmtree(preprocessed[0], ignore_errors=True)
+        
+        if result != 0 and view and 'C1083' in self.last_output:
+            # A header that didn't exist when the view was updated (e.g. generated later) isn't in it
+            log("Include not found through the include view, retrying with the source paths")
+            log("Executing: " + plain_cmd)
+            result = self._run_batch([plain_cmd], job=' '.join(source_files), flags=flag_set)
+        self.end_status()
+        
+        if (PREPROCESS == 'verify' and result == 0 and compile_only and len(source_files) == 1
+                and output_opts.get('Fo') and not output_opts['Fo'].endswith(('/', '\\'))
+                and self.can_preprocess(compiler_flags)):
+            self.verify_preprocessed(include_dirs, define_macros, compiler_flags, source_files, output_opts)
+        
+        if obj_file and result == 0 and os.path.exists(obj_file):
+            normalize_coff_timestamps(obj_file)
+        
+        if result == 0 and (show_includes or DEPFILE):
+            self.report_includes(source_files, include_dirs, output_opts.get('Fo'), show_includes)
+        
+        flush_logs_if_error()
+        return result
+
+    def build_command(self, compile_only, include_dirs, define_macros, compiler_flags, source_files, output_opts, view=None):
+        """Return the CL.EXE command line and its flag set, opening sources through view if given."""
+        cache = FlagSetCache(FLAGS_CACHE_DIR) if FLAGS_CACHE_DIR else None
+        if cache:
+            key = cache.key(compile_only, include_dirs, define_macros, compiler_flags,
+                            [view.root, view.drive, view.source_roots] if view else None)
+            cached = cache.lookup(key)
+            send_status('cache', cache='flags', hit=cached is not None)
+            if cached:
+                flag_set, rsp = cached
+                cl_args = [self.response_file_arg(rsp)] if rsp else [flag_set]
+                return self.add_tu_args(cl_args, source_files, output_opts, view), flag_set
+        
         cl_args = ['/nologo']
         
         if compile_only:
@@ -292,7 +1270,10 @@ class CLCompiler(ProxyCompiler):
             
         for dir in include_dirs:
             if os.path.exists(dir):
-                wine_dir = unix_to_wine(dir)
+                if view and view.covers(os.path.abspath(dir)):
+                    wine_dir = view.wine_path(os.path.abspath(dir))
+                else:
+                    wine_dir = unix_to_wine(dir)
                 if ' ' in wine_dir:
                     cl_args.append(f'/I"{wine_dir}"')
                 else:
@@ -317,16 +1298,28 @@ class CLCompiler(ProxyCompiler):
         for flag in compiler_flags:
             if flag != '/nologo':
                 cl_args.append(flag)
+        
+        # Everything but the per-TU paths, what makes two compiles comparable
+        flag_set = ' '.join(cl_args)
+        
+        # Include dirs that don't exist yet (generated ones) are translated again next time
+        if cache and all(os.path.exists(dir) for dir in include_dirs):
+            rsp = cache.store(key, flag_set)
+            if rsp:
+                cl_args = [self.response_file_arg(rsp)]
+        
+        return self.add_tu_args(cl_args, source_files, output_opts, view), flag_set
 
+    def response_file_arg(self, rsp):
+        wine_rsp = unix_to_wine(rsp)
+        return f'@"{wine_rsp}"' if ' ' in wine_rsp else f'@{wine_rsp}'
+
+    def add_tu_args(self, cl_args, source_files, output_opts, view=None):
+        """Append the per-TU sources, /Fo and /Fd to a flag set and return the CL.EXE command."""
+        cl_args = list(cl_args)
         for src in source_files:
             log(f"Processing source file: {src}")
-            if src.startswith('/'):
-                wine_src = "Z:" + src
-            elif os.path.exists(src):
-                wine_src = unix_to_wine(src)
-            else:
-                wine_src = src
-                
+            wine_src = self.wine_source_path(src, view)
             if ' ' in wine_src:
                 cl_args.append(f'"{wine_src}"')
             else:
@@ -346,16 +1339,174 @@ class CLCompiler(ProxyCompiler):
             else:
                 cl_args.append(f'/Fd{wine_pdb}')
                 
-        cl_cmd = "CL.EXE {0}".format(' '.join(cl_args))
+        return "CL.EXE {0}".format(' '.join(cl_args))
+
+    def wine_source_path(self, src, view=None):
+        """The path CL.EXE is given for a source file, which it also uses in diagnostics and __FILE__."""
+        if view and view.covers(os.path.abspath(src)):
+            return view.wine_path(os.path.abspath(src))
+        elif src.startswith('/'):
+            return "Z:" + src
+        elif os.path.exists(src):
+            return unix_to_wine(src)
+        return src
+
+    def can_preprocess(self, compiler_flags):
+        flags = ['/' + flag[1:] if flag.startswith('-') else flag for flag in compiler_flags]
+        return not any(flag in PREPROCESS_UNSUPPORTED or flag.startswith(PREPROCESS_UNSUPPORTED_PREFIXES)
+                       for flag in flags)
+
+    def preprocessed_flags(self, compiler_flags):
+        """The flags left for compiling a preprocessed source: no undefines or forced includes."""
+        return [flag for flag in compiler_flags if not flag.startswith(('/U', '/FI'))]
+
+    def preprocess_sources(self, source_files, include_dirs, define_macros, compiler_flags):
+        """Preprocess the sources on the host; returns (scratch dir, preprocessed files) or None to compile directly."""
+        from vc6cpp import preprocess_file
+        dirs = [(os.path.abspath(dir), unix_to_wine(os.path.abspath(dir))) for dir in include_dirs]
+        undefines = [flag[2:] for flag in compiler_flags if flag.startswith('/U') and len(flag) > 2]
+        forced = [flag[3:] for flag in compiler_flags if flag.startswith('/FI') and len(flag) > 3]
+        jobs = [(os.path.abspath(src), self.wine_source_path(src), dirs, define_macros, undefines, compiler_flags, forced)
+                for src in source_files]
         
-        log("Executing: " + cl_cmd)
+        start = time.monotonic()
+        try:
+            if len(jobs) > 1:
+                from concurrent.futures import ProcessPoolExecutor
+                with ProcessPoolExecutor(max_workers=min(len(jobs), os.cpu_count() or 1)) as pool:
+                    results = list(pool.map(preprocess_file, *zip(*jobs)))
+            else:
+                results = [preprocess_file(*jobs[0])]
+        except Exception as e:
+            # CL.EXE reports real errors in its own words, unsupported constructs just compile as before
+            log(f"Host preprocessing failed, compiling the sources directly: {str(e)}")
+            return None
         
-        result = self._run_batch([cl_cmd])
-        flush_logs_if_error()
-        return result
+        tmp_dir = tempfile.mkdtemp(prefix='vc6cpp', dir=SCRATCH_DIR)
+        preprocessed = []
+        for index, (src, (text, _)) in enumerate(zip(source_files, results)):
+            # Same name as the source, so CL.EXE picks the same language and default object name
+            path = os.path.join(tmp_dir, str(index), os.path.basename(src))
+            os.makedirs(os.path.dirname(path))
+            with open(path, 'w', encoding='latin-1') as f:
+                f.write(text)
+            preprocessed.append(path)
+        log(f"Preprocessed {len(source_files)} source(s) on the host in {time.monotonic() - start:.2f}s")
+        return tmp_dir, preprocessed
+
+    def verify_preprocessed(self, include_dirs, define_macros, compiler_flags, source_files, output_opts):
+        """Compile the source again from host-preprocessed text and check the object is the same."""
+        obj_file = output_opts['Fo']
+        preprocessed = self.preprocess_sources(source_files, include_dirs, define_macros, compiler_flags)
+        if not preprocessed:
+            print(f"vc6proxy: preprocess verify: {source_files[0]} can't be preprocessed on the host", file=sys.stderr)
+            record_metrics(self.tool, source_files[0], 1, {'preprocess_verify': 'unsupported'})
+            return
+        tmp_dir, files = preprocessed
+        direct_obj = os.path.join(tmp_dir, 'direct.obj')
+        host_obj = os.path.join(tmp_dir, 'host.obj')
+        try:
+            shutil.copy2(obj_file, direct_obj)
+            # Written to the same /Fo path, objects record their own name
+            cl_cmd, _ = self.build_command(True, [], [], self.preprocessed_flags(compiler_flags), files, output_opts)
+            # The direct compile already counted this job
+            result = self._run_batch([cl_cmd], job=source_files[0], counted=False)
+            if result == 0:
+                os.replace(obj_file, host_obj)
+            shutil.copy2(direct_obj, obj_file)
+            
+            if result != 0:
+                print(f"vc6proxy: preprocess verify: {source_files[0]} doesn't compile when preprocessed on the host",
+                      file=sys.stderr)
+                record_metrics(self.tool, source_files[0], result, {'preprocess_verify': 'failed'})
+                return
+            normalize_coff_timestamps(direct_obj)
+            normalize_coff_timestamps(host_obj)
+            if filecmp.cmp(direct_obj, host_obj, shallow=False):
+                log(f"Host preprocessing verified for {source_files[0]}")
+                record_metrics(self.tool, source_files[0], 0, {'preprocess_verify': 'same'})
+            else:
+                differences = coff_differences(direct_obj, host_obj)
+                print(f"vc6proxy: preprocess verify: {source_files[0]} compiles to a different object "
+                      f"when preprocessed on the host ({', '.join(differences)})", file=sys.stderr)
+                record_metrics(self.tool, source_files[0], 0, {'preprocess_verify': 'different', 'sections': differences})
+        except OSError as e:
+            log(f"Warning: Failed to verify host preprocessing: {str(e)}")
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    def scan_includes(self, source_files, include_dirs):
+        """Return the IncludeScanner and the headers of each source, scanning once per compile."""
+        key = (tuple(source_files), tuple(include_dirs))
+        if getattr(self, 'include_scan', (None,))[0] != key:
+            scanner = IncludeScanner(include_dirs)
+            self.include_scan = (key, scanner, {src: scanner.scan(src) for src in source_files})
+        return self.include_scan[1], self.include_scan[2]
+
+    def prepare_include_view(self, view, source_files, include_dirs):
+        """Add the headers the sources resolve to the include view; None if it can't be used."""
+        try:
+            for src in source_files:
+                if not view.covers(os.path.abspath(src)):
+                    return None
+            scanner, headers = self.scan_includes(source_files, include_dirs)
+            reached = [os.path.abspath(src) for src in source_files]
+            reached.extend(header for found in headers.values() for _, header in found)
+            if any(path in scanner.computed for path in reached):
+                # A header the scan can't name could resolve to a same-named file
+                # outside the view instead of failing, so compile from the real paths
+                log("Computed #include reached, not using the include view")
+                return None
+            for src in source_files:
+                view.add_file(os.path.abspath(src))
+            for dir in include_dirs:
+                dir = os.path.abspath(dir)
+                if os.path.isdir(dir) and view.covers(dir):
+                    view.add_dir(dir)
+            for directory, name in scanner.lookups:
+                if view.covers(directory):
+                    view.add_lookup(directory, name)
+            return view
+        except OSError as e:
+            log(f"Warning: Failed to update the include view: {str(e)}")
+            return None
+
+    def rewrite_debug_info(self, compiler_flags, output_opts, source_files):
+        """Move /Zi debug info off the target's shared /Fd PDB so parallel TUs don't serialize on it."""
+        pdb_flags = [flag for flag in compiler_flags if flag in ('/Zi', '/ZI')]
+        if not pdb_flags:
+            return
+        
+        obj_file = output_opts.get('Fo')
+        if DEBUG_INFO == 'pertu' and obj_file and len(source_files) == 1 and not obj_file.endswith(('/', '\\')):
+            # One PDB per object, LINK.EXE merges them into the final PDB
+            output_opts['Fd'] = os.path.splitext(obj_file)[0] + '.pdb'
+            log(f"Per-TU debug info: {output_opts['Fd']}")
+        else:
+            # CodeView types embedded in the object, LINK.EXE builds the final PDB from them
+            compiler_flags[:] = ['/Z7' if flag in pdb_flags else flag for flag in compiler_flags]
+            output_opts.pop('Fd', None)
+            log("Per-TU debug info: /Z7")
+
+    def report_includes(self, source_files, include_dirs, obj_file, show_includes):
+        """Emit /showIncludes lines and/or a depfile for the compiled sources."""
+        _, scanned = self.scan_includes(source_files, include_dirs)
+        for src in source_files:
+            headers = scanned[src]
+            
+            if show_includes:
+                for depth, header in headers:
+                    print(f"{SHOW_INCLUDES_PREFIX}{' ' * (depth - 1)}{header}")
+            
+            if DEPFILE and obj_file and len(source_files) == 1 and not obj_file.endswith(('/', '\\')):
+                depfile = obj_file + '.d'
+                write_depfile(depfile, obj_file, [os.path.abspath(src)] + [header for _, header in headers])
+                log(f"Wrote depfile: {depfile}")
 
 class LibExe(ProxyCompiler):
     """Proxy for Microsoft LIB.EXE (Library Manager)."""
+    tool = 'lib'
+    
     def __init__(self, env=None):
         super().__init__(env)
         
@@ -389,6 +1540,13 @@ class LibExe(ProxyCompiler):
                     other_args.append(arg)
                 i += 1
         
+        stamp = InputStamp(out_file, args) if DETERMINISTIC and out_file else None
+        if stamp and stamp.matches():
+            log(f"Inputs unchanged, kept {out_file}")
+            touch_outputs([out_file])
+            flush_logs_if_error()
+            return 0
+        
         wine_args = []
         wine_args.extend(other_args)
         
@@ -455,14 +1613,23 @@ class LibExe(ProxyCompiler):
         
         log("Executing: " + lib_cmd)
         
-        result = self._run_batch([lib_cmd])
+        result = self._run_batch([lib_cmd], job=out_file)
+        
+        if stamp:
+            if result == 0 and os.path.exists(out_file):
+                normalize_coff_timestamps(out_file)
+            stamp.update(result)
+        
         flush_logs_if_error()
         return result
 
 class LinkExe(ProxyCompiler):
     """Proxy for Microsoft LINK.EXE."""
+    tool = 'link'
+    
     def __init__(self, env=None):
         super().__init__(env)
+        self.temp_files = []
 
     def process_response_file(self, resp_file):
         """Process a response file to convert all paths inside to Wine format."""
@@ -470,34 +1637,31 @@ class LinkExe(ProxyCompiler):
             with open(resp_file, 'r') as f:
                 lines = f.readlines()
             
-            fd, temp_path = tempfile.mkstemp(suffix='.rsp')
-            
             log(f"Processing response file: {resp_file}")
-            log(f"Creating temporary response file: {temp_path}")
             
-            with os.fdopen(fd, 'w') as f:
-                for line in lines:
-                    line = line.strip()
-                    if line:
-                        log(f"  Processing line: {line}")
-                        if os.path.exists(line) or (line.startswith('/') and len(line) > 1):
-                            wine_path = unix_to_wine(line)
-                            log(f"  Converted path: {line} -> {wine_path}")
-                            f.write(f"{wine_path}\n")
-                        else:
-                            log(f"  Keeping line as is: {line}")
-                            f.write(f"{line}\n")
+            converted = []
+            for line in lines:
+                line = line.strip()
+                if line:
+                    log(f"  Processing line: {line}")
+                    if os.path.exists(line) or (line.startswith('/') and len(line) > 1):
+                        wine_path = unix_to_wine(line)
+                        log(f"  Converted path: {line} -> {wine_path}")
+                        converted.append(wine_path)
+                    else:
+                        log(f"  Keeping line as is: {line}")
+                        converted.append(line)
             
-            if os.path.exists(temp_path) and os.path.getsize(temp_path) > 0:
-                log(f"Successfully created response file: {temp_path}")
-                with open(temp_path, 'r') as f:
-                    log("Response file content:")
-                    for line in f:
-                        log(f"  {line.strip()}")
-            else:
-                log(f"Warning: Created response file {temp_path} is empty or missing")
+            if not converted:
+                log(f"Warning: Response file {resp_file} is empty")
                 return resp_file
             
+            fd, temp_path = tempfile.mkstemp(suffix='.rsp', dir=SCRATCH_DIR)
+            with os.fdopen(fd, 'w') as f:
+                f.write("".join(f"{line}\n" for line in converted))
+            self.temp_files.append(temp_path)
+            
+            log(f"Created temporary response file: {temp_path}")
             return temp_path
         except Exception as e:
             log(f"Warning: Failed to process response file {resp_file}: {str(e)}")
@@ -629,6 +1793,13 @@ class LinkExe(ProxyCompiler):
                 other_args.append(arg)
                 i += 1
         
+        stamp = InputStamp(out_file, args) if DETERMINISTIC and out_file else None
+        if stamp and stamp.matches():
+            log(f"Inputs unchanged, kept {out_file}")
+            touch_outputs([out_file, implib_file, pdb_file])
+            flush_logs_if_error()
+            return 0
+        
         wine_args = other_args.copy()
         wine_args.extend(linker_directives)
         
@@ -705,12 +1876,22 @@ class LinkExe(ProxyCompiler):
         
         log("Executing: " + link_cmd)
         
-        result = self._run_batch([link_cmd])
+        try:
+            result = self._run_batch([link_cmd], job=out_file)
+        finally:
+            for temp_path in self.temp_files:
+                if os.path.exists(temp_path):
+                    os.unlink(temp_path)
+            self.temp_files = []
+        if stamp:
+            stamp.update(result)
         flush_logs_if_error()
         return result
 
 class MidlCompiler(ProxyCompiler):
     """Proxy for Microsoft MIDL.EXE."""
+    tool = 'midl'
+    
     def __init__(self, env=None):
         super().__init__(env)
         
@@ -845,12 +2026,14 @@ class MidlCompiler(ProxyCompiler):
         
         log("Executing: " + midl_cmd)
         
-        result = self._run_batch([midl_cmd])
+        result = self._run_batch([midl_cmd], job=idl_file)
         flush_logs_if_error()
         return result
 
 class RcCompiler(ProxyCompiler):
     """Proxy for Microsoft RC.EXE (Resource Compiler)."""
+    tool = 'rc'
+    
     def __init__(self, env=None):
         super().__init__(env)
         
@@ -1002,7 +2185,7 @@ class RcCompiler(ProxyCompiler):
         
         log("Executing: " + rc_cmd)
         
-        result = self._run_batch([rc_cmd])
+        result = self._run_batch([rc_cmd], job=rc_file)
         flush_logs_if_error()
         return result
 
@@ -1013,4 +2196,29 @@ if __name__ == "__main__":
     print("")
     print("Environment variables:")
     print("  VC6_VERBOSE=1    Enable verbose output (prints all logs regardless of errors)")
+    print("  VC6_DEPFILE=1    Write a make-style <object>.d depfile next to every compiled object")
+    print("  VC6_DEBUG_INFO=z7|pertu  Replace the shared /Fd PDB with /Z7 objects or one PDB per object")
+    print("  VC6_DETERMINISTIC=1  Zero COFF timestamps, skip LIB/LINK when their inputs' content didn't change")
+    print("  VC6_METRICS=<file>  Append per-job CPU, memory and I/O usage to a JSON-lines file")
+    print("  VC6_HISTORY_DB=<file>  Record job durations in a SQLite history (see vc6history.py)")
+    print("  VC6_BUILD_ID     Build name the history samples are recorded under")
+    print("  VC6_TIMEOUT=<s>  Fixed per-job timeout instead of the adaptive one (0 disables it)")
+    print("  VC6_TIMEOUT_FACTOR, VC6_TIMEOUT_MIN  Adaptive timeout: factor of the typical duration and its minimum")
+    print("  VC6_STALL_TIMEOUT=<s>  Kill jobs that do no CPU work or I/O this long (0 disables it)")
+    print("  VC6_FLAGS_CACHE=<dir>  Cache translated CL flag sets as response files shared by a target's TUs")
+    print("  VC6_TRACE=<file>  Log every proxy invocation for replay with vc6replay.py")
+    print("  VC6_PROFILE=<dir>  Profile every proxy invocation into dir, merged by vc6profile.py")
+    print("  VC6_PROFILE_INTERVAL=<s>  CPU time between stack samples with VC6_PROFILE (default 0.001)")
+    print("  VC6_STATUS_SOCKET=<path>  Send job start/end and cache events to a vc6status.py service")
+    print("  VC6_PREPROCESS=host|verify  Preprocess CL sources on the host (vc6cpp.py); verify also compiles")
+    print("                   directly and records in VC6_METRICS which objects differ")
+    print("  VC6_WINE_SLOTS=<n>  Run at most n Wine jobs at once on the host (VC6_WINE_SLOTS_DIR holds the locks)")
+    print("  VC6_WINE_SLOTS=auto  Tune the Wine job limit to the highest throughput, learned per host by vc6tune.py")
+    print("                   (jobs weighted by their typical duration in VC6_HISTORY_DB)")
+    print("  VC6_WINE         Command used instead of wine (vc6replay.py uses it for its stand-in)")
+    print("  VC6_SCRATCH_DIR  Directory for proxy temporaries (set up by vc6prefix.py scratch)")
+    print("  VC6_SCRATCH_DRIVE  Wine drive letter mapped to VC6_SCRATCH_DIR")
+    print("  VC6_INCLUDE_VIEW  Case-exact include view directory (set up by vc6prefix.py view)")
+    print("  VC6_INCLUDE_VIEW_DRIVE  Wine drive letter mapped to VC6_INCLUDE_VIEW")
+    print("  VC6_INCLUDE_VIEW_ROOTS  Source and build roots compiled through the view, separated by ':'")
     sys.exit(0)
\ No newline at end of file
@@ -0,0 +1,194 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import math
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+# Add the current directory to the path
+script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(script_dir)
+
+from vc6metrics import load_records
+
+# The recorded VC6_* settings that change how a job compiles. The others point
+# at the production build's shared state (metrics, history, status service,
+# profiles, flag cache, Wine slots and their tuning) and are dropped.
+REPLAY_KEPT_ENV = (
+    'VC6_DEBUG_INFO', 'VC6_DEPFILE', 'VC6_DETERMINISTIC', 'VC6_PREPROCESS', 'VC6_VERBOSE', 'VC6_TOOLS_ROOT',
+    'VC6_INCLUDE_VIEW', 'VC6_INCLUDE_VIEW_DRIVE', 'VC6_INCLUDE_VIEW_ROOTS', 'VC6_SCRATCH_DIR', 'VC6_SCRATCH_DRIVE',
+    'VC6_TIMEOUT', 'VC6_TIMEOUT_FACTOR', 'VC6_TIMEOUT_MIN', 'VC6_STALL_TIMEOUT',
+)
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(1, math.ceil(pct / 100.0 * len(values)))
+    return values[rank - 1]
+
+def rebase(value, mappings):
+    for old, new in mappings:
+        value = value.replace(old, new)
+    return value
+
+class Invocation:
+    """One recorded proxy invocation and the outcome of replaying it."""
+    def __init__(self, record, mappings):
+        self.tool = record['tool']
+        self.argv = [rebase(arg, mappings) for arg in record['argv']]
+        self.cwd = rebase(record['cwd'], mappings)
+        self.env = record.get('env', {})
+        self.recorded_duration = record.get('duration')
+        self.recorded_wine = record.get('wine')
+        self.recorded_returncode = record.get('returncode')
+        self.duration = None
+        self.returncode = None
+
+    def run(self, base_env, stand_in, speed, quiet):
+        env = {}
+        for source in (os.environ, self.env):
+            env.update({name: value for name, value in source.items()
+                        if not name.startswith('VC6_') or name in REPLAY_KEPT_ENV})
+        if stand_in:
+            env['VC6_WINE'] = f"{sys.executable} {os.path.realpath(__file__)} stand-in"
+            env['VC6_REPLAY_DELAY'] = str((self.recorded_wine or 0.0) * speed)
+            # The stand-in sleeps without CPU work or I/O, which the stall watchdog would kill
+            env['VC6_STALL_TIMEOUT'] = '0'
+        # --env overrides are taken as given
+        env.update(base_env)
+        env.pop('VC6_TRACE', None)
+
+        output = subprocess.DEVNULL if quiet else None
+        start = time.monotonic()
+        try:
+            self.returncode = subprocess.run([sys.executable, os.path.join(script_dir, f"{self.tool}.py")] + self.argv,
+                                             cwd=self.cwd, env=env, stdout=output, stderr=output).returncode
+        except OSError as e:
+            print(f"vc6replay: {self.tool} in {self.cwd}: {str(e)}", file=sys.stderr)
+            self.returncode = -1
+        self.duration = time.monotonic() - start
+        return self
+
+def latency_row(label, durations):
+    cells = [percentile(durations, p) for p in (50, 90, 99)] + [max(durations) if durations else None]
+    return {'label': label, 'count': len(durations), 'p50': cells[0], 'p90': cells[1], 'p99': cells[2], 'max': cells[3]}
+
+def summarize(invocations, wall):
+    summary = {
+        'invocations': len(invocations),
+        'wall': wall,
+        'throughput': len(invocations) / wall if wall > 0 else None,
+        'failed': sum(1 for inv in invocations if inv.returncode),
+        'changed_exit': sum(1 for inv in invocations if (inv.returncode == 0) != (inv.recorded_returncode == 0)),
+        'tools': {},
+    }
+    for tool in sorted({inv.tool for inv in invocations}):
+        runs = [inv for inv in invocations if inv.tool == tool]
+        summary['tools'][tool] = {
+            'replayed': latency_row('replay', [inv.duration for inv in runs]),
+            'recorded': latency_row('recorded', [inv.recorded_duration for inv in runs if inv.recorded_duration is not None]),
+            'failed': sum(1 for inv in runs if inv.returncode),
+        }
+    return summary
+
+def print_summary(summary):
+    def fmt(value):
+        return f"{value:>8.2f}" if value is not None else f"{'-':>8}"
+
+    print(f"vc6replay: {summary['invocations']} invocations in {summary['wall']:.1f}s, "
+          f"{summary['throughput'] or 0:.2f} invocations/s, {summary['failed']} failed")
+    if summary['changed_exit']:
+        print(f"vc6replay: {summary['changed_exit']} invocation(s) exited differently than when recorded")
+    print(f"{'tool':<6} {'':<9} {'count':>6} {'p50 s':>8} {'p90 s':>8} {'p99 s':>8} {'max s':>8}")
+    for tool, stats in summary['tools'].items():
+        for row in (stats['replayed'], stats['recorded']):
+            if not row['count']:
+                continue
+            print(f"{tool:<6} {row['label']:<9} {row['count']:>6} {fmt(row['p50'])} {fmt(row['p90'])} "
+                  f"{fmt(row['p99'])} {fmt(row['max'])}")
+
+def replay(args):
+    mappings = []
+    for mapping in args.rebase or []:
+        old, sep, new = mapping.partition('=')
+        if not sep:
+            print(f"vc6replay: --rebase expects OLD=NEW, got {mapping}", file=sys.stderr)
+            return 2
+        mappings.append((old, new))
+    base_env = {}
+    for setting in args.env or []:
+        name, _, value = setting.partition('=')
+        base_env[name] = value
+
+    records = load_records(args.trace)
+    records.sort(key=lambda r: r.get('start', 0))
+    if args.tool:
+        records = [r for r in records if r['tool'] in args.tool]
+    if not records:
+        print(f"vc6replay: no invocations to replay in {args.trace}", file=sys.stderr)
+        return 1
+
+    invocations = []
+    start = time.monotonic()
+    with ThreadPoolExecutor(max_workers=args.jobs) as pool:
+        for _ in range(args.repeat):
+            batch = [Invocation(record, mappings) for record in records]
+            # Submitted in recorded start order, so the pool sees the build's original mix
+            futures = [pool.submit(inv.run, base_env, args.stand_in, args.speed, not args.verbose) for inv in batch]
+            invocations.extend(future.result() for future in futures)
+    wall = time.monotonic() - start
+
+    summary = summarize(invocations, wall)
+    summary['jobs'] = args.jobs
+    summary['stand_in'] = args.stand_in
+    if args.json:
+        json.dump(summary, sys.stdout, indent=1)
+        print()
+    else:
+        print_summary(summary)
+    return 1 if summary['failed'] and args.fail else 0
+
+def stand_in(args):
+    """Stands in for wine: takes as long as the recorded Wine run and succeeds."""
+    time.sleep(float(os.environ.get('VC6_REPLAY_DELAY', '0') or 0))
+    return 0
+
+def main():
+    """
+    Replays proxy invocations recorded with VC6_TRACE=<file>.
+    Re-issues them at a chosen concurrency against real Wine or a stand-in
+    that sleeps for the recorded Wine time, and reports throughput and
+    latency percentiles per tool.
+    """
+    parser = argparse.ArgumentParser(description="Replay VC6 proxy invocation traces")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help="Replay a trace and report throughput and latency")
+    run_parser.add_argument('trace', help="Trace file written with VC6_TRACE")
+    run_parser.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, help="Concurrent invocations (default: %(default)s)")
+    run_parser.add_argument('--stand-in', action='store_true', help="Replace Wine with a stand-in that sleeps for the recorded Wine time")
+    run_parser.add_argument('--speed', type=float, default=1.0, help="Scale the stand-in's sleep (default: %(default)s)")
+    run_parser.add_argument('--tool', action='append', choices=['cl', 'link', 'lib', 'midl', 'rc'], help="Only replay these tools")
+    run_parser.add_argument('--rebase', action='append', metavar='OLD=NEW', help="Rewrite a path prefix in argv and cwd (e.g. to a copy of the build tree)")
+    run_parser.add_argument('--env', action='append', metavar='NAME=VALUE', help="Override an environment variable for every invocation")
+    run_parser.add_argument('--repeat', type=int, default=1, help="Replay the trace this many times")
+    run_parser.add_argument('--fail', action='store_true', help="Exit with status 1 if any invocation fails")
+    run_parser.add_argument('--json', action='store_true', help="Print the summary as JSON")
+    run_parser.add_argument('-v', '--verbose', action='store_true', help="Show the proxies' output")
+    run_parser.set_defaults(func=replay)
+
+    stand_in_parser = subparsers.add_parser('stand-in', help=argparse.SUPPRESS)
+    stand_in_parser.add_argument('argv', nargs=argparse.REMAINDER)
+    stand_in_parser.set_defaults(func=stand_in)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,343 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# Add the current directory to the path
+script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(script_dir)
+
+from vc6proxy import wineserver_cpu_time
+from vc6history import HistoryDB, median
+
+# Completions counted in the recent throughput figures
+THROUGHPUT_WINDOW = 60.0
+# How often the sampler checks the wineserver and drops jobs of dead processes
+SAMPLE_INTERVAL = 5.0
+
+class BuildStatus:
+    """Live state of a build, fed by the proxies' lifecycle events."""
+    def __init__(self, history_db=None):
+        self.lock = threading.Lock()
+        self.history_db = history_db
+        self.baseline = None
+        self.build = None
+        self.first_event = None
+        self.running = {}
+        self.finished = set()
+        self.completions = []
+        self.tools = {}
+        self.caches = {}
+        self.events = 0
+        self.lost = 0
+        self.busy_seconds = 0.0
+        self.last_change = None
+        self.wineserver = None
+        self.wineserver_ratio = None
+
+    def tool(self, name):
+        return self.tools.setdefault(name, {'started': 0, 'finished': 0, 'failed': 0, 'retries': 0, 'seconds': 0.0})
+
+    def load_baseline(self):
+        """Durations of the last finished build, keyed by (tool, job), for the queue and ETA."""
+        self.baseline = {}
+        if not self.history_db or not os.path.exists(self.history_db):
+            return
+        try:
+            db = HistoryDB(self.history_db)
+            try:
+                builds = [build for build, _, _, _ in db.builds() if build != self.build]
+                if builds:
+                    samples = {}
+                    for (tool, job, _), durations in db.durations(builds[-1:]).items():
+                        samples.setdefault((tool, job), []).extend(durations)
+                    self.baseline = {key: median(durations) for key, durations in samples.items()}
+            finally:
+                db.close()
+        except Exception as e:
+            print(f"vc6status: ignoring history {self.history_db}: {str(e)}", file=sys.stderr)
+
+    def account(self, now):
+        """Integrate the number of running jobs over time, for the observed parallelism."""
+        if self.last_change is not None:
+            self.busy_seconds += len(self.running) * (now - self.last_change)
+        self.last_change = now
+
+    def handle(self, event):
+        with self.lock:
+            now = time.time()
+            self.events += 1
+            if self.first_event is None:
+                self.first_event = now
+            if self.build is None and event.get('build'):
+                self.build = event['build']
+            if self.baseline is None:
+                self.load_baseline()
+
+            kind = event.get('event')
+            key = (event.get('pid'), event.get('tool'), event.get('id') or event.get('job'))
+            if kind == 'start':
+                self.account(now)
+                # A retry of a running job (same id) is still one job
+                if key not in self.running:
+                    self.tool(event.get('tool'))['started'] += 1
+                self.running[key] = event.get('time', now)
+            elif kind == 'end':
+                self.account(now)
+                self.running.pop(key, None)
+                stats = self.tool(event.get('tool'))
+                stats['finished'] += 1
+                stats['retries'] += event.get('retries', 0)
+                stats['seconds'] += event.get('wall') or 0.0
+                if event.get('returncode'):
+                    stats['failed'] += 1
+                self.finished.add((event.get('tool'), event.get('job')))
+                self.completions.append((now, event.get('tool')))
+            elif kind == 'cache':
+                counts = self.caches.setdefault(event.get('cache'), [0, 0])
+                counts[0 if event.get('hit') else 1] += 1
+
+    def sample(self):
+        """Drop jobs whose proxy process is gone and measure the wineserver's CPU use."""
+        with self.lock:
+            now = time.time()
+            for key in list(self.running):
+                pid = key[0]
+                try:
+                    os.kill(pid, 0)
+                except ProcessLookupError:
+                    self.account(now)
+                    del self.running[key]
+                    self.lost += 1
+                except (OSError, TypeError):
+                    pass
+
+            cpu = wineserver_cpu_time()
+            if cpu is not None and self.wineserver is not None and cpu >= self.wineserver[1]:
+                self.wineserver_ratio = (cpu - self.wineserver[1]) / (now - self.wineserver[0])
+            self.wineserver = (now, cpu) if cpu is not None else None
+
+    def snapshot(self):
+        """Return the status as a dict, with the queue and ETA estimated from the last build."""
+        with self.lock:
+            now = time.time()
+            self.completions = [(t, tool) for t, tool in self.completions if now - t <= THROUGHPUT_WINDOW]
+            self.account(now)
+            elapsed = now - self.first_event if self.first_event else 0.0
+            parallelism = self.busy_seconds / elapsed if elapsed > 0 else 0.0
+
+            running = []
+            for (pid, tool, job), start in sorted(self.running.items(), key=lambda item: item[1]):
+                running.append({'tool': tool, 'job': job, 'pid': pid, 'elapsed': now - start,
+                                'expected': (self.baseline or {}).get((tool, job))})
+
+            queued = None
+            remaining = None
+            eta = None
+            if self.baseline:
+                started = self.finished | {(tool, job) for _, tool, job in self.running}
+                pending = [duration for key, duration in self.baseline.items() if key not in started]
+                queued = len(pending)
+                remaining = sum(pending)
+                for job in running:
+                    if job['expected'] is not None:
+                        remaining += max(0.0, job['expected'] - job['elapsed'])
+                eta = remaining / max(1.0, parallelism, len(running)) if self.events else None
+
+            tools = {}
+            for name, stats in self.tools.items():
+                tools[name] = dict(stats)
+                tools[name]['running'] = sum(1 for _, tool, _ in self.running if tool == name)
+                tools[name]['recent_per_min'] = sum(1 for _, tool in self.completions if tool == name) \
+                    * 60.0 / THROUGHPUT_WINDOW
+
+            return {
+                'build': self.build,
+                'elapsed': elapsed,
+                'events': self.events,
+                'running': running,
+                'queued': queued,
+                'baseline_jobs': len(self.baseline) if self.baseline else None,
+                'remaining_seconds': remaining,
+                'eta': eta,
+                'parallelism': parallelism,
+                'tools': tools,
+                'caches': {name: {'hits': hits, 'misses': misses} for name, (hits, misses) in self.caches.items()},
+                'lost': self.lost,
+                'wineserver_cpu': self.wineserver_ratio,
+                'load': os.getloadavg(),
+                'cpus': os.cpu_count(),
+            }
+
+def format_seconds(seconds):
+    if seconds is None:
+        return "-"
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m{seconds:02d}s" if minutes else f"{seconds}s"
+
+def render_text(status):
+    """The human-readable status page."""
+    lines = [f"build {status['build'] or '-'}: {format_seconds(status['elapsed'])} elapsed, "
+             f"ETA {format_seconds(status['eta'])}"]
+    finished = sum(stats['finished'] for stats in status['tools'].values())
+    if status['baseline_jobs']:
+        lines.append(f"jobs: {len(status['running'])} running, ~{status['queued']} queued, {finished} finished "
+                     f"(last build ran {status['baseline_jobs']})")
+    else:
+        lines.append(f"jobs: {len(status['running'])} running, {finished} finished (no previous build to estimate from)")
+    wineserver = status['wineserver_cpu']
+    lines.append(f"host: load {status['load'][0]:.1f} on {status['cpus']} CPUs, "
+                 f"parallelism {status['parallelism']:.1f}, wineserver "
+                 f"{f'{wineserver * 100:.0f}% CPU' if wineserver is not None else 'not sampled'}")
+    for name, cache in sorted(status['caches'].items()):
+        total = cache['hits'] + cache['misses']
+        lines.append(f"{name} cache: {cache['hits']}/{total} hits ({cache['hits'] * 100.0 / total:.0f}%)")
+    if status['lost']:
+        lines.append(f"{status['lost']} job(s) lost: the proxy exited without reporting an end")
+
+    lines.append("")
+    lines.append(f"{'tool':<6} {'running':>8} {'finished':>9} {'failed':>7} {'retries':>8} {'per min':>8} {'avg s':>7}")
+    for name, stats in sorted(status['tools'].items()):
+        average = stats['seconds'] / stats['finished'] if stats['finished'] else 0.0
+        lines.append(f"{name:<6} {stats['running']:>8} {stats['finished']:>9} {stats['failed']:>7} "
+                     f"{stats['retries']:>8} {stats['recent_per_min']:>8.1f} {average:>7.1f}")
+
+    if status['running']:
+        lines.append("")
+        lines.append("running (longest first):")
+        for job in status['running']:
+            expected = f" of ~{format_seconds(job['expected'])}" if job['expected'] is not None else ""
+            lines.append(f"  {format_seconds(job['elapsed']):>7}{expected:<12} {job['tool']:<5} {job['job']}")
+    return "\n".join(lines) + "\n"
+
+def render_prometheus(status):
+    """The counters and gauges in the Prometheus text exposition format."""
+    lines = []
+
+    def metric(name, kind, help_text, samples):
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {kind}")
+        for labels, value in samples:
+            if value is None:
+                continue
+            label_text = ','.join(f'{key}="{label}"' for key, label in labels.items())
+            lines.append(f"{name}{{{label_text}}} {value}" if label_text else f"{name} {value}")
+
+    tools = sorted(status['tools'].items())
+    metric('vc6_jobs_running', 'gauge', "Proxy jobs running in Wine",
+           [({'tool': name}, stats['running']) for name, stats in tools])
+    metric('vc6_jobs_started_total', 'counter', "Proxy jobs started",
+           [({'tool': name}, stats['started']) for name, stats in tools])
+    metric('vc6_jobs_finished_total', 'counter', "Proxy jobs finished",
+           [({'tool': name}, stats['finished']) for name, stats in tools])
+    metric('vc6_jobs_failed_total', 'counter', "Proxy jobs that exited non-zero",
+           [({'tool': name}, stats['failed']) for name, stats in tools])
+    metric('vc6_job_retries_total', 'counter', "Jobs retried after the watchdog killed them",
+           [({'tool': name}, stats['retries']) for name, stats in tools])
+    metric('vc6_job_seconds_total', 'counter', "Wall seconds spent in finished jobs",
+           [({'tool': name}, f"{stats['seconds']:.3f}") for name, stats in tools])
+    metric('vc6_cache_hits_total', 'counter', "Proxy cache hits",
+           [({'cache': name}, cache['hits']) for name, cache in sorted(status['caches'].items())])
+    metric('vc6_cache_misses_total', 'counter', "Proxy cache misses",
+           [({'cache': name}, cache['misses']) for name, cache in sorted(status['caches'].items())])
+    metric('vc6_jobs_queued', 'gauge', "Jobs of the last build not started yet", [({}, status['queued'])])
+    metric('vc6_build_eta_seconds', 'gauge', "Estimated seconds until the build finishes",
+           [({}, f"{status['eta']:.1f}" if status['eta'] is not None else None)])
+    metric('vc6_build_parallelism', 'gauge', "Average number of jobs running since the build started",
+           [({}, f"{status['parallelism']:.2f}")])
+    metric('vc6_jobs_lost_total', 'counter', "Jobs whose proxy exited without reporting an end", [({}, status['lost'])])
+    metric('vc6_wineserver_cpu_ratio', 'gauge', "CPU used by the wineserver, 1 is one full core",
+           [({}, f"{status['wineserver_cpu']:.3f}" if status['wineserver_cpu'] is not None else None)])
+    metric('vc6_status_events_total', 'counter', "Events received from the proxies", [({}, status['events'])])
+    return "\n".join(lines) + "\n"
+
+class StatusHandler(BaseHTTPRequestHandler):
+    status = None
+
+    def do_GET(self):
+        snapshot = self.status.snapshot()
+        if self.path == '/metrics':
+            body, content_type = render_prometheus(snapshot), 'text/plain; version=0.0.4'
+        elif self.path == '/status.json':
+            body, content_type = json.dumps(snapshot, indent=1), 'application/json'
+        elif self.path == '/':
+            body, content_type = render_text(snapshot), 'text/plain; charset=utf-8'
+        else:
+            self.send_error(404)
+            return
+        data = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def receive_events(sock, status):
+    while True:
+        data = sock.recv(65536)
+        try:
+            event = json.loads(data.decode('utf-8'))
+        except ValueError:
+            continue
+        if isinstance(event, dict):
+            status.handle(event)
+
+def sample_forever(status):
+    while True:
+        status.sample()
+        time.sleep(SAMPLE_INTERVAL)
+
+def serve(args):
+    status = BuildStatus(args.history)
+    if os.path.exists(args.socket):
+        os.unlink(args.socket)
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_DGRAM)
+    sock.bind(args.socket)
+    # Bursts of job starts shouldn't overflow the queue while a page renders
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+
+    StatusHandler.status = status
+    server = ThreadingHTTPServer((args.bind, args.port), StatusHandler)
+    server.daemon_threads = True
+    threading.Thread(target=receive_events, args=(sock, status), daemon=True).start()
+    threading.Thread(target=sample_forever, args=(status,), daemon=True).start()
+    print(f"vc6status: listening on {args.socket}, status at http://{args.bind}:{server.server_address[1]}/",
+          file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.unlink(args.socket)
+    return 0
+
+def main():
+    """
+    Live status service for a VC6 build.
+    Collects the job start/end and cache events the proxies send to
+    VC6_STATUS_SOCKET and serves them over localhost HTTP: a text page
+    at /, the same as JSON at /status.json and Prometheus counters at
+    /metrics. The queue and ETA are estimated from the last build in
+    the VC6_HISTORY_DB history.
+    """
+    parser = argparse.ArgumentParser(description="Live status of a VC6 build")
+    parser.add_argument('--socket', default=os.environ.get('VC6_STATUS_SOCKET'), required='VC6_STATUS_SOCKET' not in os.environ,
+                        help="Unix datagram socket the proxies send events to (default: VC6_STATUS_SOCKET)")
+    parser.add_argument('--port', type=int, default=9466, help="HTTP port (default: %(default)s, 0 picks a free one)")
+    parser.add_argument('--bind', default='127.0.0.1', help="HTTP address (default: %(default)s)")
+    parser.add_argument('--history', default=os.environ.get('VC6_HISTORY_DB'), help="History database for the queue and ETA (default: VC6_HISTORY_DB)")
+    args = parser.parse_args()
+    sys.exit(serve(args))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,298 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import json
+import time
+import fcntl
+import argparse
+import platform
+import tempfile
+from contextlib import contextmanager
+
+# Optima learned for each host, kept across builds
+TUNE_FILE = os.environ.get('VC6_TUNE_FILE') or os.path.join(os.path.expanduser('~'), '.cache', 'vc6', 'tune.json')
+# Seconds of completions measured before the slot limit is moved
+TUNE_INTERVAL = float(os.environ.get('VC6_TUNE_INTERVAL', '20'))
+TUNE_MIN_JOBS = 4
+MAX_SLOTS = int(os.environ.get('VC6_WINE_SLOTS_MAX', '0') or 0) or 2 * (os.cpu_count() or 1)
+# The tuning state belongs to one build; "vc6tune.py start" begins it
+BUILD_ID = os.environ.get('VC6_BUILD_ID') or 'unnamed'
+
+# Throughput changes within this fraction are noise (TUs differ in size)
+TOLERANCE = 0.05
+# Busy fraction of all CPUs at which more Wine jobs only add contention
+CPU_SATURATED = 0.95
+CPU_IDLE = 0.80
+# Shed slots below this fraction of MemAvailable, or above this PSI some avg10
+MEMORY_LOW = 0.10
+MEMORY_PRESSURE = 10.0
+
+STATE_NAME = 'tune-state.json'
+LOCK_NAME = 'tune.lock'
+
+def host_key():
+    """Identify the host by its hardware; containers get a new hostname on every run."""
+    model = None
+    try:
+        with open('/proc/cpuinfo') as f:
+            for line in f:
+                if line.startswith('model name'):
+                    model = line.split(':', 1)[1].strip()
+                    break
+    except OSError:
+        pass
+    memory = meminfo().get('MemTotal', 0) // (1024 * 1024)
+    return f"{os.cpu_count()}x {model or platform.machine()}, {memory} GiB"
+
+def meminfo():
+    """Return /proc/meminfo in KiB."""
+    info = {}
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                name, _, value = line.partition(':')
+                fields = value.split()
+                if fields and fields[0].isdigit():
+                    info[name] = int(fields[0])
+    except OSError:
+        pass
+    return info
+
+def memory_available():
+    """Fraction of memory available to new processes, or None."""
+    info = meminfo()
+    if not info.get('MemTotal') or 'MemAvailable' not in info:
+        return None
+    return info['MemAvailable'] / info['MemTotal']
+
+def memory_pressure():
+    """Share of the last 10 s some task stalled on memory (PSI), or None without PSI."""
+    try:
+        with open('/proc/pressure/memory') as f:
+            for line in f:
+                if line.startswith('some'):
+                    return float(line.split('avg10=', 1)[1].split()[0])
+    except (OSError, IndexError, ValueError):
+        pass
+    return None
+
+def cpu_times():
+    """Return (total, idle) jiffies of all CPUs from /proc/stat."""
+    try:
+        with open('/proc/stat') as f:
+            fields = [int(value) for value in f.readline().split()[1:]]
+    except (OSError, ValueError):
+        return 0, 0
+    # idle + iowait
+    return sum(fields[:8]), sum(fields[3:5])
+
+def load_learned(path=TUNE_FILE):
+    try:
+        with open(path, 'r') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+def save_learned(slots, throughput, path=TUNE_FILE):
+    """Record a host's best slot count and the throughput measured at each count."""
+    learned = load_learned(path)
+    learned[host_key()] = {'slots': slots, 'throughput': throughput, 'updated': time.time()}
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(learned, f, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+def initial_slots():
+    learned = load_learned().get(host_key())
+    if learned and learned.get('slots'):
+        return max(1, min(MAX_SLOTS, learned['slots']))
+    return max(1, min(MAX_SLOTS, os.cpu_count() or 1))
+
+@contextmanager
+def locked(directory):
+    os.makedirs(directory, exist_ok=True)
+    fd = os.open(os.path.join(directory, LOCK_NAME), os.O_RDWR | os.O_CREAT, 0o666)
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)
+
+def new_state():
+    total, idle = cpu_times()
+    now = time.time()
+    return {
+        'build': BUILD_ID, 'limit': initial_slots(), 'direction': 1, 'last_limit': None, 'last_throughput': None,
+        'throughput': {}, 'started': now, 'updated': now, 'interval_start': now, 'completed': 0, 'work': 0.0,
+        'waited': 0, 'known_cost': 0.0, 'known_jobs': 0, 'cpu_total': total, 'cpu_idle': idle, 'log': [],
+    }
+
+def load_state(directory):
+    try:
+        with open(os.path.join(directory, STATE_NAME), 'r') as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return None
+    # Left by an earlier build
+    if state.get('build') != BUILD_ID:
+        return None
+    return state
+
+def save_state(directory, state):
+    path = os.path.join(directory, STATE_NAME)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(state, f)
+    os.replace(tmp_path, path)
+
+def current_limit(directory):
+    """Return the number of Wine slots proxies may use right now."""
+    state = load_state(directory)
+    if state is None:
+        try:
+            with locked(directory):
+                state = load_state(directory)
+                if state is None:
+                    state = new_state()
+                    save_state(directory, state)
+        except OSError:
+            return initial_slots()
+    return state['limit']
+
+def best_slots(throughput):
+    if not throughput:
+        return None
+    return int(max(throughput, key=lambda limit: throughput[limit]))
+
+def adjust(state, now):
+    """Move the slot limit one step towards higher throughput, away from memory pressure."""
+    throughput = state['work'] / (now - state['interval_start'])
+    total, idle = cpu_times()
+    busy = 1 - (idle - state['cpu_idle']) / (total - state['cpu_total']) if total > state['cpu_total'] else None
+    available = memory_available()
+    pressure = memory_pressure()
+    limit = state['limit']
+    # Only a throughput change that followed a limit change says which way to go
+    last = state['last_throughput'] if state['last_limit'] not in (None, limit) else None
+
+    key = str(limit)
+    previous = state['throughput'].get(key)
+    state['throughput'][key] = throughput if previous is None else (previous + throughput) / 2
+
+    if (available is not None and available < MEMORY_LOW) or (pressure is not None and pressure > MEMORY_PRESSURE):
+        step, reason = -1, 'memory pressure'
+    elif not state['waited']:
+        # Fewer jobs than slots were ready, so the limit isn't what bounds throughput
+        step, reason = 0, 'slots not all used'
+    elif last is not None and throughput > last * (1 + TOLERANCE):
+        step, reason = state['direction'], 'throughput rose'
+    elif last is not None and throughput < last * (1 - TOLERANCE):
+        step, reason = -state['direction'], 'throughput fell'
+    elif busy is not None and busy >= CPU_SATURATED:
+        step, reason = -1, 'CPU saturated'
+    elif busy is None or busy < CPU_IDLE:
+        step, reason = 1, 'CPU idle'
+    else:
+        step, reason = 0, 'steady'
+
+    new_limit = max(1, min(MAX_SLOTS, limit + step))
+    if new_limit != limit:
+        state['direction'] = new_limit - limit
+    state['log'].append({
+        'time': round(now - state['started'], 1), 'limit': limit, 'new_limit': new_limit,
+        'throughput': round(throughput, 3), 'busy': None if busy is None else round(busy, 3),
+        'memory_available': None if available is None else round(available, 3), 'reason': reason,
+    })
+    state.update({
+        'limit': new_limit, 'last_limit': limit, 'last_throughput': throughput, 'interval_start': now,
+        'completed': 0, 'work': 0.0, 'waited': 0, 'cpu_total': total, 'cpu_idle': idle,
+    })
+
+def record_completion(directory, waited, cost=None):
+    """Count a finished Wine job, and retune the slot limit once an interval has been measured.
+    
+    Jobs count by cost, their typical duration in earlier builds, so an
+    interval that happened to finish many small TUs doesn't look faster;
+    jobs without history count as the average known job.
+    """
+    try:
+        with locked(directory):
+            state = load_state(directory) or new_state()
+            now = time.time()
+            if cost:
+                state['known_cost'] += cost
+                state['known_jobs'] += 1
+            else:
+                cost = state['known_cost'] / state['known_jobs'] if state['known_jobs'] else 1.0
+            state['completed'] += 1
+            state['work'] += cost
+            state['waited'] += 1 if waited else 0
+            state['updated'] = now
+            if now - state['interval_start'] >= TUNE_INTERVAL and state['completed'] >= TUNE_MIN_JOBS:
+                adjust(state, now)
+            save_state(directory, state)
+    except OSError as e:
+        print(f"vc6tune: Warning: Failed to update the slot tuning state: {str(e)}", file=sys.stderr)
+
+def start(args):
+    with locked(args.slots_dir):
+        state = new_state()
+        save_state(args.slots_dir, state)
+    print(f"vc6tune: starting with {state['limit']} Wine slot(s) on {host_key()}")
+    return 0
+
+def report(args):
+    state = load_state(args.slots_dir) if not args.learned else None
+    if state:
+        for entry in state['log']:
+            busy = f"{entry['busy']:.0%}" if entry['busy'] is not None else '?'
+            available = f"{entry['memory_available']:.0%}" if entry['memory_available'] is not None else '?'
+            print(f"  {entry['time']:>7.0f}s  {entry['limit']:>3} slot(s)  {entry['throughput']:>6.2f} work s/s  "
+                  f"CPU {busy:>4}  mem free {available:>4}  {entry['reason']}"
+                  + (f" -> {entry['new_limit']}" if entry['new_limit'] != entry['limit'] else ''))
+        best = best_slots(state['throughput'])
+        if best:
+            # Kept once the build is over, so one build's intervals can't overwrite another's mid-way
+            save_learned(best, state['throughput'])
+            print(f"vc6tune: best throughput with {best} Wine slot(s), "
+                  f"{state['throughput'][str(best)]:.2f} work s/s; ended at {state['limit']}, saved to {TUNE_FILE}")
+        else:
+            print(f"vc6tune: too few jobs to tune, ended at {state['limit']} Wine slot(s)")
+        return 0
+
+    learned = load_learned()
+    if not learned:
+        print(f"vc6tune: nothing learned yet in {TUNE_FILE}")
+    for host, entry in sorted(learned.items()):
+        print(f"  {host}: {entry['slots']} Wine slot(s)")
+    return 0
+
+def main():
+    """
+    Feedback control of the number of concurrent Wine jobs.
+    With VC6_WINE_SLOTS=auto every proxy counts its finished jobs here, each
+    weighted by its typical duration in VC6_HISTORY_DB; each interval the
+    slot limit moves one step in the direction that raised the work completed
+    per second, backs off under memory pressure or CPU saturation. "start"
+    begins a build's tuning and "report" ends it, keeping the best limit per
+    host for the next build.
+    """
+    parser = argparse.ArgumentParser(description="Auto-tuning of the VC6 proxies' Wine slot limit")
+    parser.add_argument('--slots-dir', default=os.environ.get('VC6_WINE_SLOTS_DIR') or os.path.join(tempfile.gettempdir(), 'vc6-wine-slots'),
+                        help="Slot lock directory (default: $VC6_WINE_SLOTS_DIR)")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    start_parser = subparsers.add_parser('start', help="Start a build at the host's learned slot limit")
+    start_parser.set_defaults(func=start)
+
+    report_parser = subparsers.add_parser('report', help="Show the tuning steps of this build and keep its best limit")
+    report_parser.add_argument('--learned', action='store_true', help="Show the slot limits learned per host instead")
+    report_parser.set_defaults(func=report)
+
+    args = parser.parse_args()
+    sys.exit(args.func(args))
+
+if __name__ == "__main__":
+    main()
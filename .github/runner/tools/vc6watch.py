@@ -0,0 +1,313 @@
+#!/usr/bin/python3
+
+import os
+import sys
+import time
+import shlex
+import select
+import ctypes
+import struct
+import argparse
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+
+# Add the current directory to the path
+script_dir = os.path.dirname(os.path.realpath(__file__))
+sys.path.append(script_dir)
+
+from vc6proxy import (CLCompiler, SCRIPT_DIR, WINE_COMMAND, unix_to_wine, log, flush_logs_if_error,
+                      invalidate_dir_listing)
+from vc6build import BuildGraph, execute_commands
+from vc6affected import AffectedTargets
+from vc6headers import read_cache_value
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_ISDIR = 0x40000000
+IN_NONBLOCK = 0o4000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_TO | IN_CREATE | IN_DELETE
+EVENT_HEADER = struct.Struct('iIII')
+
+# Editors save in bursts (temp file, rename, chmod), wait this long for quiet
+DEBOUNCE = 0.1
+# Swap, backup and autosave files editors write next to the file being saved
+EDITOR_TEMP_SUFFIXES = ('~', '.swp', '.swo', '.swx', '.tmp', '.bak', '.orig')
+EDITOR_TEMP_PREFIXES = ('.#', '#')
+
+def editor_temporary(path):
+    name = os.path.basename(path)
+    # 4913 is the file vim creates to probe whether it may write to a directory
+    return name.endswith(EDITOR_TEMP_SUFFIXES) or name.startswith(EDITOR_TEMP_PREFIXES) or name == '4913'
+
+class Inotify:
+    """Recursive directory watch on top of the raw inotify syscalls."""
+    def __init__(self):
+        self.libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self.libc.inotify_init1(IN_NONBLOCK | IN_CLOEXEC)
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self.paths = {}
+
+    def add_watch(self, path):
+        wd = self.libc.inotify_add_watch(self.fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            errno = ctypes.get_errno()
+            raise OSError(errno, f"inotify_add_watch {path}: {os.strerror(errno)}"
+                                 " (raise fs.inotify.max_user_watches?)")
+        self.paths[wd] = path
+
+    def add_tree(self, root, skip=()):
+        for dirpath, dirs, _ in os.walk(root):
+            dirs[:] = [d for d in dirs if not d.startswith('.') and os.path.join(dirpath, d) not in skip]
+            self.add_watch(dirpath)
+
+    def read(self):
+        """Return (path, mask) for the events queued so far."""
+        events = []
+        try:
+            data = os.read(self.fd, 65536)
+        except BlockingIOError:
+            return events
+        offset = 0
+        while offset + EVENT_HEADER.size <= len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            directory = self.paths.get(wd)
+            if directory is not None or mask & IN_Q_OVERFLOW:
+                events.append((os.path.join(directory, os.fsdecode(name)) if directory else None, mask))
+        return events
+
+class WineSession:
+    """A cmd.exe kept running under Wine with setup.bat applied, fed commands over stdin."""
+    SENTINEL = '__VC6_DONE__'
+
+    def __init__(self):
+        setup = unix_to_wine(os.path.join(SCRIPT_DIR, 'setup.bat'))
+        self.process = subprocess.Popen(WINE_COMMAND + ['cmd', '/q', '/k', setup],
+                                        stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                        universal_newlines=True, bufsize=1, start_new_session=True)
+        # Wait until setup.bat has run
+        self.run([])
+
+    def run(self, commands, cwd=None):
+        """Run command lines in the session and return (exit code of the last one, output)."""
+        lines = []
+        if cwd:
+            lines.append(f'cd /d "{unix_to_wine(cwd)}"')
+        lines.extend(commands)
+        lines.append(f'echo {self.SENTINEL} %ERRORLEVEL%')
+        try:
+            self.process.stdin.write('\r\n'.join(lines) + '\r\n')
+            self.process.stdin.flush()
+        except OSError:
+            raise RuntimeError("Wine session ended")
+
+        output = []
+        for line in self.process.stdout:
+            if self.SENTINEL in line:
+                status = line.split(self.SENTINEL, 1)[1].split()
+                return (int(status[0]) if status and status[0].lstrip('-').isdigit() else 1), ''.join(output)
+            output.append(line)
+        raise RuntimeError("Wine session ended")
+
+# The warm session of a worker process
+session = None
+
+def start_session():
+    global session
+    session = WineSession()
+
+class SessionCLCompiler(CLCompiler):
+    """CL proxy that runs CL.EXE in the worker's warm Wine session instead of a new wine cmd /c."""
+    def _run_batch(self, commands, job=None, flags=None, final=True):
+        global session
+        try:
+            returncode, output = session.run(commands, os.getcwd())
+        except RuntimeError:
+            log("Wine session ended, starting a new one")
+            start_session()
+            returncode, output = session.run(commands, os.getcwd())
+        self.last_output = output
+        # Diagnostics go straight to the developer, not only on failure
+        if output.strip():
+            print(output.rstrip())
+        return returncode
+
+def compile_in_session(command, cwd):
+    """Run one compile job in the worker's session; other tools run as usual."""
+    start = time.monotonic()
+    argv = shlex.split(command)
+    if not argv or os.path.basename(argv[0]) != 'cl.py':
+        return execute_commands([command], cwd), time.monotonic() - start
+    try:
+        os.chdir(cwd)
+        returncode = SessionCLCompiler().compile(argv[1:])
+    except Exception as e:
+        print(f"vc6watch: {str(e)}", file=sys.stderr)
+        returncode = 1
+    flush_logs_if_error()
+    sys.stdout.flush()
+    return returncode, time.monotonic() - start
+
+class Watcher:
+    """Recompiles the TUs a saved file affects and relinks on request."""
+    def __init__(self, graph, targets, pool, auto_link):
+        self.graph = graph
+        self.targets = targets
+        self.pool = pool
+        self.auto_link = auto_link
+        self.pending_links = set()
+
+    def compile(self, paths):
+        changes = []
+        for path in sorted(paths):
+            if editor_temporary(path):
+                continue
+            if self.targets.needs_full_build(path):
+                print(f"vc6watch: {os.path.relpath(path, self.targets.source_root)} changed, "
+                      "re-run cmake and restart the watch")
+                continue
+            self.targets.forget(path)
+            changes.append(('M', path))
+        if not changes:
+            return
+
+        affected, reasons, full = self.targets.select(changes)
+        if full:
+            # The file that made select() give up is the last one it gave a reason for
+            path, reason = list(reasons.items())[-1]
+            print(f"vc6watch: {os.path.relpath(path, self.targets.source_root)} changed, {reason} needed, "
+                  "run the build and restart the watch")
+            return
+        compiles = sorted(job for job in affected if job.kind == 'compile')
+        rules = [job for job in self.graph.topological_order() if job in affected and job.kind == 'rule']
+        self.pending_links |= {job for job in affected if job.kind == 'link'}
+        if not compiles and not rules:
+            return
+
+        names = ', '.join(os.path.basename(path) for _, path in changes)
+        print(f"vc6watch: {names} changed, {len(compiles)} TU(s) to compile")
+        start = time.monotonic()
+        for job in rules:
+            if execute_commands(job.commands, job.cwd) != 0:
+                print(f"vc6watch: FAILED {job.name}")
+                return
+
+        futures = {job: self.pool.submit(compile_in_session, job.commands[0], job.cwd) for job in compiles}
+        failed = []
+        for job, future in futures.items():
+            returncode, duration = future.result()
+            if returncode != 0:
+                failed.append(job)
+            print(f"vc6watch: {'FAILED ' if returncode else ''}{job.name} ({duration:.1f}s)")
+            # The TU's includes may have changed with the edit
+            self.targets.scan(job)
+        print(f"vc6watch: {len(compiles) - len(failed)}/{len(compiles)} TU(s) compiled in "
+              f"{time.monotonic() - start:.1f}s, {len(self.pending_links)} link job(s) pending")
+
+        if self.auto_link and not failed:
+            self.link()
+
+    def link(self):
+        """Rerun the library and executable jobs of everything compiled since the last link."""
+        if not self.pending_links:
+            print("vc6watch: nothing to link")
+            return
+        start = time.monotonic()
+        for job in self.graph.topological_order():
+            if job not in self.pending_links:
+                continue
+            job_start = time.monotonic()
+            returncode = execute_commands(job.commands, job.cwd)
+            print(f"vc6watch: {'FAILED ' if returncode else ''}{job.name} ({time.monotonic() - job_start:.1f}s)")
+            if returncode != 0:
+                return
+            self.pending_links.discard(job)
+        print(f"vc6watch: linked in {time.monotonic() - start:.1f}s")
+
+def main():
+    """
+    Watch mode for the VC6 proxies.
+    Watches the source tree with inotify, recompiles the TUs a saved file
+    affects in warm cmd.exe sessions (Wine started and setup.bat applied
+    once), and relinks the affected libraries and executables on request.
+    """
+    parser = argparse.ArgumentParser(description="Recompile on save with warm Wine sessions")
+    parser.add_argument('build_dir', nargs='?', default='.', help="Configured CMake build directory (Unix Makefiles generator)")
+    parser.add_argument('-j', '--jobs', type=int, default=min(4, os.cpu_count() or 1), help="Warm Wine sessions (default: %(default)s)")
+    parser.add_argument('--link', action='store_true', help="Relink after every successful compile")
+    args = parser.parse_args()
+
+    build_dir = os.path.abspath(args.build_dir)
+    source_root = read_cache_value(build_dir, 'CMAKE_HOME_DIRECTORY')
+    if not source_root:
+        print(f"vc6watch: {build_dir} is not a configured CMake build dir", file=sys.stderr)
+        sys.exit(2)
+
+    graph = BuildGraph(build_dir)
+    try:
+        graph.load()
+    except RuntimeError as e:
+        print(f"vc6watch: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    start = time.monotonic()
+    targets = AffectedTargets(graph, source_root)
+    targets.header_includers()
+    inotify = Inotify()
+    try:
+        inotify.add_tree(source_root, skip={build_dir})
+    except OSError as e:
+        print(f"vc6watch: {e}", file=sys.stderr)
+        sys.exit(1)
+    print(f"vc6watch: {len(targets.commands)} TUs, {len(targets.includers)} headers, "
+          f"{len(inotify.paths)} directories watched ({time.monotonic() - start:.1f}s)")
+
+    workers = max(1, args.jobs)
+    with ProcessPoolExecutor(max_workers=workers, initializer=start_session) as pool:
+        # Boot every worker's session now rather than on the first save
+        list(pool.map(time.sleep, [0.1] * workers))
+        watcher = Watcher(graph, targets, pool, args.link)
+        print("vc6watch: ready; press l + Enter to link, q + Enter to quit")
+
+        inputs = [inotify.fd, sys.stdin]
+        while True:
+            readable, _, _ = select.select(inputs, [], [])
+            if sys.stdin in readable:
+                command = sys.stdin.readline()
+                if not command:
+                    inputs.remove(sys.stdin)
+                elif command.strip() == 'l':
+                    watcher.link()
+                elif command.strip() == 'q':
+                    break
+            if inotify.fd not in readable:
+                continue
+
+            changed = set()
+            events = inotify.read()
+            while events:
+                for path, mask in events:
+                    if path is None:
+                        print("vc6watch: inotify queue overflowed, some changes may have been missed")
+                        continue
+                    invalidate_dir_listing(os.path.dirname(path))
+                    if mask & IN_ISDIR:
+                        if mask & (IN_CREATE | IN_MOVED_TO):
+                            inotify.add_tree(path)
+                    elif mask & (IN_CLOSE_WRITE | IN_MOVED_TO):
+                        changed.add(path)
+                time.sleep(DEBOUNCE)
+                events = inotify.read()
+            if changed:
+                watcher.compile(changed)
+
+    sys.exit(0)
+
+if __name__ == "__main__":
+    main()
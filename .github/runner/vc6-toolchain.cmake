@@ -42,3 +42,9 @@ set(CMAKE_FIND_ROOT_PATH_MODE_PACKAGE ONLY)
 
 # Add MIDL compiler command
 set(CMAKE_MIDL_COMPILER "${MIDL_PROXY}")
+
+# The CL proxy emulates /showIncludes for VC6, which lets the Ninja
+# generator track header dependencies with deps = msvc.
+set(CMAKE_CL_SHOWINCLUDES_PREFIX "Note: including file: ")
+set(CMAKE_C_CL_SHOWINCLUDES_PREFIX "${CMAKE_CL_SHOWINCLUDES_PREFIX}")
+set(CMAKE_CXX_CL_SHOWINCLUDES_PREFIX "${CMAKE_CL_SHOWINCLUDES_PREFIX}")